@@ -0,0 +1,124 @@
+"""
+Measure the wall-clock time to publish a post of several photos until every
+image is processed: one /api/images/create/ request per image followed by
+the thumbnail worker, against one /api/images/batch/ request rendering the
+images across BATCH_UPLOAD_PROCESSES processes.
+
+Runs against a throwaway test database and media directory:
+
+    python benchmarks/batch_upload.py --images 10 --repeat 3
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+
+def photo(seed, size):
+    """A distinct JPEG per seed, content-addressed storage would otherwise skip rendering repeats."""
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import Image as ImageTool
+
+    gradient = ImageTool.linear_gradient('L')
+    bands = [gradient.rotate(seed * 7 + angle).resize(size) for angle in (0, 90, 180)]
+    img = ImageTool.merge('RGB', bands)
+    content = BytesIO()
+    img.save(content, format='JPEG', quality=90)
+    return SimpleUploadedFile(f'photo{seed}.jpg', content.getvalue(), content_type='image/jpeg')
+
+
+def per_image(client, post, files):
+    from images.models import Image
+    from images.tasks import claim_image, process_image
+
+    for order_id, file in enumerate(files):
+        response = client.post('/api/images/create/', {
+            'post': post.id, 'order_id': order_id, 'image': file, 'tagged_friends': '[]'})
+        assert response.status_code == 201, response.data
+    # What the thumbnail worker then does for each of them
+    for image_id in Image.objects.filter(post=post).values_list('pk', flat=True):
+        if claim_image(image_id):
+            process_image(image_id)
+
+
+def batch(client, post, files):
+    from images.models import Image
+    from images.tasks import claim_image, process_image
+
+    items = [{'order_id': order_id} for order_id in range(len(files))]
+    response = client.post('/api/images/batch/', {'post': post.id, 'images': files, 'items': json.dumps(items)})
+    assert response.status_code == 201, response.data
+    # Without a pool the batch leaves its images to the thumbnail worker
+    for image_id in Image.objects.filter(post=post, processing_status=Image.PENDING).values_list('pk', flat=True):
+        if claim_image(image_id):
+            process_image(image_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=10, help='Photos per post.')
+    parser.add_argument('--size', type=int, nargs=2, default=(4032, 3024), help='Photo width and height.')
+    parser.add_argument('--repeat', type=int, default=3, help='Posts published per case.')
+    parser.add_argument('--processes', type=int, help='Pool size, BATCH_UPLOAD_PROCESSES or the CPU count by default.')
+    args = parser.parse_args()
+
+    import django
+    from django.conf import settings
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+
+    django.setup()
+    settings.MEDIA_ROOT = tempfile.mkdtemp()
+    # Processing is timed explicitly, not left to background threads
+    settings.THUMBNAIL_WORKERS = 0
+    setup_test_environment()
+    databases = setup_databases(verbosity=0, interactive=False)
+    try:
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+        from images.models import Image
+        from posts.models import Post
+
+        user = User.objects.create(username='benchmark')
+        client = APIClient()
+        client.force_authenticate(user)
+        processes = args.processes or settings.BATCH_UPLOAD_PROCESSES or os.cpu_count() or 1
+
+        cases = [
+            ('per image', 0, per_image),
+            ('batch', 0, batch),
+            ('batch', processes, batch),
+        ]
+        seed = 0
+        print(f'{args.images} photos of {args.size[0]}x{args.size[1]}, median of {args.repeat} posts')
+        print(f'{"path":<10} {"processes":>9} {"median s":>9} {"max s":>7}')
+        for name, case_processes, publish in cases:
+            settings.BATCH_UPLOAD_PROCESSES = case_processes
+            if case_processes:
+                # Start the pool outside the measurements, it lives as long as the server
+                batch(client, Post.objects.create(user=user), [photo(-1 - i, (64, 64)) for i in range(2)])
+            timings = []
+            for _ in range(args.repeat):
+                files = []
+                for _ in range(args.images):
+                    files.append(photo(seed, tuple(args.size)))
+                    seed += 1
+                post = Post.objects.create(user=user)
+                started = time.perf_counter()
+                publish(client, post, files)
+                timings.append(time.perf_counter() - started)
+                assert not Image.objects.filter(post=post).exclude(processing_status=Image.READY).exists()
+            print(f'{name:<10} {case_processes:>9} {statistics.median(timings):>9.2f} {max(timings):>7.2f}')
+    finally:
+        teardown_databases(databases, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Measure the latency of caption-only Image saves and audience-only UserProfile
+saves, before (the original save methods, which re-decoded and re-thumbnailed
+the source file on every save) and after change-aware reprocessing.
+
+Runs against a throwaway test database and media directory:
+
+    python benchmarks/saves.py --repeat 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+
+def legacy_image_save(image):
+    """The original Image.save: thumbnail the full image, then save every field."""
+    from django.core.files.uploadedfile import InMemoryUploadedFile
+    from PIL import Image as ImageTool
+
+    output_thumb = BytesIO()
+    img = ImageTool.open(image.image)
+    img_name = image.image.name.split('.')[0]
+    aspect_ratio = img.width / img.height
+    if aspect_ratio > 1.8:
+        img.thumbnail((9999, 400), resample=ImageTool.LANCZOS)
+    if aspect_ratio > 1.2 and aspect_ratio <= 1.8:
+        img.thumbnail((750, 9999), resample=ImageTool.LANCZOS)
+    if aspect_ratio <= 1.2 and aspect_ratio >= 0.8:
+        img.thumbnail((9999, 400), resample=ImageTool.LANCZOS)
+    if aspect_ratio < 0.8:
+        img.thumbnail((400, 9999), resample=ImageTool.LANCZOS)
+    img.save(output_thumb, format='WEBP')
+    image.image_thumbnail = InMemoryUploadedFile(
+        output_thumb, 'ImageField', f"{img_name}_thumb.webp", 'image/webp', sys.getsizeof(output_thumb), None)
+    super(type(image), image).save()
+
+
+def legacy_profile_save(profile):
+    """The original UserProfile.save: thumbnail the avatar, then save every field."""
+    from django.core.files.uploadedfile import InMemoryUploadedFile
+    from PIL import Image as ImageTool
+
+    output_thumb = BytesIO()
+    img = ImageTool.open(profile.avatar)
+    img_name = profile.avatar.name.split('.')[0]
+    if img.height > 100 or img.width > 100:
+        img.thumbnail((100, 100))
+        img.save(output_thumb, format='PNG', quality=90)
+    profile.avatar_thumbnail = InMemoryUploadedFile(
+        output_thumb, 'ImageField', f"{img_name}_thumb.jpg", 'image/jpeg', sys.getsizeof(output_thumb), None)
+    super(type(profile), profile).save()
+
+
+def photo(size):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import Image as ImageTool
+
+    gradient = ImageTool.linear_gradient('L')
+    img = ImageTool.merge('RGB', [gradient.rotate(angle).resize(size) for angle in (0, 90, 180)])
+    content = BytesIO()
+    img.save(content, format='JPEG', quality=90)
+    return SimpleUploadedFile('photo.jpg', content.getvalue(), content_type='image/jpeg')
+
+
+def measure(save, instance, edit, repeat):
+    timings = []
+    for index in range(repeat):
+        edit(instance, index)
+        started = time.perf_counter()
+        save(instance)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=30, help='Saves measured per case.')
+    args = parser.parse_args()
+
+    import django
+    from django.conf import settings
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases
+
+    django.setup()
+    settings.MEDIA_ROOT = tempfile.mkdtemp()
+    # Nothing is rendered in the background while measuring
+    settings.THUMBNAIL_WORKERS = 0
+    setup_test_environment()
+    databases = setup_databases(verbosity=0, interactive=False)
+    try:
+        from django.contrib.auth.models import User
+        from images.models import Image
+        from posts.models import Post
+        from profiles.models import UserProfile
+
+        user = User.objects.create(username='benchmark')
+        profile = UserProfile.objects.create(user=user, avatar=photo((2048, 2048)))
+        post = Post.objects.create(user=user)
+        image = Image.objects.create(post=post, user=user, image=photo((5472, 3648)))
+
+        def edit_caption(image, index):
+            image.caption = f'caption {index}'
+
+        def edit_audience(profile, index):
+            profile.default_audience = index % 4
+
+        cases = [
+            ('caption update', 'before', legacy_image_save, Image, image.pk, edit_caption),
+            ('caption update', 'after', Image.save, Image, image.pk, edit_caption),
+            ('profile update', 'before', legacy_profile_save, UserProfile, profile.pk, edit_audience),
+            ('profile update', 'after', UserProfile.save, UserProfile, profile.pk, edit_audience),
+        ]
+        print(f'{"case":<16} {"version":<8} {"median ms":>10} {"max ms":>8}')
+        for case, version, save, model, pk, edit in cases:
+            median, worst = measure(save, model.objects.get(pk=pk), edit, args.repeat)
+            print(f'{case:<16} {version:<8} {median:>10.2f} {worst:>8.2f}')
+    finally:
+        teardown_databases(databases, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Compare the thumbnail engine of images.thumbnails against the original
+Image.save path (full decode, LANCZOS thumbnail, WEBP) on a corpus of photos.
+
+Each engine runs in its own subprocess so peak RSS is measured per engine:
+
+    python benchmarks/thumbnails.py --corpus ~/photos
+    python benchmarks/thumbnails.py --generate 20     # synthetic 20 MP JPEGs
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+ENGINES = ('legacy', 'fast')
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def legacy_thumbnail(path):
+    """The thumbnail code Image.save ran in the request before images.thumbnails."""
+    from PIL import Image as ImageTool
+
+    output_size_long_horizontal = (9999, 400)
+    output_size_horizontal = (750, 9999)
+    output_size_square = (9999, 400)
+    output_size_vertical = (400, 9999)
+    output_thumb = BytesIO()
+    img = ImageTool.open(path)
+    aspect_ratio = img.width / img.height
+    if aspect_ratio > 1.8:
+        img.thumbnail(output_size_long_horizontal, resample=ImageTool.LANCZOS)
+    if aspect_ratio > 1.2 and aspect_ratio <= 1.8:
+        img.thumbnail(output_size_horizontal, resample=ImageTool.LANCZOS)
+    if aspect_ratio <= 1.2 and aspect_ratio >= 0.8:
+        img.thumbnail(output_size_square, resample=ImageTool.LANCZOS)
+    if aspect_ratio < 0.8:
+        img.thumbnail(output_size_vertical, resample=ImageTool.LANCZOS)
+    img.save(output_thumb, format='WEBP')
+    return output_thumb.getvalue()
+
+
+def fast_thumbnail(path):
+    from images.thumbnails import render_thumbnail
+
+    with open(path, 'rb') as file:
+        thumbnail, width, height = render_thumbnail(file)
+    return thumbnail.read()
+
+
+def generate_corpus(directory, count):
+    """
+    Photo-like 5472x3648 (20 MP) JPEGs of a few MB each, gradients with sensor
+    grain, every other one rotated through EXIF.
+    """
+    from PIL import Image as ImageTool
+
+    size = (5472, 3648)
+    gradient = ImageTool.linear_gradient('L')
+    paths = []
+    for index in range(count):
+        base = ImageTool.merge('RGB', [
+            gradient.rotate(index * 30 + angle).resize(size) for angle in (0, 90, 180)])
+        grain = ImageTool.merge('RGB', [ImageTool.effect_noise(size, 24)] * 3)
+        img = ImageTool.blend(base, grain, 0.2)
+        exif = img.getexif()
+        if index % 2:
+            exif[0x0112] = 6
+        path = Path(directory) / f'photo_{index:03}.jpg'
+        img.save(path, format='JPEG', quality=90, exif=exif)
+        paths.append(path)
+    return paths
+
+
+def run_worker(engine, paths, repeat):
+    import django
+    django.setup()
+
+    render = legacy_thumbnail if engine == 'legacy' else fast_thumbnail
+    output_bytes = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            output_bytes += len(render(path))
+    elapsed = time.perf_counter() - started
+    print(f'{elapsed:.4f} {peak_rss_mb():.1f} {output_bytes}')
+
+
+def peak_rss_mb():
+    # ru_maxrss survives fork and exec on Linux, so it would include the parent's
+    # peak; VmHWM belongs to this process image only
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', type=Path, help='Directory of photos to thumbnail.')
+    parser.add_argument('--generate', type=int, default=10, help='Synthetic photos to generate without --corpus.')
+    parser.add_argument('--repeat', type=int, default=1, help='Passes over the corpus per engine.')
+    parser.add_argument('--worker', choices=ENGINES, help=argparse.SUPPRESS)
+    parser.add_argument('paths', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.paths, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.corpus:
+            paths = sorted(p for p in args.corpus.iterdir() if p.suffix.lower() in EXTENSIONS)
+        else:
+            print(f'Generating {args.generate} synthetic 20 MP photos...')
+            paths = generate_corpus(directory, args.generate)
+        images = len(paths) * args.repeat
+
+        print(f'{"engine":<8} {"images/s":>9} {"ms/image":>9} {"peak RSS MB":>12} {"output KB":>10}')
+        for engine in ENGINES:
+            result = subprocess.run(
+                [sys.executable, __file__, '--worker', engine, '--repeat', str(args.repeat), *map(str, paths)],
+                check=True, capture_output=True, text=True,
+            )
+            elapsed, peak_rss, output_bytes = result.stdout.split()
+            elapsed = float(elapsed)
+            print(f'{engine:<8} {images / elapsed:>9.2f} {elapsed / images * 1000:>9.1f} '
+                  f'{float(peak_rss):>12.1f} {int(output_bytes) / 1024:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
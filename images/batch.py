@@ -0,0 +1,156 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from posts.layout import schedule_post_layout
+from .models import Image, ImageVariant, TaggedFriend
+from .storage import content_storage
+from .tasks import enqueue_thumbnail, reuse_processed_image
+from .variants import render_stored_image
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked, the parent runs the thumbnail worker threads
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.BATCH_UPLOAD_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def render_all(paths):
+    """
+    Render the stored images at ``paths`` across the BATCH_UPLOAD_PROCESSES
+    processes, with None in place of a failed one.
+    """
+    futures = [_get_pool().submit(render_stored_image, path) for path in paths]
+    rendered = []
+    for path, future in zip(paths, futures):
+        try:
+            rendered.append(future.result())
+        except Exception:
+            logger.exception('Batch rendering failed for %s', path)
+            rendered.append(None)
+    return rendered
+
+
+def store_renditions(rendered, references):
+    """
+    Save a rendered thumbnail and its variants, returning their stored names in
+    place of the bytes. Each stored name is appended to ``references``.
+    """
+    size, (thumbnail_name, thumbnail, width, height), variants, placeholder = rendered
+    thumbnail_field = Image.image_thumbnail.field
+    variant_field = ImageVariant.file.field
+
+    def save(field, name, content):
+        references.append(content_storage.save(field.generate_filename(None, name), ContentFile(content)))
+        return references[-1]
+
+    return (
+        size,
+        (save(thumbnail_field, thumbnail_name, thumbnail), width, height),
+        [(format, variant_width, variant_height, save(variant_field, name, content))
+         for format, variant_width, variant_height, name, content in variants],
+        placeholder,
+    )
+
+
+def create_images(post, user, files, items):
+    """
+    Add the images of ``files`` to ``post``, ``items`` holding the caption,
+    order_id and tagged_friends of each. Originals are stored first, the ones
+    no earlier upload processed are rendered in parallel when a pool is
+    configured (BATCH_UPLOAD_PROCESSES) and left pending for the thumbnail
+    workers otherwise, then the Image, TaggedFriend and ImageVariant rows are
+    inserted in one transaction. The stored files are released again if the
+    rows are not created.
+    """
+    references = []
+    try:
+        return _create_images(post, user, files, items, references)
+    except BaseException:
+        # No row holds the originals and renditions stored so far
+        for name in references:
+            content_storage.delete(name)
+        raise
+
+
+def _create_images(post, user, files, items, references):
+    image_field = Image.image.field
+    names = []
+    for file in files:
+        names.append(content_storage.save(image_field.generate_filename(None, file.name), file))
+        references.append(names[-1])
+
+    processed = set(Image.objects.filter(image__in=names, processing_status=Image.READY)
+                    .exclude(image_thumbnail='').exclude(image_thumbnail__isnull=True)
+                    .values_list('image', flat=True))
+    # Stored once per distinct file, a file repeated in the batch is rendered once.
+    # Without a pool they are not rendered in the request but queued below
+    to_render = []
+    if settings.BATCH_UPLOAD_PROCESSES > 0:
+        to_render = [name for name in dict.fromkeys(names) if name not in processed]
+    renditions = {}
+    for name, rendered in zip(to_render, render_all([content_storage.path(name) for name in to_render])):
+        if rendered is not None:
+            renditions[name] = store_renditions(rendered, references)
+
+    images, used = [], set()
+    for index, (name, item) in enumerate(zip(names, items)):
+        fields = {'processing_status': Image.PENDING}
+        if name in renditions:
+            (width, height), thumbnail, variants, (placeholder, dominant_color) = renditions[name]
+            # Known sizes keep the ImageFields from reopening the files
+            fields = {
+                'image_width': width, 'image_height': height, 'image_thumbnail': thumbnail[0],
+                'thumbnail_width': thumbnail[1], 'thumbnail_height': thumbnail[2],
+                'placeholder': placeholder, 'dominant_color': dominant_color, 'processing_status': Image.READY,
+            }
+            if name in used:
+                # Every field holding a content-addressed file counts as a reference
+                for rendition in [thumbnail[0]] + [variant[3] for variant in variants]:
+                    content_storage.retain(rendition)
+                    references.append(rendition)
+            used.add(name)
+        images.append(Image(
+            post=post, user=user, image=name, caption=item.get('caption', ''),
+            order_id=item.get('order_id', index), **fields))
+
+    image_type = ContentType.objects.get_for_model(Image)
+    with transaction.atomic():
+        # bulk_create skips Image.save, the images are rendered or queued below instead
+        Image.objects.bulk_create(images)
+        TaggedFriend.objects.bulk_create([
+            TaggedFriend(image=image, user_id=tagged_friend['user'],
+                         top=tagged_friend['top'], left=tagged_friend['left'])
+            for image, item in zip(images, items)
+            for tagged_friend in item.get('tagged_friends', [])
+        ])
+        ImageVariant.objects.bulk_create([
+            ImageVariant(content_type=image_type, object_id=image.pk, field='image', format=format,
+                         width=width, height=height, file=variant_name)
+            for image in images if image.processing_status == Image.READY
+            for format, width, height, variant_name in renditions[image.image.name][2]
+        ])
+        for image in images:
+            # Duplicates of processed files share their renditions, the others go to the workers.
+            # The references they take are counted in this transaction and roll back with it,
+            # unlike the files stored before it, which the caller releases
+            if image.processing_status == Image.PENDING and not reuse_processed_image(image):
+                enqueue_thumbnail(image.pk)
+        # bulk_create sends no post_save
+        schedule_post_layout(post.pk)
+    return images
@@ -0,0 +1,32 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from images.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Delete upload sessions untouched for CHUNKED_UPLOAD_EXPIRY_HOURS and their temporary files.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=settings.CHUNKED_UPLOAD_EXPIRY_HOURS)
+        expired = 0
+        for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+            session.delete()
+            expired += 1
+
+        # Temporary files whose session row is gone
+        orphaned = 0
+        if os.path.isdir(settings.CHUNKED_UPLOAD_DIR):
+            session_ids = {str(pk) for pk in UploadSession.objects.values_list('pk', flat=True)}
+            for entry in os.scandir(settings.CHUNKED_UPLOAD_DIR):
+                session_id = entry.name.removesuffix('.part')
+                if entry.is_file() and session_id not in session_ids \
+                        and entry.stat().st_mtime < cutoff.timestamp():
+                    os.remove(entry.path)
+                    orphaned += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {expired} expired session(s) and {orphaned} orphaned file(s)'))
@@ -0,0 +1,83 @@
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+
+from django.db.models import Exists, OuterRef, Q
+
+from images.models import Image, ImageVariant
+from images.tasks import claim_image, process_image, process_profile
+from profiles.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the thumbnails and variants of pending images, the out-of-process '
+        'worker of the thumbnail queue.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch', type=float, metavar='SECONDS',
+            help='Keep polling for pending images every SECONDS instead of exiting once drained.')
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Queue images whose thumbnail failed again before starting.')
+        parser.add_argument(
+            '--reset-stalled', action='store_true',
+            help='Queue images left processing by a worker that died. '
+                 'Only use while no other worker is running.')
+        parser.add_argument(
+            '--missing-variants', action='store_true',
+            help='Queue ready images that have no variants or placeholder yet, such as images '
+                 'uploaded before those existed.')
+        parser.add_argument(
+            '--profiles', action='store_true',
+            help='Also render the variants of profile avatars and covers that have none.')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            Image.objects.filter(processing_status=Image.FAILED).update(processing_status=Image.PENDING)
+        if options['reset_stalled']:
+            Image.objects.filter(processing_status=Image.PROCESSING).update(processing_status=Image.PENDING)
+        if options['missing_variants']:
+            Image.objects.filter(processing_status=Image.READY).exclude(image='').filter(
+                ~Exists(variants_of(Image, 'image')) | Q(placeholder=''),
+            ).update(processing_status=Image.PENDING)
+        if options['profiles']:
+            self.process_profiles()
+
+        while True:
+            processed = self.drain()
+            if processed:
+                self.stdout.write(self.style.SUCCESS(f'Processed {processed} image(s)'))
+            if options['watch'] is None:
+                break
+            time.sleep(options['watch'])
+
+    def drain(self):
+        processed = 0
+        while True:
+            image_ids = list(Image.objects.filter(processing_status=Image.PENDING)
+                             .order_by('pk').values_list('pk', flat=True)[:100])
+            if not image_ids:
+                return processed
+            for image_id in image_ids:
+                if claim_image(image_id):
+                    process_image(image_id)
+                    processed += 1
+
+    def process_profiles(self):
+        processed = 0
+        for field in ('avatar', 'cover'):
+            profiles = UserProfile.objects.exclude(Q(**{field: ''}) | Q(**{f'{field}__isnull': True})).exclude(
+                Exists(variants_of(UserProfile, field))).values_list('pk', flat=True)
+            for profile_id in profiles.iterator():
+                process_profile(profile_id, [field])
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} profile image(s)'))
+
+
+def variants_of(model, field):
+    return ImageVariant.objects.filter(
+        content_type=ContentType.objects.get_for_model(model), object_id=OuterRef('pk'), field=field)
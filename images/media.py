@@ -0,0 +1,176 @@
+import mimetypes
+import os
+import re
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe
+
+from profiles.models import UserProfile
+from .models import Image, ImageVariant
+from .queries import visible_images_filter
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Bytes read per step when a range is streamed by Python
+BLOCK_SIZE = 256 * 1024
+# Content-addressed names never change content, other files may be replaced
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    The inclusive (start, end) of a single-range ``Range`` header, or None to
+    serve the whole file: multiple ranges and unknown units are answered in
+    full, which RFC 9110 allows.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range, the last ``end`` bytes
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def media_etag(storage, name, stat):
+    """A strong ETag, the sha256 of content-addressed files and the size and mtime of others."""
+    if storage.is_content_name(name):
+        return '"%s"' % os.path.splitext(os.path.basename(name))[0]
+    return '"%x-%x"' % (stat.st_size, int(stat.st_mtime))
+
+
+class RangeFile:
+    """Reads at most ``length`` bytes of ``file`` from ``start``, without fileno so servers do not sendfile past it."""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def media_signature(name, viewer_id, expires):
+    return salted_hmac('images.media', f'{name}:{viewer_id}:{expires}', algorithm='sha256').hexdigest()
+
+
+def sign_media_url(url, name, viewer_id):
+    """
+    ``url`` of the stored file ``name`` with a signature letting requests
+    without the API's Authorization header, such as an <img> or <video>
+    source, fetch it as ``viewer_id``. Unchanged for anonymous viewers.
+    """
+    if viewer_id is None:
+        return url
+    period = settings.MEDIA_URL_SIGNATURE_PERIOD
+    expires = (int(time.time()) // period + 2) * period
+    return url + '?' + urlencode({
+        'viewer': viewer_id, 'expires': expires, 'signature': media_signature(name, viewer_id, expires)})
+
+
+def signed_viewer_id(request, name):
+    """The viewer a signed media URL of ``name`` was issued to, None when unsigned, forged or expired."""
+    viewer_id, expires = request.GET.get('viewer', ''), request.GET.get('expires', '')
+    if not viewer_id.isdigit() or not expires.isdigit() or int(expires) < time.time():
+        return None
+    if not constant_time_compare(request.GET.get('signature', ''), media_signature(name, viewer_id, expires)):
+        return None
+    return int(viewer_id)
+
+
+def media_visible(name, viewer_id):
+    """
+    Whether ``viewer_id`` (None when anonymous) may fetch the stored file
+    ``name``. Profile pictures are public, image files and renditions follow
+    the audience of the post of any image holding them, the owner always sees
+    their own. Files nothing references are never served.
+    """
+    profile_type = ContentType.objects.get_for_model(UserProfile)
+    if UserProfile.objects.filter(Q(avatar=name) | Q(cover=name) | Q(avatar_thumbnail=name)).exists() \
+            or ImageVariant.objects.filter(content_type=profile_type, file=name).exists():
+        return True
+
+    image_type = ContentType.objects.get_for_model(Image)
+    variant_owners = ImageVariant.objects.filter(content_type=image_type, file=name).values('object_id')
+    images = Image.objects.filter(
+        Q(image=name) | Q(image_thumbnail=name) | Q(video=name) | Q(pk__in=variant_owners))
+    return images.filter(visible_images_filter(viewer_id)).exists()
+
+
+def serve_media(request, storage, name):
+    """
+    Answer a GET or HEAD for the stored file ``name``, honouring Range,
+    If-Range and If-None-Match. Whole files go through FileResponse, which WSGI
+    servers send zero-copy; with MEDIA_ACCEL_MODE the front proxy sends it.
+    """
+    path = storage.path(name)
+    stat = os.stat(path)
+    etag = media_etag(storage, name, stat)
+    last_modified = http_date(stat.st_mtime)
+    immutable = storage.is_content_name(name)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Accept-Ranges': 'bytes',
+        # Access is checked per viewer, shared caches must not keep a copy
+        'Cache-Control': f'private, max-age={IMMUTABLE_MAX_AGE}, immutable' if immutable else 'private, no-cache',
+    }
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        return HttpResponseNotModified(headers=headers)
+
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    if settings.MEDIA_ACCEL_MODE == 'x-accel-redirect':
+        # nginx serves the internal location, ranges included
+        return HttpResponse(content_type=content_type, headers={
+            **headers, 'X-Accel-Redirect': settings.MEDIA_ACCEL_PREFIX + name})
+    if settings.MEDIA_ACCEL_MODE == 'x-sendfile':
+        return HttpResponse(content_type=content_type, headers={**headers, 'X-Sendfile': path})
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag or parse_http_date_safe(if_range) == int(stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+        except RangeNotSatisfiable:
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{stat.st_size}'})
+
+    if byte_range is None:
+        return FileResponse(open(path, 'rb'), filename=os.path.basename(name), headers=headers)
+
+    start, end = byte_range
+    response = FileResponse(
+        RangeFile(open(path, 'rb'), start, end - start + 1), status=206, headers=headers,
+        filename=os.path.basename(name))
+    response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Content-Length'] = str(end - start + 1)
+    return response
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:40
+
+from django.db import migrations, models
+
+
+def queue_missing_thumbnails(apps, schema_editor):
+    Image = apps.get_model('images', 'Image')
+    Image.objects.exclude(image='').exclude(image__isnull=True).filter(
+        models.Q(image_thumbnail='') | models.Q(image_thumbnail__isnull=True),
+    ).update(processing_status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0005_alter_image_order_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='ready', max_length=10),
+        ),
+        migrations.RunPython(queue_missing_thumbnails, migrations.RunPython.noop),
+    ]
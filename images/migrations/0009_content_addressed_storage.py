@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:52
+
+import images.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0008_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('references', models.IntegerField(default=1)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(blank=True, height_field='image_height', max_length=255, null=True, storage=images.storage.get_content_storage, upload_to='images', width_field='image_width'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, height_field='thumbnail_height', null=True, storage=images.storage.get_content_storage, upload_to='images_tumbnails', verbose_name='image_thumbnail', width_field='thumbnail_width'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='video',
+            field=models.FileField(blank=True, null=True, storage=images.storage.get_content_storage, upload_to='video'),
+        ),
+        migrations.AlterField(
+            model_name='imagevariant',
+            name='file',
+            field=models.FileField(max_length=255, storage=images.storage.get_content_storage, upload_to='image_variants'),
+        ),
+    ]
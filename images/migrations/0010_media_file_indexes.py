@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:53
+
+import images.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0009_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, height_field='image_height', max_length=255, null=True, storage=images.storage.get_content_storage, upload_to='images', width_field='image_width'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, db_index=True, height_field='thumbnail_height', null=True, storage=images.storage.get_content_storage, upload_to='images_tumbnails', verbose_name='image_thumbnail', width_field='thumbnail_width'),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='video',
+            field=models.FileField(blank=True, db_index=True, null=True, storage=images.storage.get_content_storage, upload_to='video'),
+        ),
+        migrations.AlterField(
+            model_name='imagevariant',
+            name='file',
+            field=models.FileField(db_index=True, max_length=255, storage=images.storage.get_content_storage, upload_to='image_variants'),
+        ),
+    ]
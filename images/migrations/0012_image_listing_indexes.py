@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0011_image_placeholder'),
+        ('posts', '0011_timelineentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'id'], name='image_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['post', 'order_id'], name='image_post_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('video__gt', '')), fields=['user', 'id'], name='image_user_video_idx'),
+        ),
+    ]
@@ -1,22 +1,38 @@
-from io import BytesIO
-from PIL import Image as ImageTool
+import os
+import uuid
+
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.conf import settings
-from django.core.files.uploadedfile import InMemoryUploadedFile
-import sys
 
 from posts.models import Post
+from .storage import get_content_storage
+from .tasks import enqueue_thumbnail, reuse_processed_image
+from .tracking import FileChangeTrackingModel
 
 User = settings.AUTH_USER_MODEL
 
 
-class Image(models.Model):
+class Image(FileChangeTrackingModel):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    PROCESSING_STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
     caption = models.CharField(
         default='', max_length=500, null=True, blank=True)
     image = models.ImageField(
-        upload_to='images', blank=True, null=True, max_length=255, width_field='image_width', height_field='image_height')
+        upload_to='images', blank=True, null=True, max_length=255, width_field='image_width', height_field='image_height',
+        storage=get_content_storage, db_index=True)
     image_thumbnail = models.ImageField(upload_to='images_tumbnails', width_field='thumbnail_width', height_field='thumbnail_height', blank=True, null=True,
-                                        verbose_name='image_thumbnail')
+                                        verbose_name='image_thumbnail', storage=get_content_storage, db_index=True)
     user = models.ForeignKey(User, null=True,
                              on_delete=models.CASCADE)
     post = models.ForeignKey(Post, null=True,
@@ -25,8 +41,26 @@ class Image(models.Model):
     image_height = models.IntegerField(default=0)
     thumbnail_width = models.IntegerField(default=0)
     thumbnail_height = models.IntegerField(default=0)
-    video = models.FileField(upload_to='video', blank=True, null=True)
+    video = models.FileField(upload_to='video', blank=True, null=True, storage=get_content_storage, db_index=True)
     order_id = models.IntegerField(default=-1)
+    processing_status = models.CharField(
+        max_length=10, choices=PROCESSING_STATUS_CHOICES, default=READY, db_index=True)
+    # Inline low-quality placeholder (data URI) and '#rrggbb', shown until the thumbnail loads
+    placeholder = models.TextField(blank=True, default='', editable=False)
+    dominant_color = models.CharField(max_length=7, blank=True, default='', editable=False)
+    variants = GenericRelation('ImageVariant')
+
+    class Meta:
+        indexes = [
+            # Keyset-paginated listings of images.queries.scoped_image_queryset
+            models.Index(fields=['user', 'id'], name='image_user_idx'),
+            models.Index(fields=['post', 'order_id'], name='image_post_order_idx'),
+            models.Index(fields=['user', 'id'], condition=models.Q(video__gt=''), name='image_user_video_idx'),
+        ]
+
+    tracked_file_fields = ('image',)
+    worker_fields = ('image_thumbnail', 'thumbnail_width', 'thumbnail_height', 'placeholder', 'dominant_color',
+                     'processing_status')
 
     @property
     def aspect_ratio(self):
@@ -37,31 +71,20 @@ class Image(models.Model):
         return bool(self.video)
 
     def save(self, **kwargs):
-        if self.image:
-            output_size_long_horizontal = (9999, 400)
-            output_size_horizontal = (750, 9999)
-            output_size_square = (9999, 400)
-            output_size_vertical = (400, 9999)
-            output_thumb = BytesIO()
-            img = ImageTool.open(self.image)
-            img_name = self.image.name.split('.')[0]
-            aspect_ratio = img.width / img.height
-            if aspect_ratio > 1.8:
-                img.thumbnail(output_size_long_horizontal,
-                              resample=ImageTool.LANCZOS)
-            if aspect_ratio > 1.2 and aspect_ratio <= 1.8:
-                img.thumbnail(output_size_horizontal,
-                              resample=ImageTool.LANCZOS)
-            if aspect_ratio <= 1.2 and aspect_ratio >= 0.8:
-                img.thumbnail(output_size_square, resample=ImageTool.LANCZOS)
-            if aspect_ratio < 0.8:
-                img.thumbnail(output_size_vertical, resample=ImageTool.LANCZOS)
-            img.save(output_thumb, format='WEBP')
-
-            self.image_thumbnail = InMemoryUploadedFile(
-                output_thumb, 'ImageField', f"{img_name}_thumb.webp", 'image/webp', sys.getsizeof(output_thumb), None)
-
-        super(Image, self).save()
+        # Caption and tag edits leave the image alone and never reach the workers
+        changed = self.changed_file_fields()
+        queue_thumbnail = 'image' in changed and self.image and not (self._state.adding and self.image_thumbnail)
+        if queue_thumbnail:
+            # Thumbnails are rendered off the request by images.tasks
+            self.processing_status = self.PENDING
+        if 'image' in changed and not self._state.adding:
+            # The old thumbnail is released by django_cleanup with this save, like UserProfile.avatar_thumbnail
+            self.image_thumbnail = None
+            self.thumbnail_width = self.thumbnail_height = 0
+        self.save_tracked(changed, **kwargs)
+        # A file already uploaded and processed for another image is not rendered again
+        if queue_thumbnail and not reuse_processed_image(self):
+            enqueue_thumbnail(self.pk)
 
 
 class TaggedFriend(models.Model):
@@ -73,3 +96,72 @@ class TaggedFriend(models.Model):
 
     class Meta:
         unique_together = ('user', 'image',)
+
+
+class ImageVariant(models.Model):
+    """
+    A resized rendition of an image field of any model, rendered by
+    images.tasks in every IMAGE_VARIANT_FORMATS format per width bucket.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    field = models.CharField(max_length=32)
+    format = models.CharField(max_length=10)
+    width = models.IntegerField()
+    height = models.IntegerField()
+    file = models.FileField(upload_to='image_variants', max_length=255, storage=get_content_storage, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id', 'field'], name='variant_owner_idx'),
+        ]
+
+
+class ContentBlob(models.Model):
+    """A file stored once by images.storage.ContentAddressedStorage, with the number of file fields holding it."""
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    references = models.IntegerField(default=1)
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload, written chunk by chunk at increasing offsets to a
+    temporary file under CHUNKED_UPLOAD_DIR, then finalized into an Image.
+    """
+    IMAGE = 'image'
+    VIDEO = 'video'
+    KIND_CHOICES = [
+        (IMAGE, 'Image'),
+        (VIDEO, 'Video'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    image = models.ForeignKey(Image, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def temp_path(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{self.id}.part')
+
+    @property
+    def is_complete(self):
+        return self.offset == self.size
+
+    @property
+    def is_finalized(self):
+        return bool(self.sha256)
+
+    def delete(self, *args, **kwargs):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        return super().delete(*args, **kwargs)
@@ -0,0 +1,29 @@
+import base64
+
+from PIL import Image as ImageTool
+
+from .thumbnails import encode, fit_size, resize
+
+
+# Longest side of the inline placeholder, clients stretch and blur it
+PLACEHOLDER_BOX = (20, 20)
+PLACEHOLDER_QUALITY = 40
+# Colors the image is quantized to when picking the dominant one
+DOMINANT_COLORS = 5
+
+
+def render_placeholder(img):
+    """
+    A tiny WEBP of an upright decoded image as a data URI, small enough to
+    inline in list responses, and its dominant color as ``#rrggbb``.
+    """
+    small = resize(img, fit_size(img.width, img.height, PLACEHOLDER_BOX))
+    content = encode(small.convert('RGB'), 'WEBP', 'placeholder.webp', quality=PLACEHOLDER_QUALITY)
+    data_uri = 'data:image/webp;base64,' + base64.b64encode(content.read()).decode('ascii')
+
+    # The most common color of a median-cut palette, not the average which
+    # muddies two-toned images
+    palette_image = small.convert('RGB').quantize(colors=DOMINANT_COLORS, method=ImageTool.Quantize.MEDIANCUT)
+    count, index = max(palette_image.getcolors())
+    red, green, blue = palette_image.getpalette()[index * 3:index * 3 + 3]
+    return data_uri, f'#{red:02x}{green:02x}{blue:02x}'
@@ -0,0 +1,56 @@
+from django.db.models import Exists, OuterRef, Prefetch, Q
+
+from posts.models import Post
+from posts.visibility import visibility_filter
+from .models import Image, TaggedFriend
+
+
+def tagged_friend_list_queryset(queryset=None):
+    """TaggedFriend rows with everything TaggedFriendsListSerializer renders loaded."""
+    if queryset is None:
+        queryset = TaggedFriend.objects.all()
+    return queryset.select_related('user__userprofile')
+
+
+def image_list_queryset(queryset=None):
+    """Images with everything ImageListSerializer renders loaded in three queries."""
+    if queryset is None:
+        queryset = Image.objects.all()
+    return queryset.select_related('user__userprofile').prefetch_related(
+        Prefetch('tagged_friends', queryset=tagged_friend_list_queryset()),
+        'variants',
+    )
+
+
+def visible_images_filter(viewer_id):
+    """A filter on Image matching the images of posts ``viewer_id`` may see, and their own."""
+    # Correlated, so only the posts of the scanned images are checked
+    audience = Exists(Post.objects.filter(visibility_filter(viewer_id), pk=OuterRef('post_id')))
+    if viewer_id is not None:
+        audience |= Q(user_id=viewer_id)
+    return audience
+
+
+def scoped_image_queryset(queryset, post_id=None, user_id=None, filter_by=None):
+    """
+    Narrow ``queryset`` to one listing mode, ordered for keyset pagination
+    along the index that serves it:
+
+    - ``post_id``: the images of a post in display order, on (post, order_id)
+    - ``user_id``: the images they uploaded, newest first, on (user, id);
+      ``filter_by='tagged'`` the images they are tagged in, on
+      TaggedFriend(user, image), and ``filter_by='videos'`` their videos,
+      on the partial (user, id) index of images with a video
+    """
+    if post_id is not None:
+        return queryset.filter(post_id=post_id).order_by('order_id', 'id')
+    if user_id is not None:
+        if filter_by == 'tagged':
+            queryset = queryset.filter(pk__in=TaggedFriend.objects.filter(user_id=user_id).values('image_id'))
+        elif filter_by == 'videos':
+            queryset = queryset.filter(user_id=user_id, video__gt='')
+        else:
+            queryset = queryset.filter(user_id=user_id)
+    elif filter_by == 'videos':
+        queryset = queryset.filter(video__gt='')
+    return queryset.order_by('-id')
@@ -1,8 +1,12 @@
 import json
+import os
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
 
-from .models import Image, TaggedFriend
+from .media import sign_media_url
+from .models import Image, TaggedFriend, UploadSession
+from .variants import srcset
 from posts.models import Post
 from profiles.serializers import UserPublicSerializer
 
@@ -55,7 +59,11 @@ class ImageCreateSerializer(serializers.ModelSerializer):
             'post',
             'image',
             'video',
-            'tagged_friends'
+            'tagged_friends',
+            'processing_status'
+        ]
+        read_only_fields = [
+            'processing_status'
         ]
 
     def create(self, validated_data):
@@ -68,6 +76,42 @@ class ImageCreateSerializer(serializers.ModelSerializer):
         return image
 
 
+class ImageBatchCreateSerializer(serializers.Serializer):
+    """
+    Several images of one post: ``images`` are the files and ``items`` a JSON
+    list, empty or one object per file, of their caption, order_id and tagged_friends.
+    """
+    post = serializers.PrimaryKeyRelatedField(
+        queryset=Post.objects.all(), many=False)
+    images = serializers.ListField(
+        child=serializers.ImageField(), allow_empty=False, max_length=settings.BATCH_UPLOAD_MAX_FILES)
+    items = serializers.CharField(required=False, default='[]')
+
+    def validate_post(self, value):
+        if value.user_id != self.context['request'].user.id:
+            raise serializers.ValidationError('You can only add images to your own posts.')
+        return value
+
+    def validate(self, attrs):
+        try:
+            items = json.loads(attrs['items'])
+        except ValueError:
+            raise serializers.ValidationError({'items': 'Not valid JSON.'})
+        count = len(attrs['images'])
+        if not isinstance(items, list) or len(items) not in (0, count) \
+                or not all(isinstance(item, dict) for item in items):
+            raise serializers.ValidationError({'items': f'Expected a list of {count} objects.'})
+        for item in items:
+            tagged_friends = item.get('tagged_friends', [])
+            if not isinstance(tagged_friends, list) or not all(
+                    isinstance(tagged_friend, dict) and {'user', 'top', 'left'} <= tagged_friend.keys()
+                    for tagged_friend in tagged_friends):
+                raise serializers.ValidationError(
+                    {'items': 'tagged_friends must be a list of objects with user, top and left.'})
+        attrs['items'] = items or [{} for _ in range(count)]
+        return attrs
+
+
 class ImageUpdateSerializer(serializers.ModelSerializer):
     tagged_friends = serializers.CharField(required=False)
 
@@ -91,6 +135,7 @@ class ImageUpdateSerializer(serializers.ModelSerializer):
 class ImageListSerializer(serializers.ModelSerializer):
     user = UserPublicSerializer()
     tagged_friends = TaggedFriendsListSerializer(many=True)
+    variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Image
@@ -106,5 +151,83 @@ class ImageListSerializer(serializers.ModelSerializer):
             'thumbnail_height',
             'video',
             'is_video_file',
-            'tagged_friends'
+            'tagged_friends',
+            'processing_status',
+            'placeholder',
+            'dominant_color',
+            'variants'
+        ]
+
+    def viewer_id(self):
+        request = self.context.get('request')
+        return request.user.id if request is not None and request.user.is_authenticated else None
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Fetched by <img> and <video> elements, see images.media.sign_media_url
+        for field in ('image', 'image_thumbnail', 'video'):
+            if data[field]:
+                data[field] = sign_media_url(data[field], getattr(instance, field).name, self.viewer_id())
+        return data
+
+    def get_variants(self, obj):
+        return srcset(obj, 'image', self.context.get('request'), viewer_id=self.viewer_id())
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id',
+            'kind',
+            'filename',
+            'size',
+            'offset',
+            'sha256',
+            'image',
+        ]
+        read_only_fields = [
+            'id',
+            'offset',
+            'sha256',
+            'image',
         ]
+
+    def validate_filename(self, value):
+        value = os.path.basename(value)
+        if not value:
+            raise serializers.ValidationError('A file name is required.')
+        return value
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('The size must be positive.')
+        if value > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Uploads are limited to {settings.CHUNKED_UPLOAD_MAX_SIZE} bytes.')
+        return value
+
+
+class UploadFinalizeSerializer(serializers.Serializer):
+    """Where a complete upload goes: a new image of ``post``, or the existing ``image``."""
+    post = serializers.PrimaryKeyRelatedField(
+        queryset=Post.objects.all(), many=False, required=False)
+    image = serializers.PrimaryKeyRelatedField(
+        queryset=Image.objects.all(), many=False, required=False)
+    order_id = serializers.IntegerField(required=False, default=-1)
+    caption = serializers.CharField(required=False, allow_blank=True, max_length=500, default='')
+    tagged_friends = serializers.CharField(required=False, default='[]')
+    checksum = serializers.CharField(required=False, max_length=64)
+
+    def validate_post(self, value):
+        if value.user_id != self.context['request'].user.id:
+            raise serializers.ValidationError('You can only add images to your own posts.')
+        return value
+
+    def validate(self, attrs):
+        image = attrs.get('image')
+        if image is None and attrs.get('post') is None:
+            raise serializers.ValidationError('Either a post or an image is required.')
+        if image is not None and image.user_id != self.context['request'].user.id:
+            raise serializers.ValidationError({'image': 'You can only upload to your own images.'})
+        return attrs
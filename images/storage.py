@@ -0,0 +1,100 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.functional import LazyObject
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every file once, at ``CONTENT_ADDRESSED_ROOT/ab/cd/<sha256><ext>``,
+    whatever name it was saved under. ``ContentBlob`` rows count the file
+    fields holding each stored name, and ``delete()`` only removes the bytes
+    when the last reference goes, so django_cleanup deleting one reference
+    leaves shared files alone. Names outside the root, stored before, behave
+    as in FileSystemStorage.
+    """
+
+    def content_name(self, digest, extension):
+        return '/'.join([settings.CONTENT_ADDRESSED_ROOT, digest[:2], digest[2:4], f'{digest}{extension}'])
+
+    def is_content_name(self, name):
+        return name.startswith(f'{settings.CONTENT_ADDRESSED_ROOT}/')
+
+    def _save(self, name, content):
+        from .models import ContentBlob
+
+        # Hashed while written to a temporary file next to its destination,
+        # so the file is read once and the final rename is atomic
+        temp_dir = self.path(os.path.join(settings.CONTENT_ADDRESSED_ROOT, 'tmp'))
+        os.makedirs(temp_dir, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=temp_dir)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                    size += len(chunk)
+            name = self.content_name(digest.hexdigest(), os.path.splitext(name)[1].lower())
+            path = self.path(name)
+
+            with transaction.atomic():
+                blob = ContentBlob.objects.select_for_update().filter(name=name).first()
+                if blob is not None and os.path.exists(path):
+                    blob.references = F('references') + 1
+                    blob.save(update_fields=['references'])
+                    return name
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+                if blob is None:
+                    ContentBlob.objects.create(name=name, sha256=digest.hexdigest(), size=size, references=1)
+                else:
+                    # The row outlived its file, its count is recomputed from here
+                    blob.references = 1
+                    blob.save(update_fields=['references'])
+                return name
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def retain(self, name):
+        """Count one more field holding ``name``, False when it is not a stored content name."""
+        from .models import ContentBlob
+        if not self.is_content_name(name):
+            return False
+        return ContentBlob.objects.filter(name=name).update(references=F('references') + 1) == 1
+
+    def delete(self, name):
+        from .models import ContentBlob
+        if not name or not self.is_content_name(name):
+            return super().delete(name)
+        with transaction.atomic():
+            blob = ContentBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.references > 1:
+                blob.references = F('references') - 1
+                blob.save(update_fields=['references'])
+                return
+            if blob is not None:
+                blob.delete()
+            super().delete(name)
+
+
+class DefaultContentAddressedStorage(LazyObject):
+    def _setup(self):
+        self._wrapped = ContentAddressedStorage()
+
+
+content_storage = DefaultContentAddressedStorage()
+
+
+def get_content_storage():
+    """Storage callable for file fields, so migrations reference it instead of a path."""
+    return content_storage
@@ -0,0 +1,238 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from posts.layout import update_post_layout
+from .thumbnails import thumbnail_box
+from .variants import render_variants
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+        return _executor
+
+
+def claim_image(image_id):
+    """Move a pending image to processing, False when another worker got there first."""
+    from .models import Image
+    return Image.objects.filter(pk=image_id, processing_status=Image.PENDING).update(
+        processing_status=Image.PROCESSING) == 1
+
+
+def store_file(field_file, content):
+    """Save ``content`` where ``field_file``'s field uploads to and return the stored name."""
+    return field_file.storage.save(field_file.field.generate_filename(field_file.instance, content.name), content)
+
+
+def store_variants(instance, field, variants):
+    """Replace the stored variants of ``instance``'s ``field``."""
+    from .models import ImageVariant
+    owner = {
+        'content_type': ContentType.objects.get_for_model(instance),
+        'object_id': instance.pk,
+        'field': field,
+    }
+    stored = []
+    for format, width, height, content in variants:
+        variant = ImageVariant(format=format, width=width, height=height, **owner)
+        variant.file = store_file(variant.file, content)
+        stored.append(variant)
+    with transaction.atomic():
+        # Deleted one by one so django_cleanup removes their files
+        for variant in ImageVariant.objects.filter(**owner):
+            variant.delete()
+        ImageVariant.objects.bulk_create(stored)
+
+
+def copy_variants(source, instance, field):
+    """
+    Give ``instance``'s ``field`` the variants of ``source``'s, sharing their
+    files. False when a variant file is not content-addressed and cannot be shared.
+    """
+    from .models import ImageVariant
+    variants = list(ImageVariant.objects.filter(
+        content_type=ContentType.objects.get_for_model(source), object_id=source.pk, field=field))
+    if not all(variant.file.storage.is_content_name(variant.file.name) for variant in variants):
+        return False
+    for variant in variants:
+        variant.file.storage.retain(variant.file.name)
+    with transaction.atomic():
+        for variant in ImageVariant.objects.filter(
+                content_type=ContentType.objects.get_for_model(instance), object_id=instance.pk, field=field):
+            variant.delete()
+        ImageVariant.objects.bulk_create([
+            ImageVariant(content_object=instance, field=field, format=variant.format,
+                         width=variant.width, height=variant.height, file=variant.file.name)
+            for variant in variants
+        ])
+    return True
+
+
+def reuse_processed_image(image):
+    """
+    Give a pending image the thumbnail and variants of a processed image with
+    the same content-addressed file, so a duplicate upload is not decoded again.
+    """
+    from .models import Image
+    storage = image.image.storage
+    if not storage.is_content_name(image.image.name):
+        return False
+    source = (Image.objects.filter(image=image.image.name, processing_status=Image.READY)
+              .exclude(pk=image.pk).exclude(image_thumbnail='').exclude(image_thumbnail__isnull=True).first())
+    if source is None or not storage.retain(source.image_thumbnail.name):
+        return False
+    if not copy_variants(source, image, 'image'):
+        storage.delete(source.image_thumbnail.name)
+        return False
+    image.image_thumbnail = source.image_thumbnail.name
+    image.processing_status = Image.READY
+    Image.objects.filter(pk=image.pk).update(
+        image_thumbnail=source.image_thumbnail.name,
+        thumbnail_width=source.thumbnail_width,
+        thumbnail_height=source.thumbnail_height,
+        placeholder=source.placeholder,
+        dominant_color=source.dominant_color,
+        processing_status=Image.READY,
+    )
+    return True
+
+
+def reuse_processed_profile_image(profile, field):
+    """The profile counterpart of ``reuse_processed_image``, for an avatar or a cover."""
+    from profiles.models import UserProfile
+    field_file = getattr(profile, field)
+    storage = field_file.storage
+    if not storage.is_content_name(field_file.name):
+        return False
+    sources = UserProfile.objects.filter(**{field: field_file.name}).exclude(pk=profile.pk)
+    if field == 'avatar':
+        sources = sources.exclude(avatar_thumbnail='').exclude(avatar_thumbnail__isnull=True)
+    for source in sources.filter(variants__field=field).distinct()[:1]:
+        if field == 'avatar' and not storage.retain(source.avatar_thumbnail.name):
+            return False
+        if not copy_variants(source, profile, field):
+            if field == 'avatar':
+                storage.delete(source.avatar_thumbnail.name)
+            return False
+        if field == 'avatar':
+            UserProfile.objects.filter(pk=profile.pk, avatar=field_file.name).update(
+                avatar_thumbnail=source.avatar_thumbnail.name)
+        return True
+    return False
+
+
+def process_image(image_id):
+    """
+    Render the thumbnail and the variants of a claimed image from one decode
+    and mark it ready, or failed on error.
+    """
+    from .models import Image
+    image = Image.objects.filter(pk=image_id).first()
+    if image is None:
+        return
+    try:
+        with image.image.open('rb') as file:
+            (thumbnail, width, height), variants, (placeholder, dominant_color) = render_variants(
+                file, 'image', thumbnail_box)
+        thumbnail_name = store_file(image.image_thumbnail, thumbnail)
+        store_variants(image, 'image', variants)
+    except Exception:
+        logger.exception('Thumbnail generation failed for image %s', image_id)
+        Image.objects.filter(pk=image_id).update(processing_status=Image.FAILED)
+        return
+    # A plain update, the row may have been edited while the thumbnail rendered.
+    # Only over the thumbnail read above: a new file cleared it and queued a render
+    previous_name = image.image_thumbnail.name or ''
+    unchanged = (Q(image_thumbnail=previous_name) if previous_name
+                 else Q(image_thumbnail='') | Q(image_thumbnail__isnull=True))
+    replaced = Image.objects.filter(unchanged, pk=image_id).update(
+        image_thumbnail=thumbnail_name,
+        thumbnail_width=width,
+        thumbnail_height=height,
+        placeholder=placeholder,
+        dominant_color=dominant_color,
+        processing_status=Image.READY,
+    )
+    storage = image.image_thumbnail.storage
+    if not replaced:
+        storage.delete(thumbnail_name)
+        return
+    if previous_name:
+        # Updates skip django_cleanup, release the thumbnail this one replaced
+        storage.delete(previous_name)
+    # The thumbnail carries the displayed orientation the layout uses
+    update_post_layout(image.post_id)
+
+
+def process_profile(profile_id, fields):
+    """Render the variants of a profile's ``fields``, and the avatar thumbnail with the avatar's."""
+    from profiles.models import UserProfile
+    profile = UserProfile.objects.filter(pk=profile_id).first()
+    if profile is None:
+        return
+    for field in fields:
+        field_file = getattr(profile, field)
+        if not field_file:
+            store_variants(profile, field, [])
+            continue
+        if reuse_processed_profile_image(profile, field):
+            continue
+        box = (lambda width, height: settings.AVATAR_THUMBNAIL_BOX) if field == 'avatar' else None
+        try:
+            with field_file.open('rb') as file:
+                thumbnail, variants, _ = render_variants(file, field, box)
+            store_variants(profile, field, variants)
+        except Exception:
+            logger.exception('Variant generation failed for the %s of profile %s', field, profile_id)
+            continue
+        if thumbnail:
+            # Only if the avatar was not replaced meanwhile
+            UserProfile.objects.filter(pk=profile_id, avatar=field_file.name).update(
+                avatar_thumbnail=store_file(profile.avatar_thumbnail, thumbnail[0]))
+
+
+def _run(task, *args):
+    close_old_connections()
+    try:
+        task(*args)
+    finally:
+        close_old_connections()
+
+
+def _process_claimed_image(image_id):
+    if claim_image(image_id):
+        process_image(image_id)
+
+
+def enqueue_thumbnail(image_id):
+    """
+    Hand a pending image to the in-process thumbnail workers once the current
+    transaction commits. With THUMBNAIL_WORKERS = 0 images stay pending for the
+    process_thumbnails command instead.
+    """
+    if settings.THUMBNAIL_WORKERS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run, _process_claimed_image, image_id))
+
+
+def enqueue_profile_variants(profile_id, fields):
+    """
+    Hand a profile's changed avatar or cover to the thumbnail workers once the
+    current transaction commits. With THUMBNAIL_WORKERS = 0 they are left for
+    process_thumbnails --profiles.
+    """
+    if settings.THUMBNAIL_WORKERS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run, process_profile, profile_id, list(fields)))
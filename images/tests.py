@@ -1,3 +1,516 @@
-from django.test import TestCase
+from io import BytesIO
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image as PILImage
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from profiles.models import UserProfile
+from posts.models import Post
+from posts.visibility import PRIVATE, PUBLIC
+from .batch import create_images
+from .models import ContentBlob, Image, TaggedFriend, UploadSession
+from .storage import content_storage
+from .tasks import claim_image, process_image
+from .thumbnails import render_thumbnail
+from .variants import variant_formats
+
+
+def create_user(username):
+    user = User.objects.create(username=username)
+    UserProfile.objects.create(user=user)
+    return user
+
+
+class ImageQueryBudgetTests(TestCase):
+    """Image listings must cost a fixed number of queries whatever the page size."""
+    # Images, their tagged friends and their variants, keyset pages are not counted
+    IMAGE_LIST_QUERIES = 3
+    # Count and tagged friends
+    TAGGED_FRIENDS_LIST_QUERIES = 2
+
+    def setUp(self):
+        self.client = APIClient()
+        self.author = create_user('author')
+        self.friends = [create_user('friend1'), create_user('friend2'), create_user('friend3')]
+        self.post = Post.objects.create(user=self.author)
+        # Cached per process outside tests, variants are looked up through it
+        ContentType.objects.get_for_model(Image)
+
+    def create_images(self, count):
+        images = []
+        for order_id in range(count):
+            image = Image.objects.create(
+                post=self.post, user=self.author, order_id=order_id, image_width=300, image_height=400)
+            for friend in self.friends:
+                TaggedFriend.objects.create(image=image, user=friend)
+            images.append(image)
+        return images
+
+    def test_image_list_query_count_is_independent_of_page_size(self):
+        self.create_images(1)
+        with self.assertNumQueries(self.IMAGE_LIST_QUERIES):
+            response = self.client.get('/api/images/', {'limit': 10})
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.create_images(9)
+        with self.assertNumQueries(self.IMAGE_LIST_QUERIES):
+            response = self.client.get('/api/images/', {'limit': 10})
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(response.data['results'][0]['tagged_friends']), 3)
+
+    def test_tagged_friends_list_query_count_is_independent_of_tag_count(self):
+        image, = self.create_images(1)
+        with self.assertNumQueries(self.TAGGED_FRIENDS_LIST_QUERIES):
+            response = self.client.get(f'/api/images/tagged-friends/{image.id}/')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIn('profile', response.data['results'][0]['user'])
+
+
+class ImageListingTests(TestCase):
+    """Scoped image listings follow the post audience and page with cursors."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.author = create_user('author')
+        self.friend = create_user('friend')
+        self.public_post = Post.objects.create(user=self.author, audience=PUBLIC)
+        self.private_post = Post.objects.create(user=self.author, audience=PRIVATE)
+
+    def create_image(self, post, order_id=0, video=None, tagged=()):
+        image = Image.objects.create(
+            post=post, user=self.author, order_id=order_id, video=video, image_width=300, image_height=400)
+        for user in tagged:
+            TaggedFriend.objects.create(image=image, user=user)
+        return image
+
+    def list_ids(self, **params):
+        ids, url = [], '/api/images/'
+        while url:
+            response = self.client.get(url, params if url == '/api/images/' else None)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(image['id'] for image in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_listing_modes(self):
+        first = self.create_image(self.public_post, order_id=1, tagged=[self.friend])
+        second = self.create_image(self.public_post, order_id=0)
+        video = self.create_image(self.public_post, order_id=2, video='video/clip.mp4')
+        hidden = self.create_image(self.private_post, tagged=[self.friend])
+
+        self.assertEqual(self.list_ids(post=self.public_post.id, limit=2), [second.id, first.id, video.id])
+        self.assertEqual(self.list_ids(user=self.author.id, limit=2), [video.id, second.id, first.id])
+        self.assertEqual(self.list_ids(user=self.friend.id, filterBy='tagged'), [first.id])
+        self.assertEqual(self.list_ids(user=self.author.id, filterBy='videos'), [video.id])
+
+        # The private post's images only show to their owner
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.list_ids(user=self.friend.id, filterBy='tagged'), [hidden.id, first.id])
+        self.assertEqual(self.list_ids(post=self.private_post.id), [hidden.id])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), THUMBNAIL_WORKERS=0)
+class ThumbnailPipelineTests(TestCase):
+    """Uploads are stored as pending and thumbnailed off the request."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.post = Post.objects.create(user=self.author)
+
+    def upload(self, size):
+        content = BytesIO()
+        PILImage.new('RGB', size, 'red').save(content, format='PNG')
+        return SimpleUploadedFile('photo.png', content.getvalue(), content_type='image/png')
+
+    def test_create_returns_before_the_thumbnail_is_rendered(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.post('/api/images/create/', {
+            'post': self.post.id, 'order_id': 0, 'image': self.upload((1200, 800)), 'tagged_friends': '[]',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['processing_status'], Image.PENDING)
+
+        image = Image.objects.get()
+        self.assertFalse(image.image_thumbnail)
+        listed = self.client.get('/api/images/').data['results'][0]
+        self.assertEqual(listed['processing_status'], Image.PENDING)
+        self.assertIsNone(listed['image_thumbnail'])
+
+    def test_worker_renders_pending_thumbnails_once(self):
+        image = Image.objects.create(post=self.post, user=self.author, image=self.upload((1200, 800)))
+        self.assertTrue(claim_image(image.id))
+        self.assertFalse(claim_image(image.id))
+        process_image(image.id)
+
+        image.refresh_from_db()
+        self.assertEqual(image.processing_status, Image.READY)
+        self.assertEqual((image.thumbnail_width, image.thumbnail_height), (750, 500))
+        self.assertTrue(image.image_thumbnail.name.endswith('.webp'))
+
+        self.assertTrue(image.placeholder.startswith('data:image/webp;base64,'))
+        self.assertLess(len(image.placeholder), 1000)
+        self.assertEqual(image.dominant_color, '#ff0000')
+
+        widths = sorted({variant.width for variant in image.variants.all()})
+        self.assertEqual(widths, [320, 640, 1080, 1200])
+        self.assertEqual(image.variants.count(), len(widths) * len(variant_formats()))
+
+    def test_thumbnail_follows_exif_orientation_and_drops_metadata(self):
+        content = BytesIO()
+        photo = PILImage.new('RGB', (1200, 800), 'red')
+        exif = photo.getexif()
+        exif[0x0112] = 6  # Rotated 90 degrees clockwise
+        photo.save(content, format='JPEG', exif=exif)
+        content.name = 'photo.jpg'
+        content.seek(0)
+
+        thumbnail, width, height = render_thumbnail(content)
+        self.assertEqual((width, height), (400, 600))
+        with PILImage.open(thumbnail) as rendered:
+            self.assertEqual(rendered.size, (400, 600))
+            self.assertNotIn('exif', rendered.info)
+
+    def test_caption_update_skips_reprocessing_and_keeps_worker_fields(self):
+        image = Image.objects.create(post=self.post, user=self.author, image=self.upload((1200, 800)))
+        stale = Image.objects.get(pk=image.pk)
+        claim_image(image.id)
+        process_image(image.id)
+
+        stale.caption = 'edited'
+        with self.assertNumQueries(1):
+            stale.save()
+        image.refresh_from_db()
+        self.assertEqual(image.caption, 'edited')
+        self.assertEqual(image.processing_status, Image.READY)
+        self.assertTrue(image.image_thumbnail)
+
+    def test_reuploading_the_same_file_is_not_a_change(self):
+        image = Image.objects.create(post=self.post, user=self.author, image=self.upload((1200, 800)))
+        image = Image.objects.get(pk=image.pk)
+        stored_name = image.image.name
+
+        image.image = self.upload((1200, 800))
+        self.assertEqual(image.changed_file_fields(), [])
+        self.assertEqual(image.image.name, stored_name)
+
+        image.image = self.upload((800, 800))
+        self.assertEqual(image.changed_file_fields(), ['image'])
+
+    def test_duplicate_upload_shares_files_and_renditions(self):
+        first = Image.objects.create(post=self.post, user=self.author, image=self.upload((1200, 800)))
+        claim_image(first.id)
+        process_image(first.id)
+        first.refresh_from_db()
+
+        second = Image.objects.create(post=self.post, user=self.author, image=self.upload((1200, 800)))
+        second.refresh_from_db()
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(second.processing_status, Image.READY)
+        self.assertEqual(second.image_thumbnail.name, first.image_thumbnail.name)
+        self.assertEqual(second.placeholder, first.placeholder)
+        self.assertEqual(second.variants.count(), first.variants.count())
+        self.assertEqual(ContentBlob.objects.get(name=first.image.name).references, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(second.image.storage.exists(second.image.name))
+        self.assertTrue(second.image_thumbnail.storage.exists(second.image_thumbnail.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(second.image.storage.exists(second.image.name))
+        self.assertFalse(ContentBlob.objects.exists())
+
+
+    def test_replacing_the_file_releases_the_old_thumbnail(self):
+        image = Image.objects.create(post=self.post, user=self.author, image=self.upload((1200, 800)))
+        claim_image(image.id)
+        process_image(image.id)
+        image = Image.objects.get(pk=image.pk)
+        old_thumbnail = image.image_thumbnail.name
+
+        image.image = self.upload((800, 800))
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        self.assertEqual(image.processing_status, Image.PENDING)
+        self.assertFalse(ContentBlob.objects.filter(name=old_thumbnail).exists())
+        self.assertFalse(image.image_thumbnail.storage.exists(old_thumbnail))
+
+        claim_image(image.id)
+        process_image(image.id)
+        image.refresh_from_db()
+        self.assertEqual((image.thumbnail_width, image.thumbnail_height), (400, 400))
+        self.assertEqual(ContentBlob.objects.get(name=image.image_thumbnail.name).references, 1)
+
+    def test_rendering_a_ready_image_again_keeps_one_reference(self):
+        image = Image.objects.create(post=self.post, user=self.author, image=self.upload((1200, 800)))
+        for _ in range(2):
+            Image.objects.filter(pk=image.pk).update(processing_status=Image.PENDING)
+            claim_image(image.id)
+            process_image(image.id)
+        image.refresh_from_db()
+        self.assertEqual(ContentBlob.objects.get(name=image.image_thumbnail.name).references, 1)
+
+
+@override_settings(THUMBNAIL_WORKERS=0, BATCH_UPLOAD_PROCESSES=0)
+class BatchUploadTests(TestCase):
+    """A post's images arrive in one request and come back processed or pending."""
+
+    def setUp(self):
+        # Test rollbacks leave files behind, each test checks a directory of its own
+        media_root = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.author = create_user('author')
+        self.friend = create_user('friend')
+        self.post = Post.objects.create(user=self.author)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def upload(self, size, color='red'):
+        content = BytesIO()
+        PILImage.new('RGB', size, color).save(content, format='PNG')
+        return SimpleUploadedFile('photo.png', content.getvalue(), content_type='image/png')
+
+    def use_pool(self):
+        """Render in a thread pool standing in for the BATCH_UPLOAD_PROCESSES processes."""
+        pool = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(pool.shutdown)
+        processes = override_settings(BATCH_UPLOAD_PROCESSES=2)
+        processes.enable()
+        self.addCleanup(processes.disable)
+        patcher = mock.patch('images.batch._get_pool', return_value=pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batch_creates_processed_images_with_their_tags(self):
+        self.use_pool()
+        items = [
+            {'caption': 'first', 'order_id': 2, 'tagged_friends': [{'user': self.friend.id, 'top': 1, 'left': 2}]},
+            {'caption': 'second', 'order_id': 0},
+            {'caption': 'again', 'order_id': 1},
+        ]
+        response = self.client.post('/api/images/batch/', {
+            'post': self.post.id,
+            'images': [self.upload((1200, 800)), self.upload((800, 1200), 'blue'), self.upload((1200, 800))],
+            'items': json.dumps(items),
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([image['caption'] for image in response.data], ['second', 'again', 'first'])
+        self.assertTrue(all(image['processing_status'] == Image.READY for image in response.data))
+        self.assertEqual(len(response.data[2]['tagged_friends']), 1)
+
+        first, repeated = Image.objects.get(caption='first'), Image.objects.get(caption='again')
+        self.assertEqual((first.image_width, first.image_height), (1200, 800))
+        self.assertEqual((first.thumbnail_width, first.thumbnail_height), (750, 500))
+        self.assertEqual(first.dominant_color, '#ff0000')
+        # The repeated file was rendered once and its renditions are shared
+        self.assertEqual(repeated.image_thumbnail.name, first.image_thumbnail.name)
+        self.assertEqual(repeated.variants.count(), first.variants.count())
+        self.assertEqual(ContentBlob.objects.get(name=first.image_thumbnail.name).references, 2)
+
+    def test_batch_rejects_misaligned_items_and_other_users_posts(self):
+        response = self.client.post('/api/images/batch/', {
+            'post': self.post.id, 'images': [self.upload((100, 100))], 'items': '[{}, {}]',
+        })
+        self.assertEqual(response.status_code, 400)
+
+        other_post = Post.objects.create(user=self.friend)
+        response = self.client.post('/api/images/batch/', {
+            'post': other_post.id, 'images': [self.upload((100, 100))],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Image.objects.exists())
+
+    def test_without_a_pool_images_are_left_to_the_workers(self):
+        with mock.patch('images.batch.render_stored_image') as render, \
+                mock.patch('images.batch.enqueue_thumbnail') as enqueue:
+            response = self.client.post('/api/images/batch/', {
+                'post': self.post.id, 'images': [self.upload((1200, 800)), self.upload((800, 1200), 'blue')],
+            })
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(all(image['processing_status'] == Image.PENDING for image in response.data))
+        render.assert_not_called()
+        self.assertEqual(sorted(call.args[0] for call in enqueue.call_args_list),
+                         sorted(image['id'] for image in response.data))
+
+    def test_failed_batch_releases_its_stored_files(self):
+        files = [self.upload((1200, 800)), self.upload((800, 1200), 'blue'), self.upload((1200, 800))]
+        items = [{'tagged_friends': [{'user': self.friend.id, 'top': 1, 'left': 2}]}, {}, {}]
+        with mock.patch.object(TaggedFriend.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                create_images(self.post, self.author, files, items)
+
+        self.assertFalse(Image.objects.exists())
+        self.assertFalse(ContentBlob.objects.exists())
+        root = content_storage.path(settings.CONTENT_ADDRESSED_ROOT)
+        self.assertEqual([names for _, _, names in os.walk(root) if names], [])
+
+    def test_failed_batch_releases_the_renditions_it_shared(self):
+        processed = Image.objects.create(post=self.post, user=self.author, image=self.upload((1200, 800)))
+        claim_image(processed.id)
+        process_image(processed.id)
+        processed.refresh_from_db()
+        shared = [processed.image_thumbnail.name] + list(processed.variants.values_list('file', flat=True))
+        references = dict(ContentBlob.objects.filter(name__in=shared).values_list('name', 'references'))
+
+        with mock.patch('images.batch.schedule_post_layout', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                create_images(self.post, self.author, [self.upload((1200, 800))], [{}])
+        self.assertEqual(dict(ContentBlob.objects.filter(name__in=shared).values_list('name', 'references')),
+                         references)
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CHUNKED_UPLOAD_DIR=tempfile.mkdtemp(), THUMBNAIL_WORKERS=0)
+class UploadSessionTests(TestCase):
+    """Resumable uploads are written chunk by chunk and finalized into an image."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.post = Post.objects.create(user=self.author)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        content = BytesIO()
+        PILImage.new('RGB', (640, 480), 'green').save(content, format='JPEG')
+        self.content = content.getvalue()
+
+    def start(self):
+        response = self.client.post('/api/images/uploads/', {
+            'kind': 'image', 'filename': 'photo.jpg', 'size': len(self.content)})
+        self.assertEqual(response.status_code, 201)
+        return f"/api/images/uploads/{response.data['id']}/"
+
+    def send(self, url, offset, chunk):
+        return self.client.generic(
+            'PATCH', url, chunk, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunks_resume_at_the_stored_offset(self):
+        url = self.start()
+        half = len(self.content) // 2
+        self.assertEqual(self.send(url, 0, self.content[:half]).data['offset'], half)
+
+        response = self.send(url, 0, self.content[:half])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], str(half))
+        self.assertEqual(self.client.get(url).data['offset'], half)
+
+        self.assertEqual(self.send(url, half, self.content[half:]).data['offset'], len(self.content))
+
+    def test_finalize_hashes_and_attaches_the_file(self):
+        url = self.start()
+        self.assertEqual(self.client.post(f'{url}finalize/', {'post': self.post.id}).status_code, 409)
+
+        self.send(url, 0, self.content)
+        response = self.client.post(f'{url}finalize/', {
+            'post': self.post.id, 'caption': 'uploaded', 'checksum': hashlib.sha256(self.content).hexdigest()})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['processing_status'], Image.PENDING)
+
+        session = UploadSession.objects.get()
+        image = Image.objects.get()
+        self.assertEqual(session.image, image)
+        self.assertEqual(session.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual((image.caption, image.image_width, image.image_height), ('uploaded', 640, 480))
+        self.assertFalse(os.path.exists(session.temp_path))
+
+    def test_finalize_rejects_other_users_posts(self):
+        url = self.start()
+        self.send(url, 0, self.content)
+        other_post = Post.objects.create(user=create_user('other'))
+        response = self.client.post(f'{url}finalize/', {'post': other_post.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('post', response.data)
+        self.assertFalse(Image.objects.exists())
+
+    def test_finalize_rejects_a_checksum_mismatch(self):
+        url = self.start()
+        self.send(url, 0, self.content)
+        response = self.client.post(f'{url}finalize/', {'post': self.post.id, 'checksum': '0' * 64})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Image.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), THUMBNAIL_WORKERS=0)
+class MediaServingTests(TestCase):
+    """Media files are served with byte ranges, to the viewers of the owning post only."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.post = Post.objects.create(user=self.author, audience=PUBLIC)
+        self.content = bytes(range(256)) * 64
+        poster = Image.objects.create(post=self.post, user=self.author)
+        poster.video = SimpleUploadedFile('clip.mp4', self.content, content_type='video/mp4')
+        poster.save()
+        self.url = '/media/' + poster.video.name
+
+    def test_full_and_partial_responses(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10', HTTP_IF_RANGE=etag)
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-').status_code, 416)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_media_follow_the_post_audience(self):
+        self.post.audience = PRIVATE
+        self.post.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        client = APIClient()
+        client.force_authenticate(self.author)
+        self.assertEqual(client.get(self.url).status_code, 200)
+        self.assertEqual(self.client.get('/media/content/unknown.mp4').status_code, 404)
+
+    def test_signed_urls_let_media_elements_through(self):
+        self.post.audience = PRIVATE
+        self.post.save()
+        # A poster without an image file, sized for aspect_ratio
+        Image.objects.filter(post=self.post).update(image_width=4, image_height=3)
+        client = APIClient()
+        client.force_authenticate(self.author)
+        rendered = client.get(f'/api/posts/{self.post.id}/details/').data['image_set'][0]['video']
+        url = urlsplit(rendered)
+        self.assertEqual(url.path, self.url)
+
+        # No Authorization header, as from <video src>
+        signed = f'{url.path}?{url.query}'
+        self.assertEqual(self.client.get(signed).status_code, 200)
+        response = self.client.get(signed, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[:10])
+
+        stranger = create_user('stranger')
+        self.assertEqual(self.client.get(signed.replace(f'viewer={self.author.id}', f'viewer={stranger.id}'))
+                         .status_code, 404)
+        expires = int(parse_qs(url.query)['expires'][0])
+        with mock.patch('images.media.time.time', return_value=expires + 1):
+            self.assertEqual(self.client.get(signed).status_code, 404)
+
+    @override_settings(MEDIA_ACCEL_MODE='x-accel-redirect')
+    def test_accel_mode_hands_the_file_to_the_proxy(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.url.removeprefix('/media/'))
+        self.assertEqual(response.content, b'')
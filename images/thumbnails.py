@@ -0,0 +1,88 @@
+from io import BytesIO
+import math
+import os
+
+from PIL import ExifTags, ImageOps
+from PIL import Image as ImageTool
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+
+# The last resize step shrinks by at least this factor, the rest is done by
+# JPEG draft decoding or integer reduction; 2.0 is visually lossless
+REDUCING_GAP = 2.0
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def thumbnail_box(width, height):
+    """The THUMBNAIL_BUCKETS bounding box of an image displayed at ``width`` x ``height``."""
+    aspect_ratio = width / height
+    for min_aspect_ratio, box in settings.THUMBNAIL_BUCKETS:
+        if aspect_ratio >= min_aspect_ratio:
+            return box
+    return settings.THUMBNAIL_BUCKETS[-1][1]
+
+
+def fit_size(width, height, box):
+    """The largest size with the aspect ratio of ``width`` x ``height`` that fits ``box``, never upscaled."""
+    scale = min(box[0] / width, box[1] / height, 1)
+    return max(math.floor(width * scale), 1), max(math.floor(height * scale), 1)
+
+
+def is_transposed(img):
+    return img.getexif().get(ExifTags.Base.Orientation, 1) in TRANSPOSED_ORIENTATIONS
+
+
+def displayed_size(img):
+    """The size of an opened image once its EXIF orientation is applied."""
+    return (img.height, img.width) if is_transposed(img) else img.size
+
+
+def decode(img, size):
+    """
+    Load an opened image at the smallest resolution that still resizes to
+    ``size`` (in displayed orientation) with a REDUCING_GAP margin, upright
+    and in RGB or RGBA. Nothing is decoded at full resolution when the format
+    supports draft mode, which JPEG does.
+    """
+    if is_transposed(img):
+        size = (size[1], size[0])
+    img.draft('RGB', (size[0] * REDUCING_GAP, size[1] * REDUCING_GAP))
+    if img.mode not in ('RGB', 'RGBA'):
+        # Palette and bilevel images would otherwise resize with NEAREST
+        img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+    return ImageOps.exif_transpose(img)
+
+
+def resize(img, size):
+    if img.size == size:
+        return img
+    return img.resize(size, resample=ImageTool.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def encode(img, format, name, **options):
+    """
+    Encode ``img`` into a named file. No exif or xmp is passed, so none is
+    written; the ICC profile is kept so colors stay right.
+    """
+    output = BytesIO()
+    img.save(output, format=format, icc_profile=img.info.get('icc_profile'), **options)
+    return ContentFile(output.getvalue(), name=name)
+
+
+def base_name(file):
+    return os.path.splitext(os.path.basename(file.name))[0]
+
+
+def render_thumbnail(file):
+    """
+    Decode ``file`` at the smallest resolution its thumbnail allows, apply the
+    EXIF orientation and encode it as WEBP without EXIF or XMP metadata.
+    Returns the encoded file and its width and height.
+    """
+    with ImageTool.open(file) as img:
+        width, height = displayed_size(img)
+        size = fit_size(width, height, thumbnail_box(width, height))
+        thumbnail = resize(decode(img, size), size)
+        return encode(thumbnail, 'WEBP', f"{base_name(file)}_thumb.webp"), size[0], size[1]
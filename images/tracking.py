@@ -0,0 +1,83 @@
+import hashlib
+
+from django.db import models
+
+
+def file_digest(file, algorithm='sha256'):
+    """Hex digest of a Django file, read in chunks so memory stays flat."""
+    digest = hashlib.new(algorithm)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileChangeTrackingModel(models.Model):
+    """
+    Remembers the stored names of ``tracked_file_fields`` as the row is loaded,
+    so saves can tell whether a source file changed without a query or a decode.
+    ``worker_fields`` are written by background workers and left out of saves
+    that changed no tracked file, so a stale instance cannot clobber them.
+    Subclasses call ``changed_file_fields()`` then ``save_tracked()`` from save.
+    """
+    tracked_file_fields = ()
+    worker_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Deferred fields are simply not known. Image fields with dimension
+        # fields are already FieldFiles by now, others still raw names
+        instance._loaded_file_names = {
+            field: getattr(instance.__dict__[field], 'name', instance.__dict__[field]) or ''
+            for field in cls.tracked_file_fields if field in instance.__dict__
+        }
+        return instance
+
+    def _same_as_stored(self, field_file, stored_name):
+        """Whether a newly assigned upload has the content of the file it replaces."""
+        if not stored_name or not field_file.storage.exists(stored_name):
+            return False
+        with field_file.storage.open(stored_name) as stored:
+            if stored.size != field_file.size:
+                return False
+            same = file_digest(stored) == file_digest(field_file)
+        field_file.seek(0)
+        return same
+
+    def changed_file_fields(self):
+        """
+        The tracked fields whose file differs from the stored row. A re-upload
+        of the stored content counts as unchanged and keeps the stored file.
+        """
+        loaded = getattr(self, '_loaded_file_names', {})
+        changed = []
+        for field in self.tracked_file_fields:
+            field_file = getattr(self, field)
+            if self._state.adding:
+                if field_file:
+                    changed.append(field)
+            elif field_file and not field_file._committed:
+                if self._same_as_stored(field_file, loaded.get(field)):
+                    setattr(self, field, loaded[field])
+                else:
+                    changed.append(field)
+            elif field not in loaded or (field_file.name or '') != loaded[field]:
+                changed.append(field)
+        return changed
+
+    def save_tracked(self, changed, **kwargs):
+        """
+        Save the row given the ``changed_file_fields()`` computed before any
+        pre-save work, writing every field but ``worker_fields`` when no file changed.
+        """
+        if not self._state.adding and not changed and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.worker_fields
+            ]
+        models.Model.save(self, **kwargs)
+        self._loaded_file_names = {
+            field: getattr(self, field).name or '' for field in self.tracked_file_fields}
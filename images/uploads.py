@@ -0,0 +1,63 @@
+import hashlib
+import os
+
+from django.core.files import File
+
+
+# Bytes read from the request and from the temporary file per step, so memory
+# stays flat however large the upload
+BLOCK_SIZE = 256 * 1024
+
+
+class UploadOffsetError(Exception):
+    pass
+
+
+def write_chunk(session, stream, offset, length):
+    """
+    Append ``length`` bytes of ``stream`` to the temporary file of ``session``
+    (locked by the caller) at ``offset``, which must be its current offset.
+    Returns the new offset; a stream cut short still keeps the bytes received.
+    """
+    if offset != session.offset:
+        raise UploadOffsetError(f'Expected offset {session.offset}, got {offset}.')
+    if offset + length > session.size:
+        raise UploadOffsetError(f'The chunk ends past the declared size of {session.size} bytes.')
+
+    os.makedirs(os.path.dirname(session.temp_path), exist_ok=True)
+    with open(session.temp_path, 'ab') as temp_file:
+        # Drop bytes past the offset left by a write that failed midway
+        temp_file.truncate(offset)
+        remaining = length
+        while remaining > 0:
+            block = stream.read(min(BLOCK_SIZE, remaining)) if stream is not None else b''
+            if not block:
+                break
+            temp_file.write(block)
+            remaining -= len(block)
+    return offset + length - remaining
+
+
+class HashingFile(File):
+    """A File whose chunks update a digest as storage reads them, hashing while copying."""
+
+    def __init__(self, file, name=None):
+        super().__init__(file, name)
+        self.digest = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        for chunk in super().chunks(chunk_size or BLOCK_SIZE):
+            self.digest.update(chunk)
+            yield chunk
+
+
+def store_upload(session, field_file):
+    """
+    Copy the complete temporary file of ``session`` into ``field_file``'s
+    storage, hashing it on the way. Returns the stored name and the sha256.
+    """
+    with open(session.temp_path, 'rb') as temp_file:
+        content = HashingFile(temp_file, name=session.filename)
+        name = field_file.field.generate_filename(field_file.instance, session.filename)
+        name = field_file.storage.save(name, content, max_length=field_file.field.max_length)
+    return name, content.digest.hexdigest()
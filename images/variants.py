@@ -0,0 +1,108 @@
+from PIL import features
+from PIL import Image as ImageTool
+from django.conf import settings
+
+from .placeholders import render_placeholder
+from .thumbnails import base_name, decode, displayed_size, encode, fit_size, resize, thumbnail_box
+
+
+# Pillow format name, file extension and encoder options of each variant format
+VARIANT_FORMATS = {
+    'WEBP': ('webp', {'quality': 80, 'method': 4}),
+    'AVIF': ('avif', {'quality': 60, 'speed': 8}),
+}
+
+
+def variant_formats():
+    """The configured IMAGE_VARIANT_FORMATS this Pillow build can encode."""
+    return [format for format in settings.IMAGE_VARIANT_FORMATS if features.check(format.lower())]
+
+
+def variant_widths(field, source_width):
+    """
+    The IMAGE_VARIANT_WIDTHS buckets of ``field`` below the source width, plus
+    one at the source width when it is smaller than the largest bucket, so
+    nothing is upscaled and the full resolution is always available.
+    """
+    widths = settings.IMAGE_VARIANT_WIDTHS[field]
+    return sorted({width for width in widths if width < source_width} | {min(source_width, max(widths))})
+
+
+def render_variants(file, field, thumbnail_box=None):
+    """
+    Render the width-bucketed variants of ``file`` in every variant format from
+    a single decode. ``thumbnail_box`` is called with the displayed size and
+    returns the box of a WEBP thumbnail rendered from the same decode.
+    Returns the thumbnail as (file, width, height) or None, the variants as
+    (format, width, height, file) tuples and the (data URI, dominant color)
+    placeholder, taken from the smallest variant.
+    """
+    with ImageTool.open(file) as img:
+        width, height = displayed_size(img)
+        sizes = [fit_size(width, height, (variant_width, height)) for variant_width in variant_widths(field, width)]
+        thumbnail_size = fit_size(width, height, thumbnail_box(width, height)) if thumbnail_box else None
+        largest = max(sizes + ([thumbnail_size] if thumbnail_size else []))
+        decoded = decode(img, largest)
+
+        name = base_name(file)
+        variants = []
+        # Largest first, each step resizes the previous variant instead of the full decode
+        source = decoded
+        for size in reversed(sizes):
+            source = resize(source, size)
+            for format in variant_formats():
+                extension, options = VARIANT_FORMATS[format]
+                variants.append((format.lower(), size[0], size[1],
+                                 encode(source, format, f"{name}_{size[0]}w.{extension}", **options)))
+
+        thumbnail = None
+        if thumbnail_size:
+            thumbnail = (encode(resize(decoded, thumbnail_size), 'WEBP', f"{name}_thumb.webp"),
+                         thumbnail_size[0], thumbnail_size[1])
+        return thumbnail, variants, render_placeholder(source)
+
+
+def render_stored_image(path):
+    """
+    Process pool entry point: the thumbnail, variants and placeholder of the
+    image file at ``path`` as render_variants returns them, plus its stored
+    (undisplayed) width and height. Files are read into bytes to pickle back.
+    """
+    with open(path, 'rb') as file:
+        with ImageTool.open(file) as img:
+            size = img.size
+        file.seek(0)
+        thumbnail, variants, placeholder = render_variants(file, 'image', thumbnail_box)
+    thumbnail_file, width, height = thumbnail
+    return (
+        size,
+        (thumbnail_file.name, thumbnail_file.read(), width, height),
+        [(format, variant_width, variant_height, content.name, content.read())
+         for format, variant_width, variant_height, content in variants],
+        placeholder,
+    )
+
+
+def srcset(instance, field, request=None, viewer_id=None):
+    """
+    The stored variants of ``instance``'s ``field`` for clients to pick from,
+    smallest first. Reads ``instance.variants.all()`` so a prefetch applies.
+    With ``viewer_id`` the URLs are signed for that viewer, see images.media.
+    """
+    # Imported here, the batch render processes load this module without the models
+    from .media import sign_media_url
+
+    result = []
+    for variant in instance.variants.all():
+        if variant.field != field:
+            continue
+        url = variant.file.url
+        url = request.build_absolute_uri(url) if request is not None else url
+        result.append({
+            'url': sign_media_url(url, variant.file.name, viewer_id),
+            'width': variant.width,
+            'height': variant.height,
+            'format': variant.format,
+        })
+    result.sort(key=lambda variant: (variant['width'], variant['format']))
+    return result
@@ -1,8 +1,23 @@
 from rest_framework import generics, response, status, permissions
+from rest_framework.exceptions import ValidationError
+from rest_framework.views import APIView
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404
+from PIL import Image as ImageTool
+from django.db import transaction
 import json
+import os
 
-from .models import Image, TaggedFriend
+from .batch import create_images
+from .models import Image, TaggedFriend, UploadSession
+from posts.pagination import KeysetPagination
+from .media import media_visible, serve_media, signed_viewer_id
+from .queries import image_list_queryset, scoped_image_queryset, tagged_friend_list_queryset
+from .queries import visible_images_filter
+from .storage import content_storage
 from .serilaizers import ImageCreateSerializer, ImageListSerializer, ImageUpdateSerializer, TaggedFriendsListSerializer
+from .serilaizers import ImageBatchCreateSerializer, UploadFinalizeSerializer, UploadSessionSerializer
+from .uploads import UploadOffsetError, store_upload, write_chunk
 
 class OwnerPermission(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -15,6 +30,21 @@ class ImageCreateView(generics.CreateAPIView):
     serializer_class = ImageCreateSerializer
     queryset = Image.objects.all()
     
+class ImageBatchCreateView(generics.GenericAPIView):
+    """All the images of a post in one request, returned processed."""
+    serializer_class = ImageBatchCreateSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        images = create_images(data['post'], request.user, data['images'], data['items'])
+        images = image_list_queryset().filter(pk__in=[image.pk for image in images]).order_by('order_id', 'pk')
+        return response.Response(
+            ImageListSerializer(images, many=True, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED)
+
 class ImageUpdateView(generics.UpdateAPIView):
     permission_classes = [OwnerPermission]
     serializer_class = ImageUpdateSerializer
@@ -26,12 +56,154 @@ class ImageDestroyView(generics.DestroyAPIView):
     queryset = Image.objects.all()
 
 class ImageListView(generics.ListAPIView):
+    """
+    Images the viewer may see: ``post`` lists a post's images, ``user`` the
+    ones they uploaded, or with ``filterBy=tagged`` the ones they are tagged
+    in and with ``filterBy=videos`` their videos.
+    """
     serializer_class = ImageListSerializer
+    pagination_class = KeysetPagination
     queryset = Image.objects.all()
 
+    def get_queryset(self):
+        viewer_id = self.request.user.id if self.request.user.is_authenticated else None
+        queryset = image_list_queryset(super().get_queryset()).filter(visible_images_filter(viewer_id))
+        try:
+            post_id = int(self.request.GET['post']) if 'post' in self.request.GET else None
+            user_id = int(self.request.GET['user']) if 'user' in self.request.GET else None
+        except ValueError:
+            raise ValidationError({'detail': 'post and user must be integer ids.'})
+        return scoped_image_queryset(queryset, post_id, user_id, self.request.GET.get('filterBy'))
+
 class TaggedFriendsListAPIView(generics.ListCreateAPIView):
     serializer_class = TaggedFriendsListSerializer
     queryset = TaggedFriend.objects.all()
 
     def get_queryset(self):
-        return super().get_queryset().filter(image=self.kwargs.get('pk'))
+        return tagged_friend_list_queryset(super().get_queryset()).filter(image=self.kwargs.get('pk'))
+
+
+# RESUMABLE UPLOADS
+class UploadSessionCreateView(generics.CreateAPIView):
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class UploadSessionView(generics.RetrieveDestroyAPIView):
+    """
+    GET reports how many bytes arrived so an interrupted upload can resume,
+    PATCH appends the raw request body at the ``Upload-Offset`` header.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def patch(self, request, *args, **kwargs):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            raise ValidationError({'Upload-Offset': 'An integer Upload-Offset header is required.'})
+
+        with transaction.atomic():
+            session = generics.get_object_or_404(
+                self.get_queryset().select_for_update(), pk=self.kwargs['pk'])
+            if session.is_finalized:
+                return response.Response(
+                    {'detail': 'This upload is already finalized.'}, status=status.HTTP_409_CONFLICT)
+            try:
+                # The body is streamed, never parsed into request.data
+                session.offset = write_chunk(session, request.stream, offset, length)
+            except UploadOffsetError as error:
+                return response.Response(
+                    {'detail': str(error), 'offset': session.offset}, status=status.HTTP_409_CONFLICT,
+                    headers={'Upload-Offset': str(session.offset)})
+            session.save(update_fields=['offset', 'updated_at'])
+        return response.Response(
+            {'offset': session.offset, 'size': session.size}, headers={'Upload-Offset': str(session.offset)})
+
+
+class UploadSessionFinalizeView(generics.GenericAPIView):
+    serializer_class = UploadFinalizeSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        session = generics.get_object_or_404(self.get_queryset(), pk=self.kwargs['pk'])
+        if session.is_finalized:
+            return response.Response(
+                {'detail': 'This upload is already finalized.'}, status=status.HTTP_409_CONFLICT)
+        if not session.is_complete:
+            return response.Response(
+                {'detail': f'Only {session.offset} of {session.size} bytes were received.', 'offset': session.offset},
+                status=status.HTTP_409_CONFLICT)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if session.kind == UploadSession.VIDEO and 'image' not in data:
+            # Like ImageCreateSerializer, a video belongs to an image acting as its poster
+            raise ValidationError({'image': 'Videos are attached to an existing image.'})
+
+        if session.kind == UploadSession.IMAGE:
+            try:
+                with ImageTool.open(session.temp_path) as img:
+                    img.verify()
+            except Exception:
+                raise ValidationError({'detail': 'The upload is not a valid image.'})
+
+        image = data.get('image') or Image(
+            post=data['post'], user=request.user, order_id=data['order_id'], caption=data['caption'])
+        field_file = getattr(image, session.kind)
+        # Copied and hashed outside any transaction, the file can be large
+        name, digest = store_upload(session, field_file)
+        if data.get('checksum') and data['checksum'].lower() != digest:
+            field_file.storage.delete(name)
+            raise ValidationError({'checksum': 'The upload does not match the checksum.'})
+
+        with transaction.atomic():
+            locked = self.get_queryset().select_for_update().get(pk=session.pk)
+            if locked.is_finalized:
+                field_file.storage.delete(name)
+                return response.Response(
+                    {'detail': 'This upload is already finalized.'}, status=status.HTTP_409_CONFLICT)
+            setattr(image, session.kind, name)
+            image.save()
+            if 'image' not in data:
+                for tagged_friend in json.loads(data['tagged_friends']):
+                    TaggedFriend.objects.create(
+                        image=image, user_id=tagged_friend['user'], top=tagged_friend['top'], left=tagged_friend['left'])
+            locked.sha256 = digest
+            locked.image = image
+            locked.save(update_fields=['sha256', 'image', 'updated_at'])
+        os.remove(session.temp_path)
+
+        image = image_list_queryset().get(pk=image.pk)
+        return response.Response(
+            ImageListSerializer(image, context=self.get_serializer_context()).data, status=status.HTTP_201_CREATED)
+
+
+# MEDIA FILES
+class MediaFileView(APIView):
+    """Serves MEDIA_ROOT files to the viewers allowed to see them, with byte ranges for seeking in videos."""
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, name):
+        # Media elements cannot send the Authorization header, their URLs are signed instead
+        viewer_id = signed_viewer_id(request, name)
+        if viewer_id is None and request.user.is_authenticated:
+            viewer_id = request.user.id
+        try:
+            exists = content_storage.exists(name)
+        except SuspiciousFileOperation:
+            raise Http404
+        # Hidden and missing files look the same
+        if not exists or not media_visible(name, viewer_id):
+            raise Http404
+        return serve_media(request, content_storage, name)
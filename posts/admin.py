@@ -8,4 +8,6 @@ admin.site.register(models.Post)
 admin.site.register(models.PostComment)
 admin.site.register(models.PostLike)
 admin.site.register(models.CommentLike)
+admin.site.register(models.Reaction)
+admin.site.register(models.ReactionAggregate)
 admin.site.register(models.Audience)
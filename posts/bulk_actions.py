@@ -0,0 +1,214 @@
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+from rest_framework import serializers, status
+
+from profiles.models import FavoritePost, UserProfile
+from .counters import adjust_comment_counters, adjust_post_counters
+from .models import ClientAction, Post, PostComment, Reaction
+from .reactions import like_value, reaction_breakdowns, reaction_info, record_reaction_changes, visible_targets
+from .serializers import CommentActionSerializer, CommentLikeActionSerializer, CommentListSerilaizer
+from .serializers import FavoritePostSerializer, PostLikeActionSerializer
+
+
+PAYLOAD_SERIALIZERS = {
+    'post_like': PostLikeActionSerializer,
+    'comment_like': CommentLikeActionSerializer,
+    'favorite': FavoritePostSerializer,
+    'comment': CommentActionSerializer,
+}
+NOT_FOUND = (status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'})
+
+
+def run_actions(request, actions):
+    """
+    Replay ``actions``, validated BulkActionSerializer envelopes, for the
+    request user in one transaction and return one ``{id, status, data}``
+    result per action, in order. Actions whose id the user already sent get
+    their stored result back instead of running again.
+
+    Each type runs as a whole, with its rows read, deleted and inserted in
+    bulk, while taps on one post or comment keep their relative order: the
+    results are those of running the actions one by one. Actions of other
+    types cannot depend on each other, a comment's id is only known once
+    it has been created.
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                return _run_actions(request, actions)
+        except IntegrityError:
+            # A concurrent retry stored some of these actions first, the
+            # second attempt returns their results
+            if attempt:
+                raise
+
+
+def _run_actions(request, actions):
+    user = request.user
+    stored = {action.action_id: (action.status, action.result) for action in
+              ClientAction.objects.filter(user=user, action_id__in=[action['id'] for action in actions])}
+    results = {}
+    by_type = {action_type: [] for action_type in PAYLOAD_SERIALIZERS}
+    for action in actions:
+        if action['id'] in stored:
+            continue
+        payload = PAYLOAD_SERIALIZERS[action['type']](data=action)
+        if payload.is_valid():
+            by_type[action['type']].append((action['id'], payload.validated_data))
+        else:
+            results[action['id']] = (status.HTTP_400_BAD_REQUEST, payload.errors)
+
+    results.update(toggle_reactions(Reaction.POST, user.id, [
+        (action_id, data['post'], like_kind(data['like'])) for action_id, data in by_type['post_like']]))
+    results.update(toggle_reactions(Reaction.COMMENT, user.id, [
+        (action_id, data['comment'], like_kind(data['like'])) for action_id, data in by_type['comment_like']]))
+    results.update(toggle_favorites(user, [
+        (action_id, data['post_id']) for action_id, data in by_type['favorite']]))
+    results.update(create_comments(request, by_type['comment']))
+
+    ClientAction.objects.bulk_create([
+        ClientAction(user=user, action_id=action_id, status=result_status, result=data)
+        for action_id, (result_status, data) in results.items()
+    ])
+    results.update(stored)
+    return [{'id': action['id'], 'status': results[action['id']][0], 'data': results[action['id']][1]}
+            for action in actions]
+
+
+def like_kind(like):
+    return Reaction.LIKE if like else Reaction.DISLIKE
+
+
+def toggle_reactions(target_type, user_id, taps):
+    """
+    Apply ``(action_id, target_id, kind)`` taps as ``toggle_reaction`` would
+    one after the other, with one delete and one insert of the user's
+    reactions and one count change per target. Returns results by action id.
+    """
+    if not taps:
+        return {}
+    # Targets the user may not see are not found, as in ReactionAPIView
+    target_ids = set(visible_targets(target_type, user_id).filter(pk__in={target_id for _, target_id, _ in taps})
+                     .values_list('pk', flat=True))
+    if not target_ids:
+        return {action_id: NOT_FOUND for action_id, _, _ in taps}
+
+    # As in toggle_reaction, deleting first takes the reactions' locks and
+    # tells their kinds. They are all inserted again below
+    reactions = connection.ops.quote_name(Reaction._meta.db_table)
+    user_column = connection.ops.quote_name(Reaction._meta.get_field('user').column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {reactions} WHERE target_type = %s AND {user_column} = %s '
+            f'AND target_id IN ({", ".join(["%s"] * len(target_ids))}) RETURNING target_id, kind',
+            [target_type, user_id, *target_ids])
+        initial = dict(cursor.fetchall())
+
+    breakdowns = reaction_breakdowns(target_type, list(target_ids))
+    names = dict(Reaction.KIND_CHOICES)
+    current = dict(initial)
+    results = {}
+    for action_id, target_id, kind in taps:
+        if target_id not in target_ids:
+            results[action_id] = NOT_FOUND
+            continue
+        previous = current.get(target_id)
+        current[target_id] = None if previous == kind else kind
+        breakdown = breakdowns[target_id]
+        if previous is not None:
+            breakdown[names[previous]] -= 1
+        if current[target_id] is not None:
+            breakdown[names[current[target_id]]] += 1
+        results[action_id] = (status.HTTP_200_OK, reaction_info(
+            breakdown['like'], breakdown['dislike'], like_value(current[target_id])))
+
+    Reaction.objects.bulk_create([
+        Reaction(target_type=target_type, target_id=target_id, user_id=user_id, kind=kind)
+        for target_id, kind in current.items() if kind is not None
+    ], ignore_conflicts=True)
+    record_reaction_changes(target_type, [
+        (target_id, initial.get(target_id), kind) for target_id, kind in current.items()
+        if kind != initial.get(target_id)
+    ])
+    return results
+
+
+def toggle_favorites(user, toggles):
+    """Apply ``(action_id, post_id)`` toggles as FavoritePostView would, with one delete and one insert."""
+    if not toggles:
+        return {}
+    profile_id = UserProfile.objects.filter(user=user).values_list('pk', flat=True).first()
+    post_ids = {post_id for _, post_id in toggles}
+    existing = set(Post.objects.filter(pk__in=post_ids).values_list('pk', flat=True))
+    initial = set(FavoritePost.objects.filter(userprofile_id=profile_id, post_id__in=existing)
+                  .values_list('post_id', flat=True))
+
+    current = set(initial)
+    results = {}
+    for action_id, post_id in toggles:
+        if post_id not in existing or profile_id is None:
+            results[action_id] = (status.HTTP_400_BAD_REQUEST, {
+                'post_id': [FavoritePostSerializer.default_error_messages['does_not_exist']]})
+            continue
+        current ^= {post_id}
+        results[action_id] = (status.HTTP_200_OK, {'id': post_id, 'favorite': post_id in current})
+
+    FavoritePost.objects.filter(userprofile_id=profile_id, post_id__in=initial - current).delete()
+    FavoritePost.objects.bulk_create([
+        FavoritePost(userprofile_id=profile_id, post_id=post_id) for post_id in current - initial
+    ], ignore_conflicts=True)
+    return results
+
+
+def create_comments(request, comments):
+    """
+    Create ``(action_id, CommentActionSerializer data)`` comments and replies
+    with one insert, then add them to their post's and parent's counters as
+    CommentCreateAPIView does. Returns results by action id.
+    """
+    if not comments:
+        return {}
+    posts = Post.objects.only('pk', 'user_id', 'pinned_comment_id').in_bulk(
+        {data['post'] for _, data in comments})
+    parents = PostComment.objects.only('pk').in_bulk(
+        {data['comment'] for _, data in comments if data.get('comment')})
+    mentioned = set(User.objects.filter(pk__in={data['mentioned_user'] for _, data in comments
+                                                if data.get('mentioned_user')}).values_list('pk', flat=True))
+
+    results, created = {}, []
+    does_not_exist = serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+    for action_id, data in comments:
+        missing = {field: [does_not_exist.format(pk_value=data[field])] for field, found in [
+            ('post', data['post'] in posts),
+            ('comment', not data.get('comment') or data['comment'] in parents),
+            ('mentioned_user', not data.get('mentioned_user') or data['mentioned_user'] in mentioned),
+        ] if not found}
+        if missing:
+            results[action_id] = (status.HTTP_400_BAD_REQUEST, missing)
+            continue
+        created.append((action_id, PostComment(
+            user=request.user, post=posts[data['post']], comment_id=data.get('comment'),
+            mentioned_user_id=data.get('mentioned_user'), text=data['text'])))
+    if not created:
+        return results
+
+    PostComment.objects.bulk_create([comment for _, comment in created])
+    comments_counts = Counter(comment.post_id for _, comment in created if comment.comment_id is None)
+    for post_id, count in comments_counts.items():
+        adjust_post_counters(post_id, comments_count=count)
+    replies_counts = Counter(comment.comment_id for _, comment in created if comment.comment_id is not None)
+    for comment_id, count in replies_counts.items():
+        adjust_comment_counters(comment_id, replies_count=count)
+    replied_by_author = {comment.comment_id for _, comment in created
+                         if comment.comment_id is not None and comment.user_id == comment.post.user_id}
+    if replied_by_author:
+        PostComment.objects.filter(pk__in=replied_by_author).update(is_replied_by_author=True)
+
+    rendered = CommentListSerilaizer(
+        [comment for _, comment in created], many=True,
+        context={'request': request, 'user': request.user}).data
+    for (action_id, _), data in zip(created, rendered):
+        results[action_id] = (status.HTTP_201_CREATED, data)
+    return results
@@ -0,0 +1,93 @@
+from django.db.models import Count, Exists, F, Func, IntegerField, OuterRef, Q, Subquery
+
+from .models import Post, PostComment, Reaction
+
+
+POST_COUNTER_FIELDS = ('likes_count', 'dislikes_count', 'comments_count')
+COMMENT_COUNTER_FIELDS = ('likes_count', 'dislikes_count', 'replies_count', 'is_replied_by_author')
+
+
+def adjust_post_counters(post_id, **deltas):
+    """Increment the given ``<field>=<delta>`` counters on a post in place."""
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if updates:
+        Post.objects.filter(pk=post_id).update(**updates)
+
+
+def adjust_comment_counters(comment_id, **deltas):
+    """Increment the given ``<field>=<delta>`` counters on a comment in place."""
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if updates:
+        PostComment.objects.filter(pk=comment_id).update(**updates)
+
+
+def reply_created(reply):
+    """Account for a newly created reply on its parent comment."""
+    updates = {'replies_count': F('replies_count') + 1}
+    if reply.user_id is not None and reply.user_id == reply.post.user_id:
+        updates['is_replied_by_author'] = True
+    PostComment.objects.filter(pk=reply.comment_id).update(**updates)
+
+
+def reply_deleted(reply):
+    """Account for a deleted reply on its parent comment."""
+    updates = {'replies_count': F('replies_count') - 1}
+    if reply.user_id is not None and reply.user_id == reply.post.user_id:
+        updates['is_replied_by_author'] = _author_replied()
+    PostComment.objects.filter(pk=reply.comment_id).update(**updates)
+
+
+def annotate_true_post_counters(queryset):
+    """Annotate ``true_<field>`` with the counters computed from the source rows."""
+    return queryset.annotate(
+        true_likes_count=count_subquery(_reactions(Reaction.POST, Reaction.LIKE)),
+        true_dislikes_count=count_subquery(_reactions(Reaction.POST, Reaction.DISLIKE)),
+        true_comments_count=Count('comments', filter=Q(comments__comment=None), distinct=True),
+    )
+
+
+def _reactions(target_type, kind):
+    return Reaction.objects.filter(target_type=target_type, target_id=OuterRef('pk'), kind=kind)
+
+
+def count_subquery(queryset):
+    """A scalar subquery counting ``queryset``, usually filtered on an ``OuterRef``."""
+    counted = queryset.order_by().annotate(
+        total=Func(F('pk'), function='COUNT', output_field=IntegerField())
+    ).values('total')
+    return Subquery(counted)
+
+
+def _author_replied():
+    # A reply shares its parent's post, so compare against the reply's own post author
+    return Exists(PostComment.objects.filter(
+        comment=OuterRef('pk'), user_id=F('post__user_id')))
+
+
+def annotate_true_comment_counters(queryset):
+    """Annotate ``true_<field>`` with the counters computed from the source rows."""
+    return queryset.annotate(
+        true_likes_count=count_subquery(_reactions(Reaction.COMMENT, Reaction.LIKE)),
+        true_dislikes_count=count_subquery(_reactions(Reaction.COMMENT, Reaction.DISLIKE)),
+        true_replies_count=count_subquery(PostComment.objects.filter(comment=OuterRef('pk'))),
+        true_is_replied_by_author=_author_replied(),
+    )
+
+
+def recount_posts(post_ids):
+    """Overwrite the counters of the given posts with values recounted in the database."""
+    Post.objects.filter(pk__in=post_ids).update(
+        likes_count=count_subquery(_reactions(Reaction.POST, Reaction.LIKE)),
+        dislikes_count=count_subquery(_reactions(Reaction.POST, Reaction.DISLIKE)),
+        comments_count=count_subquery(PostComment.objects.filter(post=OuterRef('pk'), comment=None)),
+    )
+
+
+def recount_comments(comment_ids):
+    """Overwrite the counters of the given comments with values recounted in the database."""
+    PostComment.objects.filter(pk__in=comment_ids).update(
+        likes_count=count_subquery(_reactions(Reaction.COMMENT, Reaction.LIKE)),
+        dislikes_count=count_subquery(_reactions(Reaction.COMMENT, Reaction.DISLIKE)),
+        replies_count=count_subquery(PostComment.objects.filter(comment=OuterRef('pk'))),
+        is_replied_by_author=_author_replied(),
+    )
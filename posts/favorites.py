@@ -0,0 +1,39 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Post
+
+
+def toggle_favorite(user_id, post_id):
+    """
+    Add a post to the user's favorites or take it out, resolving the
+    profile inside the statements rather than loading the favorites: an
+    insert of the FavoritePost row with ON CONFLICT DO NOTHING RETURNING,
+    and only when it was there already a delete. Returns whether the post
+    is a favorite afterwards, raises Post.DoesNotExist when there is no such
+    post (or the user has no profile).
+    """
+    from profiles.models import FavoritePost, UserProfile
+    quote = connection.ops.quote_name
+    favorites = quote(FavoritePost._meta.db_table)
+    profiles = quote(UserProfile._meta.db_table)
+    posts = quote(Post._meta.db_table)
+    profile_id = f'(SELECT id FROM {profiles} WHERE user_id = %s)'
+    favorited_at = connection.ops.adapt_datetimefield_value(timezone.now())
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # SQLite needs the WHERE to parse an upsert of a SELECT
+        cursor.execute(
+            f'INSERT INTO {favorites} (userprofile_id, post_id, favorited_at) '
+            f'SELECT {profile_id}, %s, %s WHERE EXISTS (SELECT 1 FROM {posts} WHERE id = %s) '
+            f'AND {profile_id} IS NOT NULL '
+            f'ON CONFLICT (userprofile_id, post_id) DO NOTHING RETURNING id',
+            [user_id, post_id, favorited_at, post_id, user_id])
+        if cursor.fetchone() is not None:
+            return True
+        cursor.execute(
+            f'DELETE FROM {favorites} WHERE userprofile_id = {profile_id} AND post_id = %s RETURNING id',
+            [user_id, post_id])
+        if cursor.fetchone() is None:
+            raise Post.DoesNotExist
+    return False
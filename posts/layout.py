@@ -0,0 +1,111 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import Post
+
+
+LAYOUT_VERSION = 1
+
+
+def image_ratios(sizes):
+    """
+    Displayed aspect ratios from (thumbnail_width, thumbnail_height,
+    image_width, image_height) rows. Thumbnails follow the EXIF orientation,
+    so their size wins once rendered; unknown sizes count as square.
+    """
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 4)
+    rendered = sizes[:, 1] > 0
+    widths = np.where(rendered, sizes[:, 0], sizes[:, 2])
+    heights = np.where(rendered, sizes[:, 1], sizes[:, 3])
+    return np.divide(widths, heights, out=np.ones_like(widths), where=(widths > 0) & (heights > 0))
+
+
+def partition_rows(ratios, width, target_height, gap):
+    """
+    Split the images into consecutive rows whose heights, once each row is
+    stretched to ``width``, stay closest to ``target_height``: a linear
+    partition minimizing the summed squared relative height error, where the
+    height of every candidate row ending at an image comes from one prefix
+    sum difference.
+    """
+    count = len(ratios)
+    prefix = np.concatenate([[0.0], np.cumsum(ratios)])
+    best = np.full(count + 1, np.inf)
+    best[0] = 0.0
+    previous = np.zeros(count + 1, dtype=np.int64)
+    for end in range(1, count + 1):
+        starts = np.arange(end)
+        heights = (width - gap * (end - starts - 1)) / (prefix[end] - prefix[starts])
+        costs = best[:end] + np.where(heights > 0, ((heights - target_height) / target_height) ** 2, np.inf)
+        previous[end] = np.argmin(costs)
+        best[end] = costs[previous[end]]
+
+    rows, end = [], count
+    while end > 0:
+        rows.append((int(previous[end]), end))
+        end = previous[end]
+    return rows[::-1]
+
+
+def justify(ratios, width, target_height, gap, max_scale):
+    """
+    Boxes ``[left, top, width, height]`` of the images laid out in justified
+    rows ``width`` pixels wide, and the total height. Rows taller than
+    ``max_scale`` times the target are capped and centered instead.
+    """
+    boxes = np.zeros((len(ratios), 4), dtype=np.int64)
+    top = 0
+    for start, end in partition_rows(ratios, width, target_height, gap):
+        row = ratios[start:end]
+        gaps = gap * (end - start - 1)
+        height = min((width - gaps) / row.sum(), target_height * max_scale)
+        widths = row * height
+        # Edges are rounded rather than widths, so rows keep their exact width
+        lefts = (width - widths.sum() - gaps) / 2 + np.concatenate([[0.0], np.cumsum(widths + gap)[:-1]])
+        rounded_lefts = np.rint(lefts).astype(np.int64)
+        boxes[start:end, 0] = rounded_lefts
+        boxes[start:end, 1] = top
+        boxes[start:end, 2] = np.rint(lefts + widths).astype(np.int64) - rounded_lefts
+        boxes[start:end, 3] = round(height)
+        top += round(height) + gap
+    return boxes, max(top - gap, 0)
+
+
+def compute_layout(images):
+    """
+    The images_layout of a post from its ``(id, thumbnail_width,
+    thumbnail_height, image_width, image_height)`` rows in display order:
+    the image ids, then the boxes of each in every POST_LAYOUT_ROW_HEIGHTS
+    viewport width.
+    """
+    images = list(images)
+    if not images:
+        return {}
+    ratios = image_ratios([sizes for _, *sizes in images])
+    widths = {}
+    for width, target_height in settings.POST_LAYOUT_ROW_HEIGHTS.items():
+        boxes, height = justify(
+            ratios, width, target_height, settings.POST_LAYOUT_GAP, settings.POST_LAYOUT_MAX_ROW_SCALE)
+        widths[str(width)] = {'height': height, 'boxes': boxes.tolist()}
+    return {
+        'version': LAYOUT_VERSION,
+        'images': [image_id for image_id, *_ in images],
+        'widths': widths,
+    }
+
+
+def update_post_layout(post_id):
+    """Recompute and store the images_layout of a post."""
+    from images.models import Image
+    if post_id is None:
+        return
+    images = Image.objects.filter(post_id=post_id).order_by('order_id', 'pk').values_list(
+        'pk', 'thumbnail_width', 'thumbnail_height', 'image_width', 'image_height')
+    # A plain update, leaving updated_at alone
+    Post.objects.filter(pk=post_id).update(images_layout=compute_layout(images))
+
+
+def schedule_post_layout(post_id):
+    """Recompute a post's layout once the current transaction commits and its images are final."""
+    transaction.on_commit(lambda: update_post_layout(post_id))
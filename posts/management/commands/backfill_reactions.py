@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.counters import recount_comments, recount_posts
+from posts.models import CommentLike, Post, PostComment, PostLike, Reaction
+from posts.reactions import drain_reaction_journal, rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = ('Move the PostLike and CommentLike rows into Reaction, then rebuild the reaction '
+            'aggregates and the like counters from it. Run once after migrating, it is safe to resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows moved, or targets rebuilt, per transaction.')
+
+    def handle(self, *args, batch_size, **options):
+        moved = 0
+        for legacy, target_type, target_field in [
+            (PostLike, Reaction.POST, 'post_id'),
+            (CommentLike, Reaction.COMMENT, 'comment_id'),
+        ]:
+            moved += self.move(legacy, target_type, target_field, batch_size)
+
+        # Rebuilt counts include the journaled taps, applying them afterwards would count them twice
+        drain_reaction_journal()
+        rebuilt = 0
+        for model, target_type, recount in [
+            (Post, Reaction.POST, recount_posts),
+            (PostComment, Reaction.COMMENT, recount_comments),
+        ]:
+            rebuilt += self.rebuild(model, target_type, recount, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} reaction(s), rebuilt the counts of {rebuilt} post(s) and comment(s)'))
+
+    def move(self, legacy, target_type, target_field, batch_size):
+        """
+        Copy and delete the legacy rows a batch at a time, each batch its own
+        short transaction. Moved rows cannot be copied twice, and a reaction
+        the user already set again since the deploy wins over its legacy row.
+        """
+        moved = 0
+        while True:
+            with transaction.atomic():
+                rows = list(legacy.objects.order_by('id').values_list(
+                    'id', target_field, 'user_id', 'like')[:batch_size])
+                if not rows:
+                    return moved
+                Reaction.objects.bulk_create([
+                    Reaction(target_type=target_type, target_id=target_id, user_id=user_id,
+                             kind=Reaction.LIKE if like else Reaction.DISLIKE)
+                    for _, target_id, user_id, like in rows
+                ], ignore_conflicts=True)
+                legacy.objects.filter(id__in=[row[0] for row in rows]).delete()
+            moved += len(rows)
+
+    def rebuild(self, model, target_type, recount, batch_size):
+        """Recount the aggregates and like counters of every target, taps during the move included."""
+        rebuilt = 0
+        last_id = 0
+        while True:
+            target_ids = list(
+                model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not target_ids:
+                return rebuilt
+            last_id = target_ids[-1]
+            with transaction.atomic():
+                rebuild_aggregates(target_type, target_ids)
+                recount(target_ids)
+            rebuilt += len(target_ids)
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.models import ClientAction
+
+
+class Command(BaseCommand):
+    help = 'Delete the stored bulk action results older than BULK_ACTION_EXPIRY_HOURS.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=settings.BULK_ACTION_EXPIRY_HOURS)
+        deleted, _ = ClientAction.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired action result(s)'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts.layout import update_post_layout
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute the server-side image layouts of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'posts', nargs='*', type=int,
+            help='Ids of the posts to recompute, all posts with images when omitted.')
+
+    def handle(self, *args, **options):
+        post_ids = options['posts'] or Post.objects.filter(
+            image__isnull=False).distinct().order_by('pk').values_list('pk', flat=True)
+        computed = 0
+        for post_id in post_ids:
+            update_post_layout(post_id)
+            computed += 1
+        self.stdout.write(self.style.SUCCESS(f'Computed {computed} layout(s)'))
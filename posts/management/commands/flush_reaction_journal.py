@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.reactions import drain_reaction_journal
+
+
+class Command(BaseCommand):
+    help = (
+        'Apply the journaled reaction changes of REACTION_WRITE_BEHIND to the aggregates and '
+        'counters, the out-of-process flusher and the recovery after a crash.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch', type=float, metavar='SECONDS',
+            help='Keep flushing every SECONDS instead of exiting once drained.')
+        parser.add_argument(
+            '--batch-size', type=int,
+            help='Journal rows applied per transaction, REACTION_FLUSH_BATCH by default.')
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = drain_reaction_journal(options['batch_size'])
+            if flushed:
+                self.stdout.write(self.style.SUCCESS(f'Applied {flushed} reaction change(s)'))
+            if options['watch'] is None:
+                break
+            time.sleep(options['watch'])
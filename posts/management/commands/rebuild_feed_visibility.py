@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.visibility import rebuild_visibility
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed friends / friends of friends visibility index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of viewers to rebuild per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = list(get_user_model().objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(user_ids), batch_size):
+            rebuild_visibility(user_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt visibility for {len(user_ids)} user(s)'))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import TimelineEntry
+from posts.timeline import backfill_timeline, friend_ids
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized home timelines from the visibility index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'users', nargs='*', type=int,
+            help='Ids of the users to rebuild, all users when omitted.')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+        rebuilt = 0
+        for user_id in user_ids:
+            with transaction.atomic():
+                TimelineEntry.objects.filter(viewer_id=user_id).delete()
+                backfill_timeline(user_id, [user_id, *friend_ids(user_id)], settings.TIMELINE_MAX_ENTRIES)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} timeline(s)'))
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:28
+
+from django.db import migrations, models
+from django.db.models import F, Func, IntegerField, OuterRef, Subquery
+
+
+def _count(queryset):
+    return Subquery(queryset.order_by().annotate(
+        total=Func(F('pk'), function='COUNT', output_field=IntegerField())
+    ).values('total'))
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    PostLike = apps.get_model('posts', 'PostLike')
+    PostComment = apps.get_model('posts', 'PostComment')
+    Post.objects.update(
+        likes_count=_count(PostLike.objects.filter(post=OuterRef('pk'), like=True)),
+        dislikes_count=_count(PostLike.objects.filter(post=OuterRef('pk'), like=False)),
+        comments_count=_count(PostComment.objects.filter(post=OuterRef('pk'), comment=None)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_alter_commentlike_comment_alter_post_user_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='dislikes_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
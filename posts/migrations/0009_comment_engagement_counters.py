@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:29
+
+from django.db import migrations, models
+from django.db.models import Exists, F, Func, IntegerField, OuterRef, Subquery
+
+
+def _count(queryset):
+    return Subquery(queryset.order_by().annotate(
+        total=Func(F('pk'), function='COUNT', output_field=IntegerField())
+    ).values('total'))
+
+
+def backfill_counters(apps, schema_editor):
+    PostComment = apps.get_model('posts', 'PostComment')
+    CommentLike = apps.get_model('posts', 'CommentLike')
+    PostComment.objects.update(
+        likes_count=_count(CommentLike.objects.filter(comment=OuterRef('pk'), like=True)),
+        dislikes_count=_count(CommentLike.objects.filter(comment=OuterRef('pk'), like=False)),
+        replies_count=_count(PostComment.objects.filter(comment=OuterRef('pk'))),
+        is_replied_by_author=Exists(PostComment.objects.filter(
+            comment=OuterRef('pk'), user_id=F('post__user_id'))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_post_engagement_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postcomment',
+            name='dislikes_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postcomment',
+            name='is_replied_by_author',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postcomment',
+            name='likes_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='postcomment',
+            name='replies_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
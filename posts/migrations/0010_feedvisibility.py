@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:32
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_visibility(apps, schema_editor):
+    UserProfile = apps.get_model('profiles', 'UserProfile')
+    FeedVisibility = apps.get_model('posts', 'FeedVisibility')
+
+    friends = defaultdict(set)
+    rows = UserProfile.friends.through.objects.filter(
+        from_userprofile__user__isnull=False, to_userprofile__user__isnull=False,
+    ).values_list('from_userprofile__user_id', 'to_userprofile__user_id')
+    for user_id, friend_id in rows:
+        friends[user_id].add(friend_id)
+
+    visibility = []
+    for viewer_id, direct in friends.items():
+        indirect = set().union(*(friends[friend_id] for friend_id in direct)) - direct - {viewer_id}
+        visibility += [FeedVisibility(viewer_id=viewer_id, author_id=author_id, distance=1)
+                       for author_id in direct]
+        visibility += [FeedVisibility(viewer_id=viewer_id, author_id=author_id, distance=2)
+                       for author_id in indirect]
+    FeedVisibility.objects.bulk_create(visibility, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_comment_engagement_counters'),
+        ('profiles', '0002_userprofile_favorite_posts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedVisibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.PositiveSmallIntegerField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('viewer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('viewer', 'author')},
+            },
+        ),
+        migrations.RunPython(build_visibility, migrations.RunPython.noop),
+    ]
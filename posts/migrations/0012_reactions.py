@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_timelineentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReactionAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_type', models.PositiveSmallIntegerField(choices=[(1, 'Post'), (2, 'Comment')])),
+                ('target_id', models.PositiveBigIntegerField()),
+                ('like_count', models.IntegerField(default=0)),
+                ('dislike_count', models.IntegerField(default=0)),
+                ('love_count', models.IntegerField(default=0)),
+                ('haha_count', models.IntegerField(default=0)),
+                ('wow_count', models.IntegerField(default=0)),
+                ('sad_count', models.IntegerField(default=0)),
+                ('angry_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('target_type', 'target_id'), name='reaction_aggregate_target_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Reaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_type', models.PositiveSmallIntegerField(choices=[(1, 'Post'), (2, 'Comment')])),
+                ('target_id', models.PositiveBigIntegerField()),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'like'), (2, 'dislike'), (3, 'love'), (4, 'haha'), (5, 'wow'), (6, 'sad'), (7, 'angry')])),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('target_type', 'target_id', 'user'), name='reaction_target_user_uniq')],
+            },
+        ),
+    ]
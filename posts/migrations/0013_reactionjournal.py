@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_reactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReactionJournal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_type', models.PositiveSmallIntegerField(choices=[(1, 'Post'), (2, 'Comment')])),
+                ('target_id', models.PositiveBigIntegerField()),
+                ('previous_kind', models.PositiveSmallIntegerField(choices=[(1, 'like'), (2, 'dislike'), (3, 'love'), (4, 'haha'), (5, 'wow'), (6, 'sad'), (7, 'angry')], null=True)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'like'), (2, 'dislike'), (3, 'love'), (4, 'haha'), (5, 'wow'), (6, 'sad'), (7, 'angry')], null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['target_type', 'target_id'], name='reaction_journal_target_idx')],
+            },
+        ),
+    ]
@@ -13,7 +13,30 @@ class Audience(models.Model):
     users = models.ManyToManyField(User, related_name='audience_users')
 
 
-class Post(models.Model):
+class DenormalizedFieldsModel(models.Model):
+    """
+    ``denormalized_fields`` are maintained by in-place updates and left out of
+    saves of existing rows, so a stale instance cannot write old values back
+    over concurrent changes. Name them in ``update_fields`` to save them.
+    """
+    denormalized_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.denormalized_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Post(DenormalizedFieldsModel):
+    # Counters of posts.counters, layout of posts.layout, pull flag of posts.timeline
+    denormalized_fields = ('likes_count', 'dislikes_count', 'comments_count', 'images_layout', 'pulled')
+
     created_at = models.DateTimeField(
         auto_now_add=True, editable=False, null=False, blank=False)
     updated_at = models.DateTimeField(
@@ -33,13 +56,30 @@ class Post(models.Model):
     custom_audience = models.ForeignKey(
         Audience, null=True, blank=True, on_delete=models.SET_NULL)
     images_layout = models.JSONField(default=dict, blank=True, null=True)
-    
+    # Denormalized engagement counters, maintained by posts.counters
+    likes_count = models.IntegerField(default=0, editable=False)
+    dislikes_count = models.IntegerField(default=0, editable=False)
+    comments_count = models.IntegerField(default=0, editable=False)
+    # Not fanned out to friends' timelines, readers pull it, see posts.timeline
+    pulled = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], condition=models.Q(pulled=True), name='post_pulled_user_idx'),
+        ]
+
     @property
     def images_count(self):
+        # Annotated by posts.queries.post_list_queryset
+        if hasattr(self, 'num_images'):
+            return self.num_images
         return self.image_set.count()
 
 
-class PostComment(models.Model):
+class PostComment(DenormalizedFieldsModel):
+    # Counters and flag of posts.counters
+    denormalized_fields = ('likes_count', 'dislikes_count', 'replies_count', 'is_replied_by_author')
+
     text = models.TextField(default='')
     user = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
@@ -48,6 +88,11 @@ class PostComment(models.Model):
     mentioned_user = models.ForeignKey(
         User, null=True, default=None, on_delete=models.SET_NULL, related_name='reply_reply')
     is_liked_by_author = models.BooleanField(default=False)
+    # Denormalized counters, maintained by posts.counters
+    likes_count = models.IntegerField(default=0, editable=False)
+    dislikes_count = models.IntegerField(default=0, editable=False)
+    replies_count = models.IntegerField(default=0, editable=False)
+    is_replied_by_author = models.BooleanField(default=False, editable=False)
     created_at = models.DateTimeField(
         auto_now_add=True, editable=False, null=False, blank=False)
     updated_at = models.DateTimeField(
@@ -70,3 +115,135 @@ class CommentLike(models.Model):
 
     class Meta:
         unique_together = ('comment', 'user',)
+
+
+class Reaction(models.Model):
+    """
+    A user's reaction to a post or a comment, stored as small-int codes and
+    written by posts.reactions. Supersedes PostLike and CommentLike, whose rows
+    the backfill_reactions command moves here.
+    """
+    POST = 1
+    COMMENT = 2
+    TARGET_TYPE_CHOICES = [
+        (POST, 'Post'),
+        (COMMENT, 'Comment'),
+    ]
+    LIKE = 1
+    DISLIKE = 2
+    LOVE = 3
+    HAHA = 4
+    WOW = 5
+    SAD = 6
+    ANGRY = 7
+    KIND_CHOICES = [
+        (LIKE, 'like'),
+        (DISLIKE, 'dislike'),
+        (LOVE, 'love'),
+        (HAHA, 'haha'),
+        (WOW, 'wow'),
+        (SAD, 'sad'),
+        (ANGRY, 'angry'),
+    ]
+
+    # Kept when the user is deleted, like the rows it replaces, so counts stay put
+    user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='reactions')
+    target_type = models.PositiveSmallIntegerField(choices=TARGET_TYPE_CHOICES)
+    target_id = models.PositiveBigIntegerField()
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['target_type', 'target_id', 'user'], name='reaction_target_user_uniq'),
+        ]
+
+
+class ReactionAggregate(models.Model):
+    """The reaction counts of one post or comment by kind, so a breakdown is a single-row read."""
+    target_type = models.PositiveSmallIntegerField(choices=Reaction.TARGET_TYPE_CHOICES)
+    target_id = models.PositiveBigIntegerField()
+    like_count = models.IntegerField(default=0)
+    dislike_count = models.IntegerField(default=0)
+    love_count = models.IntegerField(default=0)
+    haha_count = models.IntegerField(default=0)
+    wow_count = models.IntegerField(default=0)
+    sad_count = models.IntegerField(default=0)
+    angry_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['target_type', 'target_id'], name='reaction_aggregate_target_uniq'),
+        ]
+
+    @staticmethod
+    def count_field(kind):
+        """The column counting reactions of ``kind``."""
+        return f'{dict(Reaction.KIND_CHOICES)[kind]}_count'
+
+    def breakdown(self):
+        return {name: getattr(self, f'{name}_count') for _, name in Reaction.KIND_CHOICES}
+
+
+class ReactionJournal(models.Model):
+    """
+    A reaction change whose counts are not applied yet, written in the tap's
+    transaction when REACTION_WRITE_BEHIND is on and folded into the
+    aggregate and counters by posts.reactions.flush_reaction_journal.
+    """
+    target_type = models.PositiveSmallIntegerField(choices=Reaction.TARGET_TYPE_CHOICES)
+    target_id = models.PositiveBigIntegerField()
+    # None when the user had no reaction before, or has none after
+    previous_kind = models.PositiveSmallIntegerField(choices=Reaction.KIND_CHOICES, null=True)
+    kind = models.PositiveSmallIntegerField(choices=Reaction.KIND_CHOICES, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['target_type', 'target_id'], name='reaction_journal_target_idx'),
+        ]
+
+
+class ClientAction(models.Model):
+    """
+    An action replayed through the bulk actions endpoint under its
+    client-supplied id, kept with its result so a retry returns that result
+    instead of running the action again. See posts.bulk_actions.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    action_id = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField()
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'action_id'], name='client_action_user_uniq'),
+        ]
+
+
+class FeedVisibility(models.Model):
+    """
+    Precomputed friendship distance from a viewer to an author, one row per
+    direction, maintained by posts.visibility. Backs the friends (2) and
+    friends of friends (3) audiences with a single indexed lookup.
+    """
+    viewer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    # 1-friends, 2-friends of friends
+    distance = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('viewer', 'author',)
+
+
+class TimelineEntry(models.Model):
+    """A post fanned out to a viewer's home timeline, maintained by posts.timeline."""
+    viewer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Copy of post.created_at so a timeline page is one (viewer, created_at) range scan
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('viewer', 'post',)
+        indexes = [
+            models.Index(fields=['viewer', '-created_at', '-post'], name='timeline_viewer_created_idx'),
+        ]
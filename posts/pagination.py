@@ -0,0 +1,132 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a composite ordering that never counts rows.
+
+    The cursor holds the ordering values of the last row of a page and the next
+    page is fetched with a lexicographic "after this row" filter, so every page
+    costs the same no matter how deep the client scrolls. The ordering is taken
+    from the queryset (falling back to ``ordering``) and always ends in the
+    primary key so positions are unique. Requests that pass ``offset`` are
+    served by ``LimitOffsetPagination`` as before.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+    offset_pagination_class = LimitOffsetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.offset_paginator = None
+        if self.offset_pagination_class.offset_query_param in request.query_params:
+            self.offset_paginator = self.offset_pagination_class()
+            return self.offset_paginator.paginate_queryset(queryset, request, view)
+
+        self.page_size = self.get_page_size(request)
+        self.keyset = self.get_ordering(queryset)
+        queryset = queryset.order_by(*self.keyset)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_position_filter(position))
+            except (TypeError, ValueError, ValidationError):
+                # Values that do not fit the ordering fields
+                raise NotFound(self.invalid_cursor_message)
+
+        # Fetch one extra row to learn whether there is a next page
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        if self.offset_paginator is not None:
+            return self.offset_paginator.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.limit_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, queryset):
+        ordering = [field for field in queryset.query.order_by] or list(self.ordering)
+        for field in ordering:
+            if not isinstance(field, str) or '__' in field:
+                raise TypeError(
+                    f'{self.__class__.__name__} needs plain field or annotation names '
+                    f'to order by, got {field!r}')
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            # Break ties on the primary key in the direction of the last field
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        return ordering
+
+    def get_position_filter(self, position):
+        position_filter = Q()
+        for index, field in enumerate(self.keyset):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f'{name}__{lookup}': position[index]})
+            for previous_index, previous_field in enumerate(self.keyset[:index]):
+                clause &= Q(**{previous_field.lstrip('-'): position[previous_index]})
+            position_filter |= clause
+        return position_filter
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        position = [getattr(last, field.lstrip('-')) for field in self.keyset]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position))
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in position]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.keyset):
+            raise NotFound(self.invalid_cursor_message)
+        return position
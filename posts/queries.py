@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.db.models import OuterRef, Prefetch
+
+from images.models import Image
+from images.queries import image_list_queryset
+from .counters import count_subquery
+
+
+def post_list_queryset(queryset):
+    """
+    Posts with everything PostListSerializer renders loaded up front, so a page
+    costs the same handful of queries whatever its size or image count.
+    """
+    return queryset.select_related('user__userprofile').prefetch_related(
+        'tags',
+        Prefetch('tagged_friends', queryset=get_user_model().objects.select_related('userprofile')),
+        Prefetch('image_set', queryset=image_list_queryset()),
+    ).annotate(
+        num_images=count_subquery(Image.objects.filter(post=OuterRef('pk'))),
+    )
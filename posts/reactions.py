@@ -0,0 +1,303 @@
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count
+
+from .models import Post, PostComment, Reaction, ReactionAggregate, ReactionJournal
+from .visibility import visibility_filter
+
+logger = logging.getLogger(__name__)
+
+
+TARGET_MODELS = {
+    Reaction.POST: Post,
+    Reaction.COMMENT: PostComment,
+}
+KIND_CODES = {name: kind for kind, name in Reaction.KIND_CHOICES}
+COUNT_FIELDS = [ReactionAggregate.count_field(kind) for kind, _ in Reaction.KIND_CHOICES]
+
+
+def visible_targets(target_type, viewer_id):
+    """The posts, or the comments on the posts, ``viewer_id`` may see and react to."""
+    visible = Post.objects.filter(visibility_filter(viewer_id))
+    return visible if target_type == Reaction.POST else PostComment.objects.filter(post__in=visible)
+
+
+def like_value(kind):
+    """The legacy like flag of a reaction kind: True for a like, False for a dislike, None otherwise."""
+    return {Reaction.LIKE: True, Reaction.DISLIKE: False}.get(kind)
+
+
+def toggle_reaction(target_type, target_id, user_id, kind):
+    """
+    Apply a ``kind`` tap of ``user_id`` on a post or comment in raw statements
+    that report their own effect: the reaction is deleted with RETURNING to
+    learn the previous one, inserted again with ON CONFLICT DO NOTHING unless
+    the tap undid it, and the aggregate row upserted with RETURNING. Tapping
+    the current reaction removes it, tapping another one switches. The
+    target's likes_count and dislikes_count follow likes and dislikes.
+
+    With REACTION_WRITE_BEHIND the aggregate and counters are left alone:
+    the change is journaled in the same transaction and the counts returned
+    are the stored ones plus the pending changes, this one included.
+
+    Returns ``(breakdown, reaction)``: the counts by kind name and the
+    viewer's reaction kind afterwards or None. Raises the target's
+    DoesNotExist when there is no such post or comment.
+    """
+    target_model = TARGET_MODELS[target_type]
+    quote = connection.ops.quote_name
+    reactions = quote(Reaction._meta.db_table)
+    targets = quote(target_model._meta.db_table)
+    user_column = quote(Reaction._meta.get_field('user').column)
+    key = [target_type, target_id, user_id]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # The delete takes the reaction's row (SQLite: the write) lock, so
+        # concurrent taps of one user queue behind it instead of racing
+        cursor.execute(
+            f'DELETE FROM {reactions} WHERE target_type = %s AND target_id = %s AND {user_column} = %s '
+            f'RETURNING kind', key)
+        row = cursor.fetchone()
+        previous = None if row is None else row[0]
+        current = None if previous == kind else kind
+
+        if current is not None:
+            # SQLite needs the WHERE to parse an upsert of a SELECT
+            cursor.execute(
+                f'INSERT INTO {reactions} (target_type, target_id, {user_column}, kind) '
+                f'SELECT %s, %s, %s, %s WHERE EXISTS (SELECT 1 FROM {targets} WHERE id = %s) '
+                f'ON CONFLICT (target_type, target_id, {user_column}) DO NOTHING RETURNING kind',
+                key + [kind, target_id])
+            if cursor.fetchone() is None:
+                cursor.execute(
+                    f'SELECT kind FROM {reactions} WHERE target_type = %s AND target_id = %s AND {user_column} = %s',
+                    key)
+                row = cursor.fetchone()
+                if row is None:
+                    raise target_model.DoesNotExist
+                # A concurrent tap inserted first and counted itself, this one adds nothing
+                previous = current = row[0]
+
+        if settings.REACTION_WRITE_BEHIND:
+            if previous != current:
+                record_reaction_changes(target_type, [(target_id, previous, current)])
+            return reaction_breakdown(target_type, target_id), current
+
+        deltas = _count_deltas([(target_id, previous, current)])[target_id]
+        counts = _apply_counts(cursor, target_type, target_id, deltas)
+    return {name: count for (_, name), count in zip(Reaction.KIND_CHOICES, counts)}, current
+
+
+def record_reaction_changes(target_type, changes):
+    """
+    Account for ``(target_id, previous kind, kind)`` changes of reactions
+    already written: journaled with REACTION_WRITE_BEHIND, otherwise applied
+    to the aggregates and counters with one upsert and update per target.
+    """
+    if settings.REACTION_WRITE_BEHIND:
+        ReactionJournal.objects.bulk_create([
+            ReactionJournal(target_type=target_type, target_id=target_id, previous_kind=previous, kind=kind)
+            for target_id, previous, kind in changes
+        ])
+        transaction.on_commit(lambda: _journaled(len(changes)))
+        return
+    with connection.cursor() as cursor:
+        for target_id, deltas in sorted(_count_deltas(changes).items()):
+            if any(deltas.values()):
+                _apply_counts(cursor, target_type, target_id, deltas)
+
+
+def _count_deltas(changes):
+    """Fold ``(key, previous kind, kind)`` changes into count field deltas by key."""
+    deltas = defaultdict(lambda: dict.fromkeys(COUNT_FIELDS, 0))
+    for key, previous, kind in changes:
+        if previous is not None:
+            deltas[key][ReactionAggregate.count_field(previous)] -= 1
+        if kind is not None:
+            deltas[key][ReactionAggregate.count_field(kind)] += 1
+    return deltas
+
+
+def _apply_counts(cursor, target_type, target_id, deltas):
+    """
+    Add ``deltas`` by count field to a target's aggregate row in one upsert,
+    and the like and dislike ones to its likes_count and dislikes_count.
+    Returns the aggregate's counts in COUNT_FIELDS order.
+    """
+    quote = connection.ops.quote_name
+    aggregates = quote(ReactionAggregate._meta.db_table)
+    targets = quote(TARGET_MODELS[target_type]._meta.db_table)
+    columns = ', '.join(COUNT_FIELDS)
+    cursor.execute(
+        f'INSERT INTO {aggregates} (target_type, target_id, {columns}) '
+        f'VALUES (%s, %s, {", ".join(["%s"] * len(COUNT_FIELDS))}) '
+        f'ON CONFLICT (target_type, target_id) DO UPDATE SET '
+        f'{", ".join(f"{field} = {field} + excluded.{field}" for field in COUNT_FIELDS)} '
+        f'RETURNING {columns}',
+        [target_type, target_id] + [deltas[field] for field in COUNT_FIELDS])
+    counts = cursor.fetchone()
+
+    likes = deltas[ReactionAggregate.count_field(Reaction.LIKE)]
+    dislikes = deltas[ReactionAggregate.count_field(Reaction.DISLIKE)]
+    if likes or dislikes:
+        cursor.execute(
+            f'UPDATE {targets} SET likes_count = likes_count + %s, dislikes_count = dislikes_count + %s '
+            f'WHERE id = %s',
+            [likes, dislikes, target_id])
+    return counts
+
+
+def toggle_post_reaction(post_id, user_id, like):
+    """
+    Tap like (True) or dislike (False) on a post, see ``toggle_reaction``.
+    Returns ``(likes_count, dislikes_count, like)`` with the viewer's like flag afterwards.
+    """
+    breakdown, current = toggle_reaction(
+        Reaction.POST, post_id, user_id, Reaction.LIKE if like else Reaction.DISLIKE)
+    return breakdown['like'], breakdown['dislike'], like_value(current)
+
+
+def toggle_comment_reaction(comment_id, user_id, like):
+    """The comment counterpart of ``toggle_post_reaction``."""
+    breakdown, current = toggle_reaction(
+        Reaction.COMMENT, comment_id, user_id, Reaction.LIKE if like else Reaction.DISLIKE)
+    return breakdown['like'], breakdown['dislike'], like_value(current)
+
+
+def reaction_info(likes_count, dislikes_count, reaction):
+    """The like and dislike counts and viewer flags the likes endpoints answer with, from a toggle's result."""
+    return {
+        'likes_count': likes_count,
+        'dislikes_count': dislikes_count,
+        'liked': reaction is True,
+        'disliked': reaction is False,
+    }
+
+
+def reaction_breakdown(target_type, target_id):
+    """The counts by kind name of a post or comment, see ``reaction_breakdowns``."""
+    return reaction_breakdowns(target_type, [target_id])[target_id]
+
+
+def reaction_breakdowns(target_type, target_ids):
+    """
+    The counts by kind name of each given post or comment, from their
+    aggregate rows and, with REACTION_WRITE_BEHIND, their journaled changes
+    not flushed yet.
+    """
+    aggregates = {aggregate.target_id: aggregate for aggregate in
+                  ReactionAggregate.objects.filter(target_type=target_type, target_id__in=target_ids)}
+    pending = pending_counts(target_type, target_ids) if settings.REACTION_WRITE_BEHIND else {}
+    breakdowns = {}
+    for target_id in target_ids:
+        breakdown = aggregates.get(target_id, ReactionAggregate()).breakdown()
+        for name, delta in pending.get(target_id, {}).items():
+            breakdown[name] += delta
+        breakdowns[target_id] = breakdown
+    return breakdowns
+
+
+def rebuild_aggregates(target_type, target_ids):
+    """Overwrite the aggregate rows of the given targets with counts recomputed from their reactions."""
+    aggregates = {target_id: ReactionAggregate(target_type=target_type, target_id=target_id)
+                  for target_id in target_ids}
+    counts = (Reaction.objects.filter(target_type=target_type, target_id__in=target_ids)
+              .values_list('target_id', 'kind').annotate(total=Count('pk')).order_by())
+    for target_id, kind, total in counts:
+        setattr(aggregates[target_id], ReactionAggregate.count_field(kind), total)
+    ReactionAggregate.objects.bulk_create(
+        aggregates.values(), update_conflicts=True,
+        unique_fields=['target_type', 'target_id'], update_fields=COUNT_FIELDS)
+
+
+def pending_counts(target_type, target_ids):
+    """
+    The journaled count changes not flushed yet of the given targets, as
+    ``{target_id: {kind name: delta}}`` with targets without any left out.
+    """
+    pending = defaultdict(lambda: defaultdict(int))
+    rows = (ReactionJournal.objects.filter(target_type=target_type, target_id__in=target_ids)
+            .values_list('target_id', 'previous_kind', 'kind').annotate(total=Count('pk')).order_by())
+    names = dict(Reaction.KIND_CHOICES)
+    for target_id, previous, kind, total in rows:
+        if previous is not None:
+            pending[target_id][names[previous]] -= total
+        if kind is not None:
+            pending[target_id][names[kind]] += total
+    return pending
+
+
+def flush_reaction_journal(limit=None):
+    """
+    Fold up to ``limit`` (REACTION_FLUSH_BATCH) journaled changes into the
+    aggregates and counters, oldest first, one upsert and update per target
+    however many taps it got. The rows are claimed by deleting them with
+    RETURNING in the same transaction, so concurrent flushers never apply
+    one twice and a crash leaves them in the journal. Returns the count.
+    """
+    limit = limit or settings.REACTION_FLUSH_BATCH
+    journal = connection.ops.quote_name(ReactionJournal._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {journal} WHERE id IN (SELECT id FROM {journal} ORDER BY id LIMIT %s) '
+            f'RETURNING target_type, target_id, previous_kind, kind', [limit])
+        rows = cursor.fetchall()
+        deltas = _count_deltas(((target_type, target_id), previous, kind)
+                               for target_type, target_id, previous, kind in rows)
+        # In key order, so concurrent flushers lock the rows in the same order
+        for (target_type, target_id), target_deltas in sorted(deltas.items()):
+            if any(target_deltas.values()):
+                _apply_counts(cursor, target_type, target_id, target_deltas)
+    return len(rows)
+
+
+def drain_reaction_journal(limit=None):
+    """Flush the journal ``limit`` rows at a time until it is empty, returns the number of changes applied."""
+    limit = limit or settings.REACTION_FLUSH_BATCH
+    flushed = 0
+    while True:
+        count = flush_reaction_journal(limit)
+        flushed += count
+        if count < limit:
+            return flushed
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+_flush_wanted = threading.Event()
+_journaled_events = 0
+
+
+def _journaled(count=1):
+    """Count committed journal rows, starting the flusher or waking it early after REACTION_FLUSH_EVENTS."""
+    global _flusher, _journaled_events
+    if settings.REACTION_FLUSH_INTERVAL_MS <= 0:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run_flusher, name='reaction-flusher', daemon=True)
+            _flusher.start()
+        _journaled_events += count
+        if _journaled_events >= settings.REACTION_FLUSH_EVENTS:
+            _flush_wanted.set()
+
+
+def _run_flusher():
+    global _journaled_events
+    while True:
+        _flush_wanted.wait(settings.REACTION_FLUSH_INTERVAL_MS / 1000)
+        _flush_wanted.clear()
+        with _flusher_lock:
+            _journaled_events = 0
+        close_old_connections()
+        try:
+            drain_reaction_journal()
+        except Exception:
+            # The rows stay journaled, the next round retries them
+            logger.exception('Flushing the reaction journal failed')
+        finally:
+            close_old_connections()
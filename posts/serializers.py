@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from taggit.serializers import (TagListSerializerField,
@@ -6,7 +8,9 @@ from taggit.serializers import (TagListSerializerField,
 from images.serilaizers import ImageListSerializer
 from profiles.serializers import UserPublicSerializer
 
-from .models import Audience, Post, PostComment, PostLike, CommentLike
+from .models import Audience, Post, PostComment, Reaction
+from .timeline import fan_out_post
+from .viewer_state import ViewerStateListSerializer, get_viewer_id, get_viewer_state
 
 
 # COMMENTS
@@ -14,19 +18,17 @@ from .models import Audience, Post, PostComment, PostLike, CommentLike
 
 class CommentListSerilaizer(serializers.ModelSerializer):
     user = UserPublicSerializer()
-    likes_count = serializers.SerializerMethodField()
-    dislikes_count = serializers.SerializerMethodField()
+    likes_count = serializers.SerializerMethodField()  # Denormalized
+    dislikes_count = serializers.SerializerMethodField()  # Denormalized
     liked = serializers.SerializerMethodField()
     disliked = serializers.SerializerMethodField()
-    is_replied_by_author = serializers.SerializerMethodField()
-    replies_count = serializers.IntegerField(
-        source='replies.count',
-        read_only=True,
-    )
+    is_replied_by_author = serializers.BooleanField(read_only=True)  # Denormalized
+    replies_count = serializers.IntegerField(read_only=True)  # Denormalized
     is_pinned_by_author = serializers.SerializerMethodField()
 
     class Meta:
         model = PostComment
+        list_serializer_class = ViewerStateListSerializer
         fields = [
             'id',
             'text',
@@ -45,36 +47,19 @@ class CommentListSerilaizer(serializers.ModelSerializer):
         ]
 
     def get_likes_count(self, comment):
-        count = CommentLike.objects.filter(like=True, comment=comment).count()
-        return count
+        return get_viewer_state(self.context).comment_count(comment, 'likes_count')
 
     def get_dislikes_count(self, comment):
-        count = CommentLike.objects.filter(like=False, comment=comment).count()
-        return count
+        return get_viewer_state(self.context).comment_count(comment, 'dislikes_count')
 
     def get_liked(self, comment):
-        user = self.context.get('user')
-        if user:
-            liked = CommentLike.objects.filter(
-                like=True, comment=comment, user=user).exists()
-            return liked
-        return False
+        return get_viewer_state(self.context).comment_reaction(comment) is True
 
     def get_disliked(self, comment):
-        user = self.context.get('user')
-        if user:
-            disliked = CommentLike.objects.filter(
-                like=False, comment=comment, user=user).exists()
-            return disliked
-        return False
-
-    def get_is_replied_by_author(self, comment):
-        is_replied_by_author = PostComment.objects.filter(
-            comment=comment, user=comment.post.user).exists()
-        return is_replied_by_author
-    
+        return get_viewer_state(self.context).comment_reaction(comment) is False
+
     def get_is_pinned_by_author(self, comment):
-        return comment.post.pinned_comment == comment
+        return comment.post.pinned_comment_id == comment.id
 
 
 class CommentCreateSerilaizer(serializers.ModelSerializer):
@@ -121,10 +106,10 @@ class PostListSerializer(serializers.ModelSerializer):
     user = UserPublicSerializer(many=False, read_only=True)
     tagged_friends = UserPublicSerializer(many=True, read_only=True)
     tags = TagListSerializerField()
-    comments_count = serializers.IntegerField(read_only=True)  # Annotated
-    likes_count = serializers.IntegerField(read_only=True)  # Annotated
-    dislikes_count = serializers.IntegerField(read_only=True)  # Annotated
-    favorite = serializers.BooleanField() # Annotated
+    comments_count = serializers.IntegerField(read_only=True)  # Denormalized
+    likes_count = serializers.SerializerMethodField()  # Denormalized
+    dislikes_count = serializers.SerializerMethodField()  # Denormalized
+    favorite = serializers.SerializerMethodField()
     liked = serializers.SerializerMethodField()
     disliked = serializers.SerializerMethodField()
     audience = serializers.SerializerMethodField()
@@ -132,6 +117,7 @@ class PostListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
+        list_serializer_class = ViewerStateListSerializer
         fields = [
             'id',
             'title',
@@ -155,28 +141,29 @@ class PostListSerializer(serializers.ModelSerializer):
             'favorite'
         ]
 
+    def get_likes_count(self, post):
+        return get_viewer_state(self.context).post_count(post, 'likes_count')
+
+    def get_dislikes_count(self, post):
+        return get_viewer_state(self.context).post_count(post, 'dislikes_count')
+
     def get_liked(self, post):
-        user_id = self.context.get('user')
-        if user_id:
-            return PostLike.objects.filter(like=True, post=post, user_id=user_id).exists()
-        return False
+        return get_viewer_state(self.context).post_reaction(post) is True
 
     def get_disliked(self, post):
-        user_id = self.context.get('user')
-        if user_id:
-            return PostLike.objects.filter(like=False, post=post, user_id=user_id).exists()
-        return False
+        return get_viewer_state(self.context).post_reaction(post) is False
+
+    def get_favorite(self, post):
+        return get_viewer_state(self.context).is_favorite(post)
 
     def get_audience(self, post):
-        user_id = self.context.get('user')
-        if user_id and int(user_id) == post.user.id:
+        if get_viewer_id(self.context) == post.user_id:
             return post.audience
         return None
 
     def get_custom_audience(self, post):
-        user_id = self.context.get('user')
-        if user_id and int(user_id) == post.user.id and post.audience == 4:
-            return post.custom_audience.id if post.custom_audience else None
+        if get_viewer_id(self.context) == post.user_id and post.audience == 4:
+            return post.custom_audience_id
         return None
     
 
@@ -201,6 +188,10 @@ class PostCreateSerializer(TaggitSerializer, serializers.ModelSerializer):
             'tagged_friends',
             'images_layout'
         ]
+        # Computed from the images by posts.layout
+        read_only_fields = [
+            'images_layout'
+        ]
 
     def validate(self, attrs):
         audience = attrs.get('audience')
@@ -224,99 +215,74 @@ class PostCreateSerializer(TaggitSerializer, serializers.ModelSerializer):
             validated_data.pop('custom_audience', None)
         user_id = self.context['request'].user.id
         validated_data['user_id'] = user_id
-        return super().create(validated_data)
+        with transaction.atomic():
+            post = super().create(validated_data)
+            # Written once the post and its tagged friends are committed, outside the request's transaction
+            transaction.on_commit(lambda: fan_out_post(post))
+        return post
 
     def update(self, instance, validated_data):
         # Remove custom_audience if audience is not 4
         if validated_data.get('audience') != 4:
             validated_data.pop('custom_audience', None)
-        return super().update(instance, validated_data)
+        audience_changed = {'audience', 'custom_audience', 'tagged_friends'} & validated_data.keys()
+        post = super().update(instance, validated_data)
+        if audience_changed:
+            # New recipients get the post, the timeline query hides it from the ones no longer allowed
+            transaction.on_commit(lambda: fan_out_post(post))
+        return post
     
 # LIKES
 
 
-class PostLikeSerilaizer(serializers.ModelSerializer):
-    class Meta:
-        model = PostLike
-        fields = '__all__'
-
-
-class CommentLikeSerilaizer(serializers.ModelSerializer):
-    class Meta:
-        model = CommentLike
-        fields = '__all__'
+class ReactionToggleSerializer(serializers.Serializer):
+    """A like (true) or dislike (false) tap, see posts.reactions."""
+    like = serializers.BooleanField()
 
 
-class PostLikesInfoSerilaizer(serializers.ModelSerializer):
-    likes_count = serializers.SerializerMethodField()
-    dislikes_count = serializers.SerializerMethodField()
-    liked = serializers.SerializerMethodField()
-    disliked = serializers.SerializerMethodField()
-
-    class Meta:
-        model = CommentLike
-        fields = [
-            'likes_count',
-            'dislikes_count',
-            'liked',
-            'disliked',
-        ]
+class ReactionKindSerializer(serializers.Serializer):
+    """A tap of one reaction kind, by name, see posts.reactions."""
+    kind = serializers.ChoiceField(choices=[name for _, name in Reaction.KIND_CHOICES])
 
-    def get_likes_count(self, post):
-        count = PostLike.objects.filter(like=True, post=post).count()
-        return count
 
-    def get_dislikes_count(self, post):
-        count = PostLike.objects.filter(like=False, post=post).count()
-        return count
+class BulkActionSerializer(serializers.Serializer):
+    """The envelope of one action of a bulk request, its payload is validated by type in posts.bulk_actions."""
+    id = serializers.CharField(max_length=64)
+    type = serializers.ChoiceField(choices=['post_like', 'comment_like', 'favorite', 'comment'])
 
-    def get_liked(self, post):
-        user = self.context.get('request').user
-        liked = PostLike.objects.filter(
-            like=True, post=post, user=user).count() > 0
-        return liked
 
-    def get_disliked(self, post):
-        user = self.context.get('request').user
-        disliked = PostLike.objects.filter(
-            like=False, post=post, user=user).count() > 0
-        return disliked
+class BulkActionsSerializer(serializers.Serializer):
+    actions = serializers.ListField(child=serializers.DictField(), allow_empty=False)
 
+    def validate_actions(self, actions):
+        if len(actions) > settings.BULK_ACTIONS_MAX:
+            raise serializers.ValidationError(f'At most {settings.BULK_ACTIONS_MAX} actions per request.')
+        errors = {}
+        for index, action in enumerate(actions):
+            envelope = BulkActionSerializer(data=action)
+            if not envelope.is_valid():
+                errors[index] = envelope.errors
+        if errors:
+            raise serializers.ValidationError(errors)
+        if len({action['id'] for action in actions}) < len(actions):
+            raise serializers.ValidationError('Action ids must be unique.')
+        return actions
 
-class CommentLikesInfoSerilaizer(serializers.ModelSerializer):
-    likes_count = serializers.SerializerMethodField()
-    dislikes_count = serializers.SerializerMethodField()
-    liked = serializers.SerializerMethodField()
-    disliked = serializers.SerializerMethodField()
 
-    class Meta:
-        model = CommentLike
-        fields = [
-            'likes_count',
-            'dislikes_count',
-            'liked',
-            'disliked',
-        ]
+class PostLikeActionSerializer(ReactionToggleSerializer):
+    post = serializers.IntegerField()
 
-    def get_likes_count(self, comment):
-        count = CommentLike.objects.filter(like=True, comment=comment).count()
-        return count
 
-    def get_dislikes_count(self, comment):
-        count = CommentLike.objects.filter(like=False, comment=comment).count()
-        return count
+class CommentLikeActionSerializer(ReactionToggleSerializer):
+    comment = serializers.IntegerField()
 
-    def get_liked(self, comment):
-        user = self.context.get('request').user
-        liked = CommentLike.objects.filter(
-            like=True, comment=comment, user=user).count() > 0
-        return liked
 
-    def get_disliked(self, comment):
-        user = self.context.get('request').user
-        disliked = CommentLike.objects.filter(
-            like=False, comment=comment, user=user).count() > 0
-        return disliked
+class CommentActionSerializer(serializers.Serializer):
+    """The CommentCreateSerilaizer body, the related rows are looked up with the others of the request."""
+    text = serializers.CharField(allow_blank=True, default='')
+    post = serializers.IntegerField()
+    comment = serializers.IntegerField(required=False, allow_null=True)
+    mentioned_user = serializers.IntegerField(required=False, allow_null=True)
 
 
 class CommentLikeByAuthorSerializer(serializers.ModelSerializer):
@@ -332,13 +298,14 @@ class CommentLikeByAuthorSerializer(serializers.ModelSerializer):
 class ReplyListSerilaizer(serializers.ModelSerializer):
     user = UserPublicSerializer()
     mentioned_user = UserPublicSerializer()
-    likes_count = serializers.SerializerMethodField()
-    dislikes_count = serializers.SerializerMethodField()
+    likes_count = serializers.SerializerMethodField()  # Denormalized
+    dislikes_count = serializers.SerializerMethodField()  # Denormalized
     liked = serializers.SerializerMethodField()
     disliked = serializers.SerializerMethodField()
 
     class Meta:
         model = PostComment
+        list_serializer_class = ViewerStateListSerializer
         fields = [
             'id',
             'text',
@@ -356,28 +323,16 @@ class ReplyListSerilaizer(serializers.ModelSerializer):
         ]
 
     def get_likes_count(self, comment):
-        count = CommentLike.objects.filter(like=True, comment=comment).count()
-        return count
+        return get_viewer_state(self.context).comment_count(comment, 'likes_count')
 
     def get_dislikes_count(self, comment):
-        count = CommentLike.objects.filter(like=False, comment=comment).count()
-        return count
+        return get_viewer_state(self.context).comment_count(comment, 'dislikes_count')
 
     def get_liked(self, comment):
-        user = self.context.get('user')
-        if user:
-            liked = CommentLike.objects.filter(
-                like=True, comment=comment, user=user).exists()
-            return liked
-        return False
+        return get_viewer_state(self.context).comment_reaction(comment) is True
         
     def get_disliked(self, comment):
-        user = self.context.get('user')
-        if user:
-            disliked = CommentLike.objects.filter(
-                like=False, comment=comment, user=user).exists()
-            return disliked
-        return False
+        return get_viewer_state(self.context).comment_reaction(comment) is False
 
 
 
@@ -443,9 +398,6 @@ class AudienceListSerilaizer(serializers.ModelSerializer):
 
 
 class FavoritePostSerializer(serializers.Serializer):
-    post_id = serializers.IntegerField()
-
-    def validate_post_id(self, value):
-        if not Post.objects.filter(id=value).exists():
-            raise serializers.ValidationError("Post with this ID does not exist.")
-        return value
\ No newline at end of file
+    """A favorite toggle, the post is looked up by posts.favorites."""
+    default_error_messages = {'does_not_exist': 'Post with this ID does not exist.'}
+    post_id = serializers.IntegerField()
\ No newline at end of file
@@ -0,0 +1,58 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from images.models import Image
+from profiles.models import UserProfile
+from .layout import schedule_post_layout
+from .models import Post, PostComment, Reaction, ReactionAggregate, ReactionJournal
+from .tasks import enqueue_feed_update
+
+
+@receiver(m2m_changed, sender=UserProfile.friends.through)
+def update_feeds_on_friendship_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # The cleared friends are gone by post_clear, remember them
+        instance._cleared_friend_ids = set(instance.friends.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear') or instance.user_id is None:
+        return
+
+    friend_profile_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_friend_ids', set())
+    friend_user_ids = set(UserProfile.objects.filter(
+        pk__in=friend_profile_ids, user__isnull=False).values_list('user_id', flat=True))
+    # The mirror row of a symmetrical friendship is written after post_add
+    enqueue_feed_update(instance.user_id, friend_user_ids, action == 'post_add')
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def update_layout_on_image_change(sender, instance, **kwargs):
+    # Added, removed and reordered images all change the rows
+    schedule_post_layout(instance.post_id)
+
+
+def delete_target_reactions(target_type, target_ids):
+    # Reactions point at their target by id, without a cascading foreign key
+    for model in (Reaction, ReactionAggregate, ReactionJournal):
+        model.objects.filter(target_type=target_type, target_id__in=target_ids).delete()
+
+
+@receiver(pre_delete, sender=Post)
+@receiver(pre_delete, sender=PostComment)
+def delete_cascaded_comment_reactions(sender, instance, origin=None, **kwargs):
+    if origin is not instance:
+        return
+    # The comments (or replies) about to cascade, in one statement per table
+    # instead of three per comment, see delete_reactions
+    comments = PostComment.objects.filter(**{'post' if sender is Post else 'comment': instance})
+    delete_target_reactions(Reaction.COMMENT, comments.values('pk'))
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=PostComment)
+def delete_reactions(sender, instance, origin=None, **kwargs):
+    if sender is PostComment and isinstance(origin, (Post, PostComment)) and origin is not instance:
+        # Cascaded from a deleted post or comment, already cleared before the delete
+        return
+    target_type = Reaction.POST if sender is Post else Reaction.COMMENT
+    delete_target_reactions(target_type, [instance.pk])
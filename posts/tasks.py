@@ -0,0 +1,55 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .timeline import link_timelines, unlink_timelines
+from .visibility import link_visibility, unlink_visibility
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # One thread, so a process applies its friendship changes in order
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='feeds')
+        return _executor
+
+
+def update_feeds(user_id, friend_user_ids, added):
+    """Apply made (``added``) or ended friendships of ``user_id`` to the visibility index, then the timelines."""
+    if added:
+        link_visibility(user_id, friend_user_ids)
+        # Backfilled through the visibility index just updated
+        link_timelines(user_id, friend_user_ids)
+    else:
+        unlink_visibility(user_id, friend_user_ids)
+        unlink_timelines(user_id, friend_user_ids)
+
+
+def _run(task, *args):
+    close_old_connections()
+    try:
+        task(*args)
+    except Exception:
+        logger.exception('Feed update failed, rebuild_feed_visibility and rebuild_timelines repair it')
+    finally:
+        close_old_connections()
+
+
+def enqueue_feed_update(user_id, friend_user_ids, added):
+    """
+    Run ``update_feeds`` once the current transaction commits, on the
+    process's feed thread, or in the request with FEED_UPDATE_WORKERS = 0.
+    """
+    if settings.FEED_UPDATE_WORKERS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run, update_feeds, user_id, friend_user_ids, added))
+    else:
+        transaction.on_commit(lambda: update_feeds(user_id, friend_user_ids, added))
@@ -1,3 +1,946 @@
-from django.test import TestCase
+import base64
+import json
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APIRequestFactory
+
+from images.models import Image, TaggedFriend
+from profiles.models import UserProfile
+from .models import Audience, CommentLike, FeedVisibility, Post, PostComment, PostLike, Reaction, ReactionAggregate
+from .models import ReactionJournal, TimelineEntry
+from .counters import POST_COUNTER_FIELDS
+from .queries import post_list_queryset
+from .reactions import flush_reaction_journal
+from .serializers import CommentListSerilaizer, PostListSerializer
+from .timeline import fan_out_post
+from .visibility import rebuild_visibility
+
+
+def create_user(username):
+    user = User.objects.create(username=username)
+    UserProfile.objects.create(user=user)
+    return user
+
+
+def create_post(user, tagged_friends=(), images=0):
+    post = Post.objects.create(user=user, text='text')
+    post.tags.add('django', 'python')
+    post.tagged_friends.set(tagged_friends)
+    for order_id in range(images):
+        image = Image.objects.create(
+            post=post, user=user, order_id=order_id, image_width=400, image_height=300)
+        for friend in tagged_friends:
+            TaggedFriend.objects.create(image=image, user=friend, top=10, left=10)
+    return post
+
+
+class PostQueryBudgetTests(TestCase):
+    """
+    Rendering posts must cost a fixed number of queries whatever the page size
+    or image count, so a serializer change adding a per-row query fails here.
+    """
+    # Posts, tags, tagged friends, images, image tagged friends, image variants,
+    # viewer reactions and viewer favorites
+    POST_LIST_QUERIES = 8
+    POST_DETAIL_QUERIES = 8
+
+    def setUp(self):
+        self.client = APIClient()
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        self.friends = [create_user('friend1'), create_user('friend2')]
+        # Cached per process outside tests, image variants are looked up through it
+        ContentType.objects.get_for_model(Image)
+
+    def get_post_list(self, limit):
+        self.client.force_authenticate(self.viewer)
+        return self.client.get('/api/posts/', {'user': self.author.id, 'filterBy': 'all', 'limit': limit})
+
+    def test_post_list_query_count_is_independent_of_page_size(self):
+        create_post(self.author, self.friends, images=1)
+        with self.assertNumQueries(self.POST_LIST_QUERIES):
+            response = self.get_post_list(limit=10)
+        self.assertEqual(len(response.data['results']), 1)
+
+        for _ in range(9):
+            create_post(self.author, self.friends, images=4)
+        with self.assertNumQueries(self.POST_LIST_QUERIES):
+            response = self.get_post_list(limit=10)
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_post_list_renders_prefetched_data(self):
+        create_post(self.author, self.friends, images=3)
+        post = self.get_post_list(limit=10).data['results'][0]
+        self.assertEqual(post['images_count'], 3)
+        self.assertEqual(sorted(post['tags']), ['django', 'python'])
+        self.assertEqual(len(post['tagged_friends']), 2)
+        self.assertEqual(len(post['image_set'][0]['tagged_friends']), 2)
+
+    def test_post_detail_query_count_is_independent_of_image_count(self):
+        self.client.force_authenticate(self.viewer)
+        small = create_post(self.author, self.friends, images=1)
+        large = create_post(self.author, self.friends, images=8)
+        for post in (small, large):
+            with self.assertNumQueries(self.POST_DETAIL_QUERIES):
+                response = self.client.get(f'/api/posts/{post.id}/details/')
+            self.assertEqual(response.data['images_count'], post.image_set.count())
+
+
+class ViewerStateTests(TestCase):
+    """
+    A page loads the viewer's reactions with one query and their favorites with
+    another, whether the viewer comes from the serializer context or the request.
+    """
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        self.posts = [Post.objects.create(user=self.author) for _ in range(3)]
+        self.comments = [PostComment.objects.create(post=self.posts[0], user=self.author, text='text')
+                         for _ in range(3)]
+        Reaction.objects.create(target_type=Reaction.POST, target_id=self.posts[0].id,
+                                user=self.viewer, kind=Reaction.LIKE)
+        Reaction.objects.create(target_type=Reaction.COMMENT, target_id=self.comments[1].id,
+                                user=self.viewer, kind=Reaction.DISLIKE)
+        self.viewer.userprofile.favorite_posts.add(self.posts[1])
+        self.author.userprofile.favorite_posts.add(self.posts[2])
+
+    def request_for(self, user):
+        request = APIRequestFactory().get('/')
+        request.user = user
+        return request
+
+    def contexts(self):
+        return [
+            {'user': self.viewer.id},
+            {'user': self.viewer},
+            {'request': self.request_for(self.viewer)},
+            {'user': '', 'request': self.request_for(self.viewer)},
+        ]
+
+    def test_post_page_costs_one_reaction_and_one_favorites_query(self):
+        posts = list(post_list_queryset(Post.objects.order_by('id')))
+        for context in self.contexts():
+            with self.assertNumQueries(2):
+                data = PostListSerializer(posts, many=True, context=context).data
+            self.assertEqual([(post['liked'], post['disliked'], post['favorite']) for post in data],
+                             [(True, False, False), (False, False, True), (False, False, False)])
+
+    def test_comment_page_costs_one_reaction_query(self):
+        comments = list(PostComment.objects.select_related('user__userprofile', 'post').order_by('id'))
+        for context in self.contexts():
+            with self.assertNumQueries(1):
+                data = CommentListSerilaizer(comments, many=True, context=context).data
+            self.assertEqual([(comment['liked'], comment['disliked']) for comment in data],
+                             [(False, False), (False, True), (False, False)])
+
+    def test_anonymous_viewers_cost_no_queries(self):
+        posts = list(post_list_queryset(Post.objects.all()))
+        with self.assertNumQueries(0):
+            data = PostListSerializer(posts, many=True, context={'request': self.request_for(AnonymousUser())}).data
+        self.assertFalse(any(post['liked'] or post['favorite'] for post in data))
+
+    def test_audience_is_shown_to_the_author_however_they_are_resolved(self):
+        post = self.posts[0]
+        for context in ({'user': self.author.id}, {'user': self.author}, {'request': self.request_for(self.author)}):
+            self.assertEqual(PostListSerializer(post, context=context).data['audience'], post.audience)
+        for context in self.contexts():
+            self.assertIsNone(PostListSerializer(post, context=context).data['audience'])
+
+    def test_detail_reports_the_viewers_favorite(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        self.assertTrue(client.get(f'/api/posts/{self.posts[1].id}/details/').data['favorite'])
+        # The author's favorite is not the viewer's
+        self.assertFalse(client.get(f'/api/posts/{self.posts[2].id}/details/').data['favorite'])
+        client.force_authenticate(self.author)
+        self.assertTrue(client.get(f'/api/posts/{self.posts[2].id}/details/').data['favorite'])
+
+
+@override_settings(FEED_UPDATE_WORKERS=0)
+class PostAudienceTests(TestCase):
+    """
+    Posts, comments and replies reach the audience of the post, judged by the
+    authenticated viewer whatever ``?user=`` names.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.author = create_user('author')
+        self.friend = create_user('friend')
+        self.friend_of_friend = create_user('friend_of_friend')
+        self.member = create_user('member')
+        self.stranger = create_user('stranger')
+        self.befriend(self.author, self.friend)
+        self.befriend(self.friend, self.friend_of_friend)
+
+        audience = Audience.objects.create(user=self.author, title='close')
+        audience.users.set([self.member])
+        self.posts = {
+            level: Post.objects.create(user=self.author, audience=level,
+                                       custom_audience=audience if level == 4 else None)
+            for level in range(5)
+        }
+
+    def befriend(self, user, friend):
+        with self.captureOnCommitCallbacks(execute=True):
+            user.userprofile.friends.add(friend.userprofile)
+
+    def visible_audiences(self, viewer):
+        if viewer is None:
+            self.client.force_authenticate(None)
+        else:
+            self.client.force_authenticate(viewer)
+        response = self.client.get('/api/posts/', {'user': self.author.id, 'filterBy': 'my'})
+        return {post['id'] for post in response.data['results']}
+
+    def ids(self, *levels):
+        return {self.posts[level].id for level in levels}
+
+    def test_each_audience_reaches_its_viewers(self):
+        self.assertEqual(self.visible_audiences(self.author), self.ids(0, 1, 2, 3, 4))
+        self.assertEqual(self.visible_audiences(self.friend), self.ids(1, 2, 3))
+        self.assertEqual(self.visible_audiences(self.friend_of_friend), self.ids(1, 3))
+        self.assertEqual(self.visible_audiences(self.member), self.ids(1, 4))
+        self.assertEqual(self.visible_audiences(self.stranger), self.ids(1))
+        self.assertEqual(self.visible_audiences(None), self.ids(1))
+
+    def test_user_parameter_does_not_impersonate(self):
+        response = self.client.get('/api/posts/', {'user': self.author.id, 'filterBy': 'my'})
+        self.assertEqual({post['id'] for post in response.data['results']}, self.ids(1))
+
+        post = self.posts[2]
+        comment = PostComment.objects.create(post=post, user=self.author, text='text')
+        PostComment.objects.create(post=post, user=self.friend, comment=comment, text='reply')
+        for url in (f'/api/posts/comments/{post.id}/', f'/api/posts/replies/{comment.id}/'):
+            self.assertEqual(self.client.get(url, {'user': self.friend.id}).status_code, 404)
+            self.client.force_authenticate(self.stranger)
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.client.force_authenticate(self.friend)
+            self.assertEqual(len(self.client.get(url).data['results']), 1)
+            self.client.force_authenticate(None)
+
+    def test_visibility_follows_friend_add_remove_and_clear(self):
+        def distance(viewer, author):
+            row = FeedVisibility.objects.filter(viewer=viewer, author=author).first()
+            return row and row.distance
+
+        self.assertEqual(distance(self.friend_of_friend, self.author), 2)
+        self.assertEqual(distance(self.author, self.friend_of_friend), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.friend.userprofile.friends.remove(self.friend_of_friend.userprofile)
+        self.assertIsNone(distance(self.friend_of_friend, self.author))
+        self.assertIsNone(distance(self.friend_of_friend, self.friend))
+        self.assertEqual(distance(self.friend, self.author), 1)
+
+        self.befriend(self.friend_of_friend, self.author)
+        self.assertEqual(distance(self.friend_of_friend, self.author), 1)
+        self.assertEqual(distance(self.friend_of_friend, self.friend), 2)
+        self.assertEqual(self.visible_audiences(self.friend_of_friend), self.ids(1, 2, 3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.userprofile.friends.clear()
+        self.assertFalse(FeedVisibility.objects.filter(viewer=self.author).exists())
+        self.assertFalse(FeedVisibility.objects.filter(author=self.author).exists())
+        self.assertEqual(self.visible_audiences(self.friend), self.ids(1))
+
+    def test_incremental_updates_match_a_full_rebuild(self):
+        users = [self.author, self.friend, self.friend_of_friend, self.member, self.stranger]
+        profiles = [user.userprofile for user in users]
+
+        def rows():
+            return set(FeedVisibility.objects.values_list('viewer_id', 'author_id', 'distance'))
+
+        steps = [
+            lambda: profiles[3].friends.add(profiles[1], profiles[4]),
+            lambda: profiles[2].friends.add(profiles[0]),
+            lambda: profiles[1].friends.remove(profiles[0]),
+            lambda: profiles[4].friends.add(profiles[2]),
+            lambda: profiles[2].friends.clear(),
+            lambda: profiles[0].friends.add(profiles[1], profiles[4]),
+            lambda: profiles[3].friends.remove(profiles[4]),
+        ]
+        for step in steps:
+            with self.captureOnCommitCallbacks(execute=True):
+                step()
+            incremental = rows()
+            rebuild_visibility([user.id for user in users])
+            self.assertEqual(incremental, rows())
+
+    def test_a_new_friendship_writes_only_its_delta(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.befriend(self.member, self.stranger)
+        inserts = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT OR IGNORE INTO "posts_feedvisibility"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if query['sql'].startswith('DELETE FROM "posts_feedvisibility"')])
+        self.assertEqual(set(FeedVisibility.objects.filter(viewer=self.member).values_list('author_id', 'distance')),
+                         {(self.stranger.id, 1)})
+
+
+@override_settings(TIMELINE_TRIM_EVERY=1, FEED_UPDATE_WORKERS=0)
+class TimelineTests(TestCase):
+    """Posts reach the home timelines of their audience, pushed on commit or pulled for busy authors."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.author = create_user('author')
+        self.friend = create_user('friend')
+        self.stranger = create_user('stranger')
+        self.befriend(self.author, self.friend)
+
+    def befriend(self, user, friend):
+        with self.captureOnCommitCallbacks(execute=True):
+            user.userprofile.friends.add(friend.userprofile)
+
+    def create_post(self, audience):
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post('/api/posts/create/', {'text': 'text', 'audience': audience})
+        self.assertEqual(len(callbacks), 1)
+        return Post.objects.get(pk=response.data['id'])
+
+    def timeline(self, viewer):
+        return set(TimelineEntry.objects.filter(viewer=viewer).values_list('post_id', flat=True))
+
+    def feed(self, viewer):
+        self.client.force_authenticate(viewer)
+        response = self.client.get('/api/posts/', {'user': viewer.id, 'filterBy': 'feed'})
+        return {post['id'] for post in response.data['results']}
+
+    def test_new_posts_fan_out_to_their_audience(self):
+        friends_post = self.create_post(audience=2)
+        private_post = self.create_post(audience=0)
+        self.assertEqual(self.timeline(self.author), {friends_post.id, private_post.id})
+        self.assertEqual(self.timeline(self.friend), {friends_post.id})
+        self.assertEqual(self.timeline(self.stranger), set())
+        self.assertEqual(self.feed(self.friend), {friends_post.id})
+
+    def test_widened_audience_fans_out(self):
+        post = self.create_post(audience=0)
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/posts/{post.id}/update/', {'audience': 2})
+        self.assertEqual(self.timeline(self.friend), {post.id})
+        self.assertEqual(self.feed(self.friend), {post.id})
+
+        # Narrowing leaves the entry to the feed's visibility filter
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/posts/{post.id}/update/', {'audience': 0})
+        self.assertEqual(self.feed(self.friend), set())
+
+    @override_settings(TIMELINE_MAX_ENTRIES=3)
+    def test_timelines_are_trimmed_to_the_cap(self):
+        posts = [Post.objects.create(user=self.author, audience=2) for _ in range(5)]
+        for post in posts:
+            fan_out_post(post)
+        newest = {post.id for post in posts[-3:]}
+        self.assertEqual(self.timeline(self.author), newest)
+        self.assertEqual(self.timeline(self.friend), newest)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_busy_authors_are_pulled_at_read_time(self):
+        self.befriend(self.author, self.stranger)
+        post = self.create_post(audience=2)
+        self.assertEqual(self.timeline(self.friend), set())
+        self.assertEqual(self.timeline(self.author), {post.id})
+        self.assertEqual(self.feed(self.friend), {post.id})
+        self.assertEqual(self.feed(self.stranger), {post.id})
+
+    def test_pulled_posts_stay_pulled_when_the_author_drops_under_the_limit(self):
+        self.befriend(self.author, self.stranger)
+        with override_settings(TIMELINE_FANOUT_LIMIT=1):
+            post = self.create_post(audience=2)
+        self.assertTrue(Post.objects.get(pk=post.pk).pulled)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.userprofile.friends.remove(self.stranger.userprofile)
+        self.assertEqual(self.timeline(self.friend), set())
+        self.assertEqual(self.feed(self.friend), {post.id})
+        self.assertEqual(self.feed(self.stranger), set())
+
+    def test_friendships_backfill_and_unlink_timelines(self):
+        post = self.create_post(audience=2)
+        self.assertEqual(self.timeline(self.stranger), set())
+
+        self.befriend(self.stranger, self.author)
+        self.assertEqual(self.timeline(self.stranger), {post.id})
+        self.assertEqual(self.feed(self.stranger), {post.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stranger.userprofile.friends.remove(self.author.userprofile)
+        self.assertEqual(self.timeline(self.stranger), set())
+        self.assertEqual(self.timeline(self.friend), {post.id})
+
+
+class CounterTests(TestCase):
+    """The denormalized post and comment counters follow the writes that change them."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        self.post = Post.objects.create(user=self.author)
+
+    def create_comment(self, user, parent=None):
+        self.client.force_authenticate(user)
+        data = {'post': self.post.id, 'text': 'text'}
+        if parent is not None:
+            data['comment'] = parent.id
+        response = self.client.post('/api/posts/comments/', data)
+        self.assertEqual(response.status_code, 201)
+        return PostComment.objects.get(pk=response.data['id'])
+
+    def delete_comment(self, user, comment):
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.delete(f'/api/posts/comments/{comment.id}/delete/').status_code, 204)
+
+    def counters(self, obj, *fields):
+        obj.refresh_from_db()
+        return tuple(getattr(obj, field) for field in fields)
+
+    def sync(self, *args):
+        out = StringIO()
+        call_command('sync_post_counters', *args, stdout=out)
+        return out.getvalue()
+
+    def test_post_counters_follow_likes_and_top_level_comments(self):
+        self.client.force_authenticate(self.viewer)
+        self.client.post(f'/api/posts/{self.post.id}/likes/', {'like': False})
+        comment = self.create_comment(self.viewer)
+        self.create_comment(self.author, parent=comment)
+        self.assertEqual(self.counters(self.post, *POST_COUNTER_FIELDS), (0, 1, 1))
+
+        self.client.force_authenticate(self.viewer)
+        self.client.post(f'/api/posts/{self.post.id}/likes/', {'like': True})
+        self.delete_comment(self.viewer, comment)
+        self.assertEqual(self.counters(self.post, *POST_COUNTER_FIELDS), (1, 0, 0))
+        self.assertIn('0 drifted', self.sync('--check'))
+
+    def test_post_saves_keep_counters_and_layout(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        self.client.force_authenticate(self.viewer)
+        self.client.post(f'/api/posts/{self.post.id}/likes/', {'like': True})
+        comment = self.create_comment(self.viewer)
+        Post.objects.filter(pk=self.post.pk).update(images_layout={'360': []})
+
+        stale.text = 'edited'
+        stale.save()
+        self.client.force_authenticate(self.author)
+        self.client.patch(f'/api/posts/{self.post.id}/update/', {'title': 'title'})
+        self.client.post(f'/api/posts/{self.post.id}/pin-comment/', {'comment': comment.id})
+
+        self.assertEqual(self.counters(self.post, *POST_COUNTER_FIELDS), (1, 0, 1))
+        self.assertEqual(self.counters(self.post, 'images_layout', 'text', 'title', 'pinned_comment_id'),
+                         ({'360': []}, 'edited', 'title', comment.id))
+
+    def test_replies_count_and_author_replied_flag(self):
+        comment = self.create_comment(self.viewer)
+        viewer_reply = self.create_comment(self.viewer, parent=comment)
+        self.assertEqual(self.counters(comment, 'replies_count', 'is_replied_by_author'), (1, False))
+        author_reply = self.create_comment(self.author, parent=comment)
+        self.assertEqual(self.counters(comment, 'replies_count', 'is_replied_by_author'), (2, True))
+
+        self.delete_comment(self.author, author_reply)
+        self.assertEqual(self.counters(comment, 'replies_count', 'is_replied_by_author'), (1, False))
+        self.delete_comment(self.viewer, viewer_reply)
+        self.assertEqual(self.counters(comment, 'replies_count', 'is_replied_by_author'), (0, False))
+        # Replies never count as the post's comments
+        self.assertEqual(self.counters(self.post, 'comments_count'), (1,))
+
+    def test_comment_saves_keep_counters(self):
+        comment = self.create_comment(self.viewer)
+        stale = PostComment.objects.get(pk=comment.pk)
+        self.create_comment(self.author, parent=comment)
+        self.client.force_authenticate(self.viewer)
+        self.client.post(f'/api/posts/comments/{comment.id}/likes/', {'like': True})
+
+        stale.text = 'edited'
+        stale.save()
+        self.client.force_authenticate(self.author)
+        self.client.post(f'/api/posts/comments/{comment.id}/like_by_author/')
+        self.client.force_authenticate(self.viewer)
+        self.client.put(f'/api/posts/comments/{comment.id}/update/', {'text': 'again'})
+
+        self.assertEqual(self.counters(comment, 'likes_count', 'replies_count', 'is_replied_by_author'),
+                         (1, 1, True))
+        self.assertEqual(self.counters(comment, 'text', 'is_liked_by_author'), ('again', True))
+
+    def test_deleting_a_comment_with_replies(self):
+        comment = self.create_comment(self.viewer)
+        for user in (self.author, self.viewer):
+            self.create_comment(user, parent=comment)
+        other = self.create_comment(self.author)
+        self.delete_comment(self.author, comment)
+
+        self.assertEqual(list(PostComment.objects.values_list('pk', flat=True)), [other.id])
+        self.assertEqual(self.counters(self.post, 'comments_count'), (1,))
+        self.assertIn('0 drifted', self.sync('--check'))
+
+    def test_sync_check_reports_and_sync_fixes_drift(self):
+        comment = self.create_comment(self.viewer)
+        self.create_comment(self.author, parent=comment)
+        Post.objects.filter(pk=self.post.pk).update(comments_count=5)
+        PostComment.objects.filter(pk=comment.pk).update(replies_count=0, is_replied_by_author=False)
+
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, '2 row(s) have drifted counters'):
+            call_command('sync_post_counters', '--check', stdout=out)
+        self.assertIn(f'Post {self.post.id} has drifted counters', out.getvalue())
+        self.assertIn(f'Comment {comment.id} has drifted counters', out.getvalue())
+        self.assertEqual(self.counters(self.post, 'comments_count'), (5,))
+
+        self.assertIn('2 drifted row(s) fixed', self.sync())
+        self.assertEqual(self.counters(self.post, 'comments_count'), (1,))
+        self.assertEqual(self.counters(comment, 'replies_count', 'is_replied_by_author'), (1, True))
+        self.assertIn('0 drifted row(s) found', self.sync('--check'))
+
+
+class KeysetPaginationTests(TestCase):
+    """Comments and replies page on their composite ordering through opaque cursors."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.author = create_user('author')
+        self.post = Post.objects.create(user=self.author)
+
+    def comment(self, likes_count=0, **fields):
+        comment = PostComment.objects.create(post=self.post, user=self.author, text='text', **fields)
+        PostComment.objects.filter(pk=comment.pk).update(likes_count=likes_count)
+        return comment
+
+    def walk(self, url, limit=2, **params):
+        ids, pages = [], 0
+        response = self.client.get(url, {'limit': limit, **params})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), limit)
+            ids += [item['id'] for item in response.data['results']]
+            pages += 1
+            if not response.data['next']:
+                return ids, pages
+            response = self.client.get(response.data['next'])
+
+    def cursor(self, value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+    def test_top_comments_page_on_pinned_author_liked_likes_and_age(self):
+        liked = self.comment(likes_count=5)
+        author_liked = self.comment(likes_count=1, is_liked_by_author=True)
+        liked_later = self.comment(likes_count=5)
+        pinned = self.comment()
+        unliked = self.comment()
+        Post.objects.filter(pk=self.post.pk).update(pinned_comment=pinned)
+
+        ids, pages = self.walk(f'/api/posts/comments/{self.post.id}/')
+        self.assertEqual(ids, [pinned.id, author_liked.id, liked_later.id, liked.id, unliked.id])
+        self.assertEqual(pages, 3)
+
+        ids, _ = self.walk(f'/api/posts/comments/{self.post.id}/', sort_by='newest_first')
+        self.assertEqual(ids, [pinned.id, unliked.id, liked_later.id, author_liked.id, liked.id])
+
+    def test_replies_page_oldest_first(self):
+        parent = self.comment()
+        replies = [self.comment(comment=parent) for _ in range(5)]
+        ids, pages = self.walk(f'/api/posts/replies/{parent.id}/')
+        self.assertEqual(ids, [reply.id for reply in replies])
+        self.assertEqual(pages, 3)
+
+        ids, pages = self.walk(f'/api/posts/replies/{parent.id}/', limit=5)
+        self.assertEqual((len(ids), pages), (5, 1))
+
+    def test_bad_cursors_are_not_found(self):
+        self.comment()
+        url = f'/api/posts/comments/{self.post.id}/'
+        for cursor in ('!!!', 'bm90IGpzb24', self.cursor({'id': 1}), self.cursor([1, 2]),
+                       self.cursor(['x'] * 5)):
+            response = self.client.get(url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_offset_opts_into_limit_offset_paging(self):
+        comments = [self.comment() for _ in range(3)]
+        response = self.client.get(f'/api/posts/comments/{self.post.id}/', {'offset': 1, 'limit': 1})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([item['id'] for item in response.data['results']], [comments[1].id])
+        self.assertIn('offset=2', response.data['next'])
+
+
+class PostLayoutTests(TestCase):
+    """The server computes the justified image layout of a post as its images change."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.post = Post.objects.create(user=self.author)
+
+    def add_image(self, order_id, width, height):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Image.objects.create(
+                post=self.post, user=self.author, order_id=order_id, image_width=width, image_height=height)
+
+    def test_rows_fill_each_viewport_width(self):
+        images = [self.add_image(order_id, *size) for order_id, size in
+                  enumerate([(400, 300), (300, 400), (1600, 900), (400, 400), (900, 1600)])]
+        self.post.refresh_from_db()
+        layout = self.post.images_layout
+        self.assertEqual(layout['images'], [image.id for image in images])
+
+        for width, target_height in settings.POST_LAYOUT_ROW_HEIGHTS.items():
+            boxes = layout['widths'][str(width)]['boxes']
+            self.assertEqual(len(boxes), len(images))
+            for top in {box[1] for box in boxes}:
+                row = [box for box in boxes if box[1] == top]
+                # Rows at most at the cap, otherwise stretched to the full width
+                if row[0][3] < target_height * settings.POST_LAYOUT_MAX_ROW_SCALE:
+                    self.assertEqual(row[-1][0] + row[-1][2], width)
+                    self.assertEqual(row[0][0], 0)
+                self.assertEqual(len({box[3] for box in row}), 1)
+
+    def test_layout_follows_removed_and_reordered_images(self):
+        first = self.add_image(0, 400, 300)
+        second = self.add_image(1, 300, 400)
+        second.order_id = -1
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.images_layout['images'], [second.id, first.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.images_layout['images'], [second.id])
+        # A lone portrait image is capped in height and centered
+        box = self.post.images_layout['widths']['360']['boxes'][0]
+        self.assertEqual(box[3], 180 * settings.POST_LAYOUT_MAX_ROW_SCALE)
+        self.assertEqual(box[0] * 2 + box[2], 360)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.images_layout, {})
+
+
+class ReactionToggleTests(TestCase):
+    """
+    A tap is a visibility check, a delete, an optional insert, an aggregate
+    upsert and, for likes and dislikes, a counter update, answered from their
+    RETURNING rows.
+    """
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        self.post = Post.objects.create(user=self.author)
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def tap(self, url, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, format='json')
+        statements = [query['sql'] for query in queries.captured_queries
+                      if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+        return response, statements
+
+    def test_post_taps_toggle_and_switch(self):
+        url = f'/api/posts/{self.post.id}/likes/'
+        steps = [
+            (True, {'likes_count': 1, 'dislikes_count': 0, 'liked': True, 'disliked': False}, 5),
+            (True, {'likes_count': 0, 'dislikes_count': 0, 'liked': False, 'disliked': False}, 4),
+            (False, {'likes_count': 0, 'dislikes_count': 1, 'liked': False, 'disliked': True}, 5),
+            (True, {'likes_count': 1, 'dislikes_count': 0, 'liked': True, 'disliked': False}, 5),
+        ]
+        for like, expected, statement_count in steps:
+            response, statements = self.tap(url, {'like': like})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, expected)
+            self.assertEqual(len(statements), statement_count, statements)
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count), (1, 0))
+        self.assertEqual(list(Reaction.objects.values_list('user_id', 'kind')), [(self.viewer.id, Reaction.LIKE)])
+
+    def test_emoji_reactions_and_breakdown(self):
+        url = f'/api/posts/{self.post.id}/reactions/'
+        self.tap(f'/api/posts/{self.post.id}/likes/', {'like': True})
+        response, statements = self.tap(url, {'kind': 'love'})
+        self.assertEqual(response.data['reaction'], 'love')
+        self.assertEqual(response.data['reactions']['love'], 1)
+        # Switching away from a like also lowers the like counter
+        self.assertEqual(response.data['reactions']['like'], 0)
+        self.assertEqual(len(statements), 5)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+        # The target's visibility, then its aggregate
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.data['reactions']['love'], 1)
+        self.assertEqual(self.client.get('/api/posts/0/reactions/').status_code, 404)
+
+        response, statements = self.tap(url, {'kind': 'love'})
+        self.assertIsNone(response.data['reaction'])
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(self.tap(url, {'kind': 'meh'})[0].status_code, 400)
+
+    def test_comment_taps_and_missing_targets(self):
+        comment = PostComment.objects.create(post=self.post, user=self.author, text='text')
+        response, _ = self.tap(f'/api/posts/comments/{comment.id}/likes/', {'like': False})
+        self.assertEqual(response.data['dislikes_count'], 1)
+        comment.refresh_from_db()
+        self.assertEqual(comment.dislikes_count, 1)
+
+        response, _ = self.tap('/api/posts/0/likes/', {'like': True})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Reaction.objects.filter(target_id=0).exists())
+        response, _ = self.tap(f'/api/posts/{self.post.id}/likes/', {'like': 'maybe'})
+        self.assertEqual(response.status_code, 400)
+
+        self.post.delete()
+        self.assertFalse(Reaction.objects.exists())
+        self.assertFalse(ReactionAggregate.objects.exists())
+
+    def test_reaction_breakdowns_follow_the_post_audience(self):
+        private = Post.objects.create(user=self.author, audience=0)
+        comment = PostComment.objects.create(post=private, user=self.author, text='text')
+        for url in (f'/api/posts/{private.id}/reactions/', f'/api/posts/comments/{comment.id}/reactions/'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.client.force_authenticate(self.author)
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.client.force_authenticate(self.viewer)
+        self.assertEqual(self.client.get('/api/posts/comments/0/reactions/').status_code, 404)
+
+    def test_hidden_targets_cannot_be_tapped(self):
+        private = Post.objects.create(user=self.author, audience=0)
+        comment = PostComment.objects.create(post=private, user=self.author, text='text')
+        for url, data in [
+            (f'/api/posts/{private.id}/likes/', {'like': True}),
+            (f'/api/posts/comments/{comment.id}/likes/', {'like': True}),
+            (f'/api/posts/{private.id}/reactions/', {'kind': 'love'}),
+            (f'/api/posts/comments/{comment.id}/reactions/', {'kind': 'love'}),
+        ]:
+            self.assertEqual(self.tap(url, data)[0].status_code, 404)
+        self.assertFalse(Reaction.objects.exists())
+
+    def test_deleting_a_post_clears_its_comments_reactions_in_bulk(self):
+        def delete_post(comment_count):
+            post = Post.objects.create(user=self.author)
+            for _ in range(comment_count):
+                comment = PostComment.objects.create(post=post, user=self.author, text='text')
+                PostComment.objects.create(post=post, user=self.viewer, comment=comment, text='reply')
+            for comment in post.comments.all():
+                self.tap(f'/api/posts/comments/{comment.id}/likes/', {'like': True})
+            with CaptureQueriesContext(connection) as queries:
+                post.delete()
+            return len(queries)
+
+        self.assertEqual(delete_post(1), delete_post(3))
+        self.assertFalse(Reaction.objects.filter(target_type=Reaction.COMMENT).exists())
+        self.assertFalse(ReactionAggregate.objects.filter(target_type=Reaction.COMMENT).exists())
+
+    def test_deleting_a_comment_clears_its_replies_reactions(self):
+        comment = PostComment.objects.create(post=self.post, user=self.author, text='text')
+        reply = PostComment.objects.create(post=self.post, user=self.viewer, comment=comment, text='reply')
+        other = PostComment.objects.create(post=self.post, user=self.viewer, text='other')
+        for target in (comment, reply, other):
+            self.tap(f'/api/posts/comments/{target.id}/likes/', {'like': True})
+        comment.delete()
+        self.assertEqual(list(Reaction.objects.filter(target_type=Reaction.COMMENT)
+                              .values_list('target_id', flat=True)), [other.id])
+        self.assertEqual(list(ReactionAggregate.objects.filter(target_type=Reaction.COMMENT)
+                              .values_list('target_id', flat=True)), [other.id])
+
+    def test_backfill_moves_legacy_likes(self):
+        comment = PostComment.objects.create(post=self.post, user=self.author, text='text')
+        PostLike.objects.create(post=self.post, user=self.viewer, like=True)
+        PostLike.objects.create(post=self.post, user=self.author, like=False)
+        CommentLike.objects.create(comment=comment, user=self.viewer, like=True)
+        # Set again through the new path before the backfill, this one wins
+        self.tap(f'/api/posts/{self.post.id}/reactions/', {'kind': 'wow'})
+
+        call_command('backfill_reactions', batch_size=1, stdout=StringIO())
+        self.assertFalse(PostLike.objects.exists())
+        self.assertFalse(CommentLike.objects.exists())
+        self.assertEqual(Reaction.objects.get(target_type=Reaction.POST, user=self.viewer).kind, Reaction.WOW)
+
+        breakdown = ReactionAggregate.objects.get(target_type=Reaction.POST, target_id=self.post.id).breakdown()
+        self.assertEqual((breakdown['like'], breakdown['dislike'], breakdown['wow']), (0, 1, 1))
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count), (0, 1))
+        self.assertEqual(comment.likes_count, 1)
+
+
+@override_settings(REACTION_WRITE_BEHIND=True, REACTION_FLUSH_INTERVAL_MS=0)
+class WriteBehindReactionTests(TestCase):
+    """Taps journal their changes, reads add the pending ones until a flush applies them."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.viewers = [create_user(f'viewer{number}') for number in range(3)]
+        self.post = Post.objects.create(user=self.author)
+        self.client = APIClient()
+
+    def tap(self, viewer, data):
+        self.client.force_authenticate(viewer)
+        return self.client.post(f'/api/posts/{self.post.id}/likes/', data, format='json')
+
+    def test_reads_include_pending_changes(self):
+        for viewer in self.viewers:
+            response = self.tap(viewer, {'like': True})
+        self.assertEqual(response.data['likes_count'], 3)
+        self.tap(self.viewers[0], {'like': False})
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count), (0, 0))
+        self.assertFalse(ReactionAggregate.objects.exists())
+        self.assertEqual(ReactionJournal.objects.count(), 4)
+
+        post = self.client.get('/api/posts/', {'user': self.author.id, 'filterBy': 'all'}).data['results'][0]
+        self.assertEqual((post['likes_count'], post['dislikes_count']), (2, 1))
+        reactions = self.client.get(f'/api/posts/{self.post.id}/reactions/').data['reactions']
+        self.assertEqual((reactions['like'], reactions['dislike']), (2, 1))
+
+    def test_flush_applies_each_target_once(self):
+        for viewer in self.viewers:
+            self.tap(viewer, {'like': True})
+        self.tap(self.viewers[0], {'like': True})
+
+        with self.assertNumQueries(5):
+            # Within a savepoint: the claiming delete, then one upsert and one counter update for the post
+            self.assertEqual(flush_reaction_journal(), 4)
+        self.assertFalse(ReactionJournal.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 2)
+        self.assertEqual(ReactionAggregate.objects.get(target_id=self.post.id).like_count, 2)
+        self.assertEqual(self.tap(self.viewers[1], {'like': True}).data['likes_count'], 1)
+
+        call_command('flush_reaction_journal', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+
+class BulkActionTests(TestCase):
+    """Queued offline actions replay in one request, each action id at most once."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        self.post = Post.objects.create(user=self.author)
+        self.comment = PostComment.objects.create(post=self.post, user=self.author, text='text')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def replay(self, actions):
+        return self.client.post('/api/posts/actions/', {'actions': actions}, format='json')
+
+    def test_actions_replay_in_order(self):
+        actions = [
+            {'id': 'a1', 'type': 'post_like', 'post': self.post.id, 'like': True},
+            {'id': 'a2', 'type': 'favorite', 'post_id': self.post.id},
+            {'id': 'a3', 'type': 'post_like', 'post': self.post.id, 'like': False},
+            {'id': 'a4', 'type': 'comment', 'post': self.post.id, 'text': 'first'},
+            {'id': 'a5', 'type': 'comment', 'post': self.post.id, 'comment': self.comment.id, 'text': 'reply'},
+            {'id': 'a6', 'type': 'comment_like', 'comment': self.comment.id, 'like': True},
+            {'id': 'a7', 'type': 'post_like', 'post': 0, 'like': True},
+            {'id': 'a8', 'type': 'comment', 'post': 0, 'text': 'lost'},
+            {'id': 'a9', 'type': 'post_like', 'post': self.post.id},
+        ]
+        response = self.replay(actions)
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['id'] for result in results], [action['id'] for action in actions])
+        self.assertEqual([result['status'] for result in results], [200, 200, 200, 201, 201, 200, 404, 400, 400])
+        self.assertEqual(results[0]['data'], {'likes_count': 1, 'dislikes_count': 0, 'liked': True, 'disliked': False})
+        self.assertEqual(results[2]['data'], {'likes_count': 0, 'dislikes_count': 1, 'liked': False, 'disliked': True})
+        self.assertEqual(results[1]['data'], {'id': self.post.id, 'favorite': True})
+        self.assertEqual(results[3]['data']['text'], 'first')
+
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.dislikes_count, self.post.comments_count), (0, 1, 1))
+        self.assertEqual((self.comment.likes_count, self.comment.replies_count), (1, 1))
+        self.assertTrue(self.viewer.userprofile.favorite_posts.filter(pk=self.post.id).exists())
+
+    def test_taps_on_hidden_targets_are_not_found(self):
+        private = Post.objects.create(user=self.author, audience=0)
+        comment = PostComment.objects.create(post=private, user=self.author, text='text')
+        response = self.replay([
+            {'id': 'a1', 'type': 'post_like', 'post': private.id, 'like': True},
+            {'id': 'a2', 'type': 'comment_like', 'comment': comment.id, 'like': True},
+            {'id': 'a3', 'type': 'post_like', 'post': self.post.id, 'like': True},
+        ])
+        self.assertEqual([result['status'] for result in response.data['results']], [404, 404, 200])
+        self.assertEqual(list(Reaction.objects.values_list('target_id', flat=True)), [self.post.id])
+
+    def test_retried_actions_run_once(self):
+        actions = [
+            {'id': 'like', 'type': 'post_like', 'post': self.post.id, 'like': True},
+            {'id': 'comment', 'type': 'comment', 'post': self.post.id, 'text': 'text'},
+        ]
+        first = self.replay(actions).data['results']
+        retried = self.replay(actions + [{'id': 'unlike', 'type': 'post_like', 'post': self.post.id, 'like': True}])
+        self.assertEqual(retried.data['results'][:2], first)
+        self.assertFalse(retried.data['results'][2]['data']['liked'])
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (0, 1))
+
+        self.assertEqual(self.replay([actions[0], actions[0]]).status_code, 400)
+
+    def test_query_count_is_independent_of_action_count(self):
+        def taps(prefix, count):
+            return [{'id': f'{prefix}{number}', 'type': 'post_like', 'post': self.post.id, 'like': True}
+                    for number in range(count)]
+
+        with CaptureQueriesContext(connection) as few:
+            self.replay(taps('few', 2))
+        with CaptureQueriesContext(connection) as many:
+            self.replay(taps('many', 20))
+        self.assertEqual(len(many), len(few))
+
+
+class FavoriteTests(TestCase):
+    """Favorites toggle without loading the collection and page newest first."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.viewer = create_user('viewer')
+        self.posts = [Post.objects.create(user=self.author) for _ in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def toggle(self, post_id):
+        return self.client.post('/api/posts/favorite/', {'post_id': post_id}, format='json')
+
+    def test_toggle_is_one_statement_to_add(self):
+        with self.assertNumQueries(3):
+            # Within a savepoint
+            response = self.toggle(self.posts[0].id)
+        self.assertEqual(response.data, {'id': self.posts[0].id, 'favorite': True})
+        with self.assertNumQueries(4):
+            response = self.toggle(self.posts[0].id)
+        self.assertFalse(response.data['favorite'])
+        self.assertFalse(self.viewer.userprofile.favorite_posts.exists())
+
+        response = self.toggle(0)
+        self.assertEqual(response.status_code, 400)
+
+    def test_feed_pages_by_favorited_at(self):
+        for post in [self.posts[1], self.posts[0], self.posts[2]]:
+            self.toggle(post.id)
+        params = {'user': self.viewer.id, 'filterBy': 'favorites', 'limit': 2}
+        page = self.client.get('/api/posts/', params).data
+        self.assertEqual([post['id'] for post in page['results']], [self.posts[2].id, self.posts[0].id])
+        self.assertTrue(all(post['favorite'] for post in page['results']))
+        page = self.client.get(page['next']).data
+        self.assertEqual([post['id'] for post in page['results']], [self.posts[1].id])
+        self.assertIsNone(page['next'])
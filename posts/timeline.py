@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Q
+
+from .models import FeedVisibility, Post, TimelineEntry
+from .visibility import CUSTOM, FRIENDS, FRIENDS_OF_FRIENDS, PUBLIC, visibility_filter
+
+
+def friend_ids(user_id, limit=None):
+    queryset = FeedVisibility.objects.filter(viewer_id=user_id, distance=1).values_list('author_id', flat=True)
+    return list(queryset[:limit] if limit is not None else queryset)
+
+
+def timeline_recipients(post, friends):
+    """The viewers a new post is written to: its author, tagged users and allowed ``friends``."""
+    recipients = {post.user_id}
+    recipients.update(post.tagged_friends.values_list('pk', flat=True))
+
+    if post.audience in (PUBLIC, FRIENDS, FRIENDS_OF_FRIENDS):
+        recipients.update(friends)
+    elif post.audience == CUSTOM and post.custom_audience_id:
+        recipients.update(
+            post.custom_audience.users.filter(pk__in=friends).values_list('pk', flat=True))
+    return recipients
+
+
+def fan_out_post(post):
+    """
+    Write ``post`` to the recipients' timelines not holding it yet, so it can
+    run again when the audience widens, and trim a sample of them.
+    """
+    friends = friend_ids(post.user_id, limit=settings.TIMELINE_FANOUT_LIMIT + 1)
+    if len(friends) > settings.TIMELINE_FANOUT_LIMIT:
+        # Too many friends to write to, readers pull the post instead. Kept
+        # on the post, so it stays pulled when the author has fewer friends later
+        Post.objects.filter(pk=post.pk).update(pulled=True)
+        friends = []
+    recipients = timeline_recipients(post, friends)
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(viewer_id=viewer_id, post=post, created_at=post.created_at)
+         for viewer_id in recipients],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    # Each timeline is checked about once every TIMELINE_TRIM_EVERY posts it
+    # gets, so it may run that many entries over the cap in between
+    trim_timelines([viewer_id for viewer_id in recipients
+                    if (viewer_id + post.pk) % settings.TIMELINE_TRIM_EVERY == 0])
+
+
+def trim_timelines(viewer_ids):
+    """Drop the oldest entries of the given timelines beyond TIMELINE_MAX_ENTRIES."""
+    limit = settings.TIMELINE_MAX_ENTRIES
+    for viewer_id in viewer_ids:
+        entries = TimelineEntry.objects.filter(viewer_id=viewer_id)
+        # The last kept entry and the first one past the cap, walked on timeline_viewer_created_idx
+        bounds = list(entries.order_by('-created_at', '-post_id')
+                      .values_list('created_at', flat=True)[limit - 1:limit + 1])
+        if len(bounds) > 1:
+            entries.filter(created_at__lt=bounds[0]).delete()
+
+
+def backfill_timeline(viewer_id, author_ids, limit):
+    """Copy the latest ``limit`` posts of ``author_ids`` that the viewer may see into their timeline."""
+    posts = (
+        Post.objects.filter(user_id__in=author_ids)
+        .filter(visibility_filter(viewer_id))
+        .order_by('-created_at')
+        .values_list('pk', 'created_at')[:limit]
+    )
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(viewer_id=viewer_id, post_id=post_id, created_at=created_at)
+         for post_id, created_at in posts],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def link_timelines(user_id, friend_user_ids):
+    """Backfill both timelines of newly made friendships."""
+    limit = settings.TIMELINE_BACKFILL_POSTS
+    for friend_id in friend_user_ids:
+        backfill_timeline(user_id, [friend_id], limit)
+        backfill_timeline(friend_id, [user_id], limit)
+    trim_timelines({user_id, *friend_user_ids})
+
+
+def unlink_timelines(user_id, friend_user_ids):
+    """Remove each other's posts from the timelines of ended friendships."""
+    TimelineEntry.objects.filter(
+        Q(viewer_id=user_id, post__user_id__in=friend_user_ids)
+        | Q(viewer_id__in=friend_user_ids, post__user_id=user_id)
+    ).delete()
+
+
+def timeline_queryset(queryset, viewer_id):
+    """
+    Restrict ``queryset`` to the viewer's home timeline, annotated with
+    ``timeline_at`` to order and paginate on. Unless friends have pulled posts
+    this is a range scan over the viewer's timeline entries.
+    """
+    friends = FeedVisibility.objects.filter(viewer_id=viewer_id, distance=1).values('author_id')
+    if not Post.objects.filter(pulled=True, user_id__in=friends).exists():
+        return queryset.filter(timeline_entries__viewer_id=viewer_id).annotate(
+            timeline_at=F('timeline_entries__created_at'))
+
+    entries = TimelineEntry.objects.filter(viewer_id=viewer_id, post=OuterRef('pk'))
+    return queryset.filter(Q(Exists(entries)) | Q(pulled=True, user_id__in=friends)).annotate(
+        timeline_at=F('created_at'))
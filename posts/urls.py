@@ -1,16 +1,19 @@
 from django.urls import path
 
 from . import views
+from .models import Reaction
 
 urlpatterns = [
     path('', views.PostListAPIView.as_view()),
     path('favorite/', views.FavoritePostView.as_view(), name='favorite-post'),
+    path('actions/', views.BulkActionAPIView.as_view()),
     path('<int:pk>/details/', views.PostRetrieveAPIView.as_view()),
     path('create/', views.PostCreateAPIView.as_view()),
     path('<int:pk>/update/', views.PostUpdateAPIView.as_view()),
     path('<int:pk>/delete/', views.PostDestroyAPIView.as_view()),
 
     path('<int:pk>/likes/', views.PostLikeAPIView.as_view()),
+    path('<int:pk>/reactions/', views.ReactionAPIView.as_view()),
     path('<int:pk>/pin-comment/', views.PostPinCommentAPIView.as_view()),
 
     path('comments/', views.CommentCreateAPIView.as_view()),
@@ -21,6 +24,7 @@ urlpatterns = [
     path('comments/<int:pk>/like_by_author/',
          views.CommentLikeByAuthorAPIView.as_view()),
     path('comments/<int:pk>/likes/', views.CommentLikeAPIView.as_view()),
+    path('comments/<int:pk>/reactions/', views.ReactionAPIView.as_view(target_type=Reaction.COMMENT)),
 
     path('replies/<int:comment>/', views.ReplyListAPIView.as_view()),
 
@@ -0,0 +1,132 @@
+from django.conf import settings
+from django.db import models
+from rest_framework import serializers
+
+from profiles.models import FavoritePost
+from .models import Post, PostComment, Reaction
+from .reactions import like_value, pending_counts
+
+
+# The kind whose pending changes a legacy counter follows
+COUNTER_KINDS = {'likes_count': 'like', 'dislikes_count': 'dislike'}
+
+
+def get_viewer_id(context):
+    """
+    Resolve the id of the user the response is rendered for: the ``user`` entry
+    of the serializer context (an id or a User the view set) when set,
+    otherwise the authenticated request user.
+    """
+    user = context.get('user')
+    if hasattr(user, 'pk'):
+        user = user.pk
+    try:
+        user_id = int(user)
+    except (TypeError, ValueError):
+        user_id = None
+    if user_id and user_id > 0:
+        return user_id
+
+    request = context.get('request')
+    if request is not None and request.user.is_authenticated:
+        return request.user.id
+    return None
+
+
+class ViewerState:
+    """
+    The viewer's reactions and favorites for the posts and comments being
+    rendered, loaded with one query per kind for a whole page of ids. With
+    REACTION_WRITE_BEHIND, also their reaction changes not flushed yet.
+    """
+
+    def __init__(self, viewer_id):
+        self.viewer_id = viewer_id
+        self.post_reactions = {}
+        self.favorite_post_ids = set()
+        self.comment_reactions = {}
+        self.pending_post_counts = {}
+        self.pending_comment_counts = {}
+        self._loaded_post_ids = set()
+        self._loaded_comment_ids = set()
+
+    def load_posts(self, post_ids):
+        missing = set(post_ids) - self._loaded_post_ids
+        if not missing:
+            return
+        self._loaded_post_ids |= missing
+        if settings.REACTION_WRITE_BEHIND:
+            self.pending_post_counts.update(pending_counts(Reaction.POST, missing))
+        if self.viewer_id is None:
+            return
+        self.post_reactions.update(
+            Reaction.objects.filter(user_id=self.viewer_id, target_type=Reaction.POST, target_id__in=missing)
+            .values_list('target_id', 'kind')
+        )
+        self.favorite_post_ids.update(
+            FavoritePost.objects.filter(userprofile__user_id=self.viewer_id, post_id__in=missing)
+            .values_list('post_id', flat=True)
+        )
+
+    def load_comments(self, comment_ids):
+        missing = set(comment_ids) - self._loaded_comment_ids
+        if not missing:
+            return
+        self._loaded_comment_ids |= missing
+        if settings.REACTION_WRITE_BEHIND:
+            self.pending_comment_counts.update(pending_counts(Reaction.COMMENT, missing))
+        if self.viewer_id is None:
+            return
+        self.comment_reactions.update(
+            Reaction.objects.filter(user_id=self.viewer_id, target_type=Reaction.COMMENT, target_id__in=missing)
+            .values_list('target_id', 'kind')
+        )
+
+    def post_reaction(self, post):
+        """True for a like, False for a dislike, None when the viewer has not reacted."""
+        self.load_posts([post.pk])
+        return like_value(self.post_reactions.get(post.pk))
+
+    def post_count(self, post, field):
+        """A post's likes_count or dislikes_count, pending changes included."""
+        self.load_posts([post.pk])
+        return getattr(post, field) + self.pending_post_counts.get(post.pk, {}).get(COUNTER_KINDS[field], 0)
+
+    def is_favorite(self, post):
+        self.load_posts([post.pk])
+        return post.pk in self.favorite_post_ids
+
+    def comment_reaction(self, comment):
+        """True for a like, False for a dislike, None when the viewer has not reacted."""
+        self.load_comments([comment.pk])
+        return like_value(self.comment_reactions.get(comment.pk))
+
+    def comment_count(self, comment, field):
+        """A comment's likes_count or dislikes_count, pending changes included."""
+        self.load_comments([comment.pk])
+        return getattr(comment, field) + self.pending_comment_counts.get(comment.pk, {}).get(COUNTER_KINDS[field], 0)
+
+
+def get_viewer_state(context):
+    """Return the ViewerState shared by every serializer using ``context``."""
+    state = context.get('viewer_state')
+    if state is None:
+        state = context['viewer_state'] = ViewerState(get_viewer_id(context))
+    return state
+
+
+class ViewerStateListSerializer(serializers.ListSerializer):
+    """Loads the viewer's state for every post or comment of a page up front."""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        instances = list(iterable)
+
+        state = get_viewer_state(self.context)
+        ids = [instance.pk for instance in instances]
+        model = self.child.Meta.model
+        if issubclass(model, Post):
+            state.load_posts(ids)
+        elif issubclass(model, PostComment):
+            state.load_comments(ids)
+        return super().to_representation(instances)
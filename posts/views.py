@@ -1,18 +1,33 @@
-from django.db.models import Case, When, Value, IntegerField, Count, Q, F, BooleanField, Exists, OuterRef
+from django.db import transaction
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404
+from django.db.models import Case, When, Value, IntegerField, F, Q, Exists, OuterRef
 from rest_framework.mixins import UpdateModelMixin
 from rest_framework import generics, permissions
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
 
 from profiles.models import UserProfile
 from profiles.serializers import UserProfileAudienceSerializer
-from .models import Post, PostComment, PostLike, CommentLike, Audience
-from .serializers import AudienceCreateSerializer, PostListSerializer, PostCreateSerializer, PostLikesInfoSerilaizer
-from .serializers import CommentCreateSerilaizer, CommentListSerilaizer, PostLikeSerilaizer
+from .bulk_actions import run_actions
+from .counters import adjust_post_counters
+from .counters import reply_created, reply_deleted
+from .favorites import toggle_favorite
+from .models import Post, PostComment, Audience, Reaction
+from .pagination import KeysetPagination
+from .queries import post_list_queryset
+from .reactions import KIND_CODES, reaction_breakdown, reaction_info, toggle_comment_reaction
+from .reactions import toggle_post_reaction, toggle_reaction, visible_targets
+from .timeline import timeline_queryset
+from .visibility import visibility_filter
+from .serializers import AudienceCreateSerializer, PostListSerializer, PostCreateSerializer
+from .serializers import CommentCreateSerilaizer, CommentListSerilaizer
 from .serializers import ReplyListSerilaizer, CommentLikeByAuthorSerializer
-from .serializers import CommentLikesInfoSerilaizer, CommentLikeSerilaizer, PostPinnedCommentSerilaizer
-from .serializers import AudienceListSerilaizer, FavoritePostSerializer
+from .serializers import PostPinnedCommentSerilaizer
+from .serializers import AudienceListSerilaizer, FavoritePostSerializer, ReactionKindSerializer, ReactionToggleSerializer
+from .serializers import BulkActionsSerializer
 
 
 class OwnerPermission(permissions.BasePermission):
@@ -48,9 +63,13 @@ class PostAuthorPermission(permissions.BasePermission):
 #         return context
     
 class PostListAPIView(generics.ListAPIView):
-    authentication_classes = []
+    """
+    The posts of the ``?user=`` subject picked by ``filterBy``, narrowed to
+    the ones the authenticated viewer may see.
+    """
     permission_classes = [permissions.AllowAny]
     serializer_class = PostListSerializer
+    pagination_class = KeysetPagination
     queryset = Post.objects.all()
 
     def get_queryset(self):
@@ -61,55 +80,44 @@ class PostListAPIView(generics.ListAPIView):
         if not user_id:
             return Post.objects.none()
 
-        # Annotate favorite status
-        queryset = super().get_queryset().annotate(
-            favorite=Exists(
-                UserProfile.objects.filter(
-                    user_id=user_id,
-                    favorite_posts=OuterRef('pk')  # Check if the post exists in favorite_posts
-                )
-            ),
-            likes_count=Count('postlike', filter=Q(postlike__like=True), distinct=True),
-            dislikes_count=Count('postlike', filter=Q(postlike__like=False), distinct=True),
-            comments_count=Count('comments', filter=Q(comments__comment=None), distinct=True)
-        )
+        viewer_id = self.request.user.id
+        queryset = post_list_queryset(super().get_queryset())
+        queryset = queryset.filter(visibility_filter(viewer_id))
 
         # Apply filters
-        if filter_by == 'all':
-            queryset = queryset.filter(Q(user_id=user_id) | Q(tagged_friends=user_id)).distinct()
+        if filter_by == 'feed' and viewer_id:
+            # Materialized home timeline, see posts.timeline
+            return timeline_queryset(queryset, viewer_id).order_by('-timeline_at', '-id')
+        elif filter_by == 'all':
+            queryset = queryset.filter(Q(user_id=user_id) | Exists(
+                Post.tagged_friends.through.objects.filter(post=OuterRef('pk'), user_id=user_id)
+            ))
         elif filter_by == 'my':
             queryset = queryset.filter(user_id=user_id)
-        elif filter_by == 'favorites': 
-            queryset = queryset.filter(favorite=True)
+        elif filter_by == 'favorites':
+            # Newest favorite first, walked through favorite_post_feed_idx
+            return queryset.filter(favorites__userprofile__user_id=user_id).annotate(
+                favorited_at=F('favorites__favorited_at')).order_by('-favorited_at', '-id')
         elif filter_by == 'liked':  
-            queryset = queryset.filter(postlike__user_id=user_id, postlike__like=True).distinct()
+            queryset = queryset.filter(Exists(Reaction.objects.filter(
+                target_type=Reaction.POST, target_id=OuterRef('pk'), user_id=user_id, kind=Reaction.LIKE)))
 
-        return queryset
+        return queryset.order_by('-created_at', '-id')
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        context['user'] = self.request.GET.get('user', '')
+        context['user'] = self.request.user.id
         return context
 
+
 class PostRetrieveAPIView(generics.RetrieveAPIView):
     permission_classes = [permissions.AllowAny]
     serializer_class = PostListSerializer
     queryset = Post.objects.all()
-    
-    def get_queryset(self):
-        # Annotate the queryset
-        queryset = super().get_queryset().annotate(
-            comments_count=Count('comments', filter=Q(comments__comment=None)),
-            likes_count=Count('postlike', filter=Q(postlike__like=True)),
-            dislikes_count=Count('postlike', filter=Q(postlike__like=False)),
-            favorite=Case(
-                When(user__userprofile__favorite_posts__id__exact=F('id'), then=True),
-                default=False,
-                output_field=BooleanField()
-            )
-        )
 
-        return queryset
+    def get_queryset(self):
+        queryset = post_list_queryset(super().get_queryset())
+        return queryset.filter(visibility_filter(self.request.user.id))
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -158,22 +166,21 @@ class PostPinCommentAPIView(APIView):
 '''COMMENT'''
 
 class CommentListAPIView(generics.ListAPIView):
-    authentication_classes = []
     permission_classes = [permissions.AllowAny]
     serializer_class = CommentListSerilaizer
+    pagination_class = KeysetPagination
     queryset = PostComment.objects.all()
 
-    
     def get_queryset(self):
-        post = Post.objects.get(pk=self.kwargs.get('post'))
+        post = get_object_or_404(
+            Post.objects.filter(visibility_filter(self.request.user.id)), pk=self.kwargs.get('post'))
         sort_by = self.request.GET.get('sort_by', 'top_comments') 
 
-        pinned_comment_id = post.pinned_comment.id if hasattr(post, 'pinned_comment') and post.pinned_comment else None
+        pinned_comment_id = post.pinned_comment_id
 
         queryset = super().get_queryset().filter(post=post.id, comment=None)
 
-        queryset = queryset.annotate(
-            like_count=Count('commentlike', filter=Q(commentlike__like=True)),
+        queryset = queryset.select_related('user__userprofile', 'post').annotate(
             is_top_comment=Case(
                 When(is_liked_by_author=True, then=Value(1)),
                 default=Value(0),
@@ -188,7 +195,7 @@ class CommentListAPIView(generics.ListAPIView):
 
         if sort_by == 'top_comments':
             queryset = queryset.order_by(
-                '-custom_order', '-is_top_comment', '-like_count', '-created_at'
+                '-custom_order', '-is_top_comment', '-likes_count', '-created_at'
             )
         elif sort_by == 'newest_first':
             queryset = queryset.order_by('-custom_order', '-created_at')
@@ -199,7 +206,7 @@ class CommentListAPIView(generics.ListAPIView):
         
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        context['user'] = self.request.GET.get('user', -1)
+        context['user'] = self.request.user.id
         return context
 
 
@@ -215,7 +222,12 @@ class CommentCreateAPIView(generics.CreateAPIView):
     def post(self, request, *args, **kwargs):
         create_serializer = CommentCreateSerilaizer(data=request.data, context={'request': request})
         create_serializer.is_valid(raise_exception=True)
-        comment = create_serializer.save()
+        with transaction.atomic():
+            comment = create_serializer.save()
+            if comment.comment_id is None:
+                adjust_post_counters(comment.post_id, comments_count=1)
+            else:
+                reply_created(comment)
         list_serializer = CommentListSerilaizer(comment, context={'request': request, 'user': request.user})
         return Response(list_serializer.data, status=status.HTTP_201_CREATED)
 
@@ -225,6 +237,16 @@ class CommentDestroyAPIView(generics.DestroyAPIView):
     queryset = PostComment.objects.all()
     serializer_class = CommentCreateSerilaizer
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        is_top_level = instance.comment_id is None
+        post_id = instance.post_id
+        instance.delete()
+        if is_top_level:
+            adjust_post_counters(post_id, comments_count=-1)
+        else:
+            reply_deleted(instance)
+
 
 class CommentUpdateAPIView(
         generics.GenericAPIView, UpdateModelMixin):
@@ -241,77 +263,59 @@ class CommentUpdateAPIView(
 
 class PostLikeAPIView(APIView):
     def post(self, request, pk, format=None):
-        post = Post.objects.get(pk=pk)
-        user = request.user
-        like = request.data.get('like')
-        data = {
-            'user': request.user.id,
-            'post': pk,
-            'like': like
-        }
+        serializer = ReactionToggleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        get_object_or_404(visible_targets(Reaction.POST, request.user.id).only('pk'), pk=pk)
         try:
-            like_candidate = PostLike.objects.get(post=post, user=user)
-        except:
-            like_candidate = None
-
-        if like_candidate:
-            if like_candidate.like == like:
-                like_candidate.delete()
-                serializer = PostLikesInfoSerilaizer(
-                    post, context={'request': request})
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            else:
-                like_candidate.like = like
-                like_candidate.save()
-                serializer = PostLikesInfoSerilaizer(
-                    post, context={'request': request})
-                return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            serializer = PostLikeSerilaizer(data=data)
-            if serializer.is_valid():
-                serializer.save()
-                serializer = PostLikesInfoSerilaizer(
-                    post, context={'request': request})
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            result = toggle_post_reaction(pk, request.user.id, serializer.validated_data['like'])
+        except Post.DoesNotExist:
+            raise Http404
+        return Response(reaction_info(*result), status=status.HTTP_200_OK)
 
 
 class CommentLikeAPIView(APIView):
     def post(self, request, pk, format=None):
-        comment = PostComment.objects.get(pk=pk)
-        user = request.user
-        like = request.data.get('like')
-        data = {
-            'user': request.user.id,
-            'comment': pk,
-            'like': like
-        }
+        serializer = ReactionToggleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        get_object_or_404(visible_targets(Reaction.COMMENT, request.user.id).only('pk'), pk=pk)
         try:
-            like_candidate = CommentLike.objects.get(
-                comment=comment, user=user)
-        except:
-            like_candidate = None
-
-        if like_candidate:
-            if like_candidate.like == like:
-                like_candidate.delete()
-                serializer = CommentLikesInfoSerilaizer(
-                    comment, context={'request': request})
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            else:
-                like_candidate.like = like
-                like_candidate.save()
-                serializer = CommentLikesInfoSerilaizer(
-                    comment, context={'request': request})
-                return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            serializer = CommentLikeSerilaizer(data=data)
-            if serializer.is_valid():
-                serializer.save()
-                serializer = CommentLikesInfoSerilaizer(
-                    comment, context={'request': request})
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            result = toggle_comment_reaction(pk, request.user.id, serializer.validated_data['like'])
+        except PostComment.DoesNotExist:
+            raise Http404
+        return Response(reaction_info(*result), status=status.HTTP_200_OK)
+
+
+class ReactionAPIView(APIView):
+    """A post's (or comment's) reaction counts by kind, POST a ``kind`` to tap one."""
+    target_type = Reaction.POST
+
+    def get(self, request, pk, format=None):
+        get_object_or_404(visible_targets(self.target_type, request.user.id).only('pk'), pk=pk)
+        return Response({'reactions': reaction_breakdown(self.target_type, pk)})
+
+    def post(self, request, pk, format=None):
+        serializer = ReactionKindSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Hidden targets are missing ones, as for GET
+        get_object_or_404(visible_targets(self.target_type, request.user.id).only('pk'), pk=pk)
+        try:
+            breakdown, kind = toggle_reaction(
+                self.target_type, pk, request.user.id, KIND_CODES[serializer.validated_data['kind']])
+        except ObjectDoesNotExist:
+            raise Http404
+        return Response({'reactions': breakdown, 'reaction': dict(Reaction.KIND_CHOICES).get(kind)})
+
+
+class BulkActionAPIView(APIView):
+    """
+    Replay likes, favorites and comments a client queued while offline, as
+    an ordered list of actions with client-supplied ids, see posts.bulk_actions.
+    """
+
+    def post(self, request, format=None):
+        serializer = BulkActionsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'results': run_actions(request, serializer.validated_data['actions'])})
 
 
 class CommentLikeByAuthorAPIView(APIView):
@@ -334,17 +338,21 @@ class CommentLikeByAuthorAPIView(APIView):
 
 
 class ReplyListAPIView(generics.ListAPIView):
-    authentication_classes = []
     permission_classes = [permissions.AllowAny]
     serializer_class = ReplyListSerilaizer
+    pagination_class = KeysetPagination
     queryset = PostComment.objects.all()
 
     def get_queryset(self):
-        return super().get_queryset().filter(comment=self.kwargs.get('comment'))
-    
+        # Replies share their comment's post, whose audience applies to them
+        post = get_object_or_404(
+            Post.objects.filter(visibility_filter(self.request.user.id)), comments=self.kwargs.get('comment'))
+        return super().get_queryset().filter(comment=self.kwargs.get('comment'), post=post).select_related(
+            'user__userprofile', 'mentioned_user__userprofile').order_by('created_at', 'id')
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        context['user'] = self.request.GET.get('user', '')
+        context['user'] = self.request.user.id
         return context
 
 
@@ -407,13 +415,10 @@ class FavoritePostView(APIView):
         serializer = FavoritePostSerializer(data=request.data)
         if serializer.is_valid():
             post_id = serializer.validated_data['post_id']
-            user_profile = request.user.userprofile  # Access UserProfile via the related name
-            post = Post.objects.get(id=post_id)
-
-            if post in user_profile.favorite_posts.all():
-                user_profile.favorite_posts.remove(post)  # Remove from favorites
-                return Response({"id": post_id, "favorite": False}, status=status.HTTP_200_OK)
-            else:
-                user_profile.favorite_posts.add(post)  # Add to favorites
-                return Response({"id": post_id, "favorite": True}, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            try:
+                favorite = toggle_favorite(request.user.id, post_id)
+            except Post.DoesNotExist:
+                return Response({'post_id': [FavoritePostSerializer.default_error_messages['does_not_exist']]},
+                                status=status.HTTP_400_BAD_REQUEST)
+            return Response({"id": post_id, "favorite": favorite}, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,153 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from profiles.models import UserProfile
+from .models import Audience, FeedVisibility, Post
+
+
+# Post.audience values
+PRIVATE = 0
+PUBLIC = 1
+FRIENDS = 2
+FRIENDS_OF_FRIENDS = 3
+CUSTOM = 4
+
+
+def friend_ids_by_user(user_ids):
+    """Map each of ``user_ids`` to the set of its friends' user ids."""
+    friends = {user_id: set() for user_id in user_ids}
+    rows = UserProfile.friends.through.objects.filter(
+        from_userprofile__user_id__in=user_ids,
+        to_userprofile__user__isnull=False,
+    ).values_list('from_userprofile__user_id', 'to_userprofile__user_id')
+    for user_id, friend_id in rows:
+        friends[user_id].add(friend_id)
+    return friends
+
+
+def rebuild_visibility(viewer_ids):
+    """Recompute the FeedVisibility rows of the given viewers from the friend graph."""
+    viewer_ids = set(viewer_ids)
+    friends = friend_ids_by_user(viewer_ids)
+    second_degree = friend_ids_by_user(set().union(*friends.values()))
+
+    rows = []
+    for viewer_id, direct in friends.items():
+        indirect = set().union(*(second_degree[friend_id] for friend_id in direct))
+        indirect -= direct | {viewer_id}
+        rows += [FeedVisibility(viewer_id=viewer_id, author_id=author_id, distance=1)
+                 for author_id in direct]
+        rows += [FeedVisibility(viewer_id=viewer_id, author_id=author_id, distance=2)
+                 for author_id in indirect]
+
+    with transaction.atomic():
+        FeedVisibility.objects.filter(viewer_id__in=viewer_ids).delete()
+        FeedVisibility.objects.bulk_create(rows, batch_size=1000)
+
+
+def link_visibility(user_id, friend_user_ids):
+    """
+    Add the rows made by new friendships of ``user_id``: each new friend at
+    distance 1, and at distance 2 for the other side's friends, both ways.
+    Existing rows are kept, a friend of a friend becoming a friend is raised to 1.
+    """
+    friend_user_ids = set(friend_user_ids)
+    if not friend_user_ids:
+        return
+    friends = friend_ids_by_user({user_id} | friend_user_ids)
+
+    direct, indirect = set(), set()
+    for friend_id in friend_user_ids:
+        direct |= {(user_id, friend_id), (friend_id, user_id)}
+        for other_id in friends[user_id] - {friend_id}:
+            indirect |= {(other_id, friend_id), (friend_id, other_id)}
+        for other_id in friends[friend_id] - {user_id}:
+            indirect |= {(other_id, user_id), (user_id, other_id)}
+
+    with transaction.atomic():
+        FeedVisibility.objects.filter(
+            Q(viewer_id=user_id, author_id__in=friend_user_ids)
+            | Q(viewer_id__in=friend_user_ids, author_id=user_id)
+        ).update(distance=1)
+        FeedVisibility.objects.bulk_create(
+            [FeedVisibility(viewer_id=viewer_id, author_id=author_id, distance=1)
+             for viewer_id, author_id in direct]
+            + [FeedVisibility(viewer_id=viewer_id, author_id=author_id, distance=2)
+               for viewer_id, author_id in indirect - direct],
+            batch_size=1000, ignore_conflicts=True,
+        )
+
+
+def unlink_visibility(user_id, friend_user_ids):
+    """
+    Recompute the rows ended friendships of ``user_id`` may change: the pair
+    itself and each side as seen by and seeing the other side's friends.
+    """
+    friend_user_ids = set(friend_user_ids)
+    if not friend_user_ids:
+        return
+    friends = friend_ids_by_user({user_id} | friend_user_ids)
+    pairs = set()
+    for friend_id in friend_user_ids:
+        pairs |= {(user_id, friend_id), (friend_id, user_id)}
+        # The other ended friendships were paths through user_id too
+        for other_id in friends[user_id] | friend_user_ids:
+            pairs |= {(other_id, friend_id), (friend_id, other_id)}
+        for other_id in friends[friend_id]:
+            pairs |= {(other_id, user_id), (user_id, other_id)}
+    pairs = {(viewer_id, author_id) for viewer_id, author_id in pairs if viewer_id != author_id}
+
+    friends.update(friend_ids_by_user({member_id for pair in pairs for member_id in pair} - friends.keys()))
+    distances = {}
+    for viewer_id, author_id in pairs:
+        if author_id in friends[viewer_id]:
+            distances[viewer_id, author_id] = 1
+        elif friends[viewer_id] & friends[author_id]:
+            distances[viewer_id, author_id] = 2
+
+    with transaction.atomic():
+        rows = FeedVisibility.objects.select_for_update().filter(
+            viewer_id__in={viewer_id for viewer_id, _ in pairs},
+            author_id__in={author_id for _, author_id in pairs},
+        ).values_list('pk', 'viewer_id', 'author_id', 'distance')
+        stale, existing = {1: [], 2: [], None: []}, set()
+        for pk, viewer_id, author_id, distance in rows:
+            if (viewer_id, author_id) not in pairs:
+                continue
+            existing.add((viewer_id, author_id))
+            if distances.get((viewer_id, author_id)) != distance:
+                stale[distances.get((viewer_id, author_id))].append(pk)
+        FeedVisibility.objects.filter(pk__in=stale[None]).delete()
+        for distance in (1, 2):
+            FeedVisibility.objects.filter(pk__in=stale[distance]).update(distance=distance)
+        FeedVisibility.objects.bulk_create(
+            [FeedVisibility(viewer_id=viewer_id, author_id=author_id, distance=distance)
+             for (viewer_id, author_id), distance in distances.items() if (viewer_id, author_id) not in existing],
+            batch_size=1000, ignore_conflicts=True,
+        )
+
+
+def visibility_filter(viewer_id):
+    """A filter on Post matching the posts ``viewer_id`` may see (public ones for anonymous viewers)."""
+    if viewer_id is None:
+        return Q(audience=PUBLIC)
+
+    within_distance = FeedVisibility.objects.filter(
+        viewer_id=viewer_id,
+        author_id=OuterRef('user_id'),
+        # friends (2) need distance 1, friends of friends (3) distance 2 or less
+        distance__lte=OuterRef('audience') - 1,
+    )
+    in_custom_audience = Audience.users.through.objects.filter(
+        audience_id=OuterRef('custom_audience_id'), user_id=viewer_id)
+    tagged = Post.tagged_friends.through.objects.filter(
+        post_id=OuterRef('pk'), user_id=viewer_id)
+
+    return (
+        Q(user_id=viewer_id)
+        | Q(audience=PUBLIC)
+        | Q(Q(audience__in=(FRIENDS, FRIENDS_OF_FRIENDS)) & Exists(within_distance))
+        | Q(Q(audience=CUSTOM) & Exists(in_custom_audience))
+        | Exists(tagged)
+    )
+
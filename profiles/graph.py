@@ -0,0 +1,221 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Max
+
+from .models import FriendshipChange, UserProfile
+
+
+class FriendGraphSnapshot:
+    """
+    Immutable CSR adjacency of the friendship graph keyed by user id: the
+    friends of ``user_ids[i]`` are ``neighbors[offsets[i]:offsets[i + 1]]``,
+    sorted, so lookups are binary searches and intersections linear merges.
+    """
+
+    def __init__(self, adjacency):
+        self.user_ids = array('q', sorted(adjacency))
+        self.offsets = array('q', [0])
+        self.neighbors = array('q')
+        for user_id in self.user_ids:
+            self.neighbors.extend(sorted(adjacency[user_id]))
+            self.offsets.append(len(self.neighbors))
+
+    @classmethod
+    def from_edges(cls, edges):
+        adjacency = defaultdict(set)
+        for user_id, friend_id in edges:
+            adjacency[user_id].add(friend_id)
+            adjacency[friend_id].add(user_id)
+        return cls(adjacency)
+
+    def _bounds(self, user_id):
+        index = bisect_left(self.user_ids, user_id)
+        if index == len(self.user_ids) or self.user_ids[index] != user_id:
+            return 0, 0
+        return self.offsets[index], self.offsets[index + 1]
+
+    def friends(self, user_id):
+        start, end = self._bounds(user_id)
+        return self.neighbors[start:end]
+
+    def has_edge(self, user_id, friend_id):
+        start, end = self._bounds(user_id)
+        index = bisect_left(self.neighbors, friend_id, start, end)
+        return index < end and self.neighbors[index] == friend_id
+
+    def degree(self, user_id):
+        start, end = self._bounds(user_id)
+        return end - start
+
+    def adjacency(self):
+        return {
+            user_id: set(self.neighbors[self.offsets[index]:self.offsets[index + 1]])
+            for index, user_id in enumerate(self.user_ids)
+        }
+
+
+def _sorted_intersection(left, right):
+    result = []
+    i = j = 0
+    while i < len(left) and j < len(right):
+        if left[i] == right[j]:
+            result.append(left[i])
+            i += 1
+            j += 1
+        elif left[i] < right[j]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+class FriendGraphState:
+    """
+    A snapshot and the add/remove overlay replayed on it up to
+    ``last_change_id``. Never changed once published, refreshes build a new
+    state, so a reader sees one consistent graph without taking the lock.
+    """
+
+    def __init__(self, snapshot, added=None, removed=None, overlay_size=0, last_change_id=0):
+        self.snapshot = snapshot
+        self.added = added or {}
+        self.removed = removed or {}
+        self.overlay_size = overlay_size
+        self.last_change_id = last_change_id
+
+    def replay(self, changes):
+        """A new state with ``(id, user_id, friend_id, added)`` changes applied in order."""
+        added = {user_id: set(friend_ids) for user_id, friend_ids in self.added.items()}
+        removed = {user_id: set(friend_ids) for user_id, friend_ids in self.removed.items()}
+        overlay_size, last_change_id = self.overlay_size, self.last_change_id
+        for change_id, user_id, friend_id, is_added in changes:
+            for left, right in ((user_id, friend_id), (friend_id, user_id)):
+                added.setdefault(left, set()).discard(right)
+                removed.setdefault(left, set()).discard(right)
+                if is_added != self.snapshot.has_edge(left, right):
+                    (added if is_added else removed)[left].add(right)
+                overlay_size += 1
+            last_change_id = change_id
+        return FriendGraphState(
+            self.snapshot,
+            {user_id: frozenset(friend_ids) for user_id, friend_ids in added.items() if friend_ids},
+            {user_id: frozenset(friend_ids) for user_id, friend_ids in removed.items() if friend_ids},
+            overlay_size, last_change_id,
+        )
+
+    def compact(self):
+        """A new state with the overlay folded into the snapshot."""
+        adjacency = defaultdict(set, self.snapshot.adjacency())
+        for user_id, friend_ids in self.added.items():
+            adjacency[user_id] |= friend_ids
+        for user_id, friend_ids in self.removed.items():
+            adjacency[user_id] -= friend_ids
+        return FriendGraphState(FriendGraphSnapshot(adjacency), last_change_id=self.last_change_id)
+
+    def friends(self, user_id):
+        friend_ids = self.snapshot.friends(user_id)
+        added, removed = self.added.get(user_id), self.removed.get(user_id)
+        if not added and not removed:
+            return friend_ids
+        return sorted((set(friend_ids) - (removed or set())) | (added or set()))
+
+    def are_friends(self, user_id, friend_id):
+        if friend_id in self.added.get(user_id, ()):
+            return True
+        if friend_id in self.removed.get(user_id, ()):
+            return False
+        return self.snapshot.has_edge(user_id, friend_id)
+
+    def degree(self, user_id):
+        return (self.snapshot.degree(user_id)
+                + len(self.added.get(user_id, ()))
+                - len(self.removed.get(user_id, ())))
+
+
+class FriendGraph:
+    """
+    Per-process friendship graph. A CSR snapshot is loaded once, then kept
+    current by replaying FriendshipChange rows into a small add/remove overlay
+    every FRIEND_GRAPH_REFRESH_SECONDS; the overlay is folded into a new
+    snapshot when it grows past FRIEND_GRAPH_MAX_OVERLAY. The snapshot is
+    read again from the friend rows every FRIEND_GRAPH_RELOAD_SECONDS, which
+    picks up changes committed after a higher id was replayed, and when the
+    graph was left idle for longer than the change log is kept.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._refreshed_at = 0.0
+        self._loaded_at = 0.0
+
+    def _load(self):
+        last_change_id = FriendshipChange.objects.aggregate(last=Max('id'))['last'] or 0
+        edges = UserProfile.friends.through.objects.filter(
+            from_userprofile__user__isnull=False, to_userprofile__user__isnull=False,
+        ).values_list('from_userprofile__user_id', 'to_userprofile__user_id')
+        # Changes committed while the edges were read are replayed again, which is harmless
+        return FriendGraphState(FriendGraphSnapshot.from_edges(edges.iterator()), last_change_id=last_change_id)
+
+    def refresh(self, force=False):
+        """Replay new friendship changes, at most once per refresh interval unless forced."""
+        now = time.monotonic()
+        state = self._state
+        if not force and state is not None \
+                and now - self._refreshed_at < settings.FRIEND_GRAPH_REFRESH_SECONDS:
+            return
+        with self._lock:
+            if not force and self._state is not state:
+                # Another thread refreshed while this one waited
+                return
+            if self._state is None or now - self._loaded_at > settings.FRIEND_GRAPH_RELOAD_SECONDS \
+                    or now - self._refreshed_at > settings.FRIEND_GRAPH_CHANGE_RETENTION_HOURS * 3600:
+                state = self._load()
+                self._loaded_at = now
+            else:
+                changes = list(FriendshipChange.objects.filter(id__gt=self._state.last_change_id)
+                               .order_by('id').values_list('id', 'user_id', 'friend_id', 'added'))
+                state = self._state.replay(changes) if changes else self._state
+                if state.overlay_size > settings.FRIEND_GRAPH_MAX_OVERLAY:
+                    state = state.compact()
+            self._state = state
+            self._refreshed_at = now
+
+    def state(self):
+        """The current FriendGraphState, to answer several questions from the same graph."""
+        self.refresh()
+        return self._state
+
+    def friends(self, user_id):
+        """Sorted user ids of ``user_id``'s friends."""
+        return self.state().friends(user_id)
+
+    def are_friends(self, user_id, friend_id):
+        return self.state().are_friends(user_id, friend_id)
+
+    def degree(self, user_id):
+        return self.state().degree(user_id)
+
+    def mutual_friends(self, user_id, other_id):
+        """Sorted user ids of the friends ``user_id`` and ``other_id`` have in common."""
+        state = self.state()
+        return _sorted_intersection(state.friends(user_id), state.friends(other_id))
+
+    def friends_of_friends(self, user_id):
+        """User ids two hops from ``user_id`` that are not already their friends."""
+        state = self.state()
+        friend_ids = state.friends(user_id)
+        result = set()
+        for friend_id in friend_ids:
+            result.update(state.friends(friend_id))
+        result.difference_update(friend_ids)
+        result.discard(user_id)
+        return result
+
+
+friend_graph = FriendGraph()
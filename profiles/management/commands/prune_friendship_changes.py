@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from profiles.models import FriendshipChange
+
+
+class Command(BaseCommand):
+    help = 'Delete the friendship changes older than FRIEND_GRAPH_CHANGE_RETENTION_HOURS.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=settings.FRIEND_GRAPH_CHANGE_RETENTION_HOURS)
+        deleted, _ = FriendshipChange.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} friendship change(s)'))
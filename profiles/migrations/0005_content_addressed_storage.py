@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:52
+
+import images.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0004_friendsuggestion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='avatar',
+            field=models.ImageField(blank=True, max_length=255, null=True, storage=images.storage.get_content_storage, upload_to='avatars'),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='avatar_thumbnail',
+            field=models.ImageField(blank=True, max_length=255, null=True, storage=images.storage.get_content_storage, upload_to='avatars_tumbnails'),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='cover',
+            field=models.ImageField(blank=True, max_length=255, null=True, storage=images.storage.get_content_storage, upload_to='covers'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Give UserProfile.favorite_posts an explicit through model over the table
+    the plain many-to-many created, keeping its rows, then add favorited_at.
+    """
+
+    dependencies = [
+        ('posts', '0014_clientaction'),
+        ('profiles', '0006_media_file_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='FavoritePost',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to='posts.post')),
+                        ('userprofile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='profiles.userprofile')),
+                    ],
+                    options={
+                        'db_table': 'profiles_userprofile_favorite_posts',
+                        'unique_together': {('userprofile', 'post')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='userprofile',
+                    name='favorite_posts',
+                    field=models.ManyToManyField(blank=True, related_name='favorited_by', through='profiles.FavoritePost', to='posts.post'),
+                ),
+            ],
+        ),
+        # Rows favorited before now share the migration time, the feed orders them by post id
+        migrations.AddField(
+            model_name='favoritepost',
+            name='favorited_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='favoritepost',
+            index=models.Index(fields=['userprofile', 'favorited_at', 'post'], name='favorite_post_feed_idx'),
+        ),
+    ]
@@ -1,40 +1,86 @@
-from io import BytesIO
-from PIL import Image
+from django.contrib.contenttypes.fields import GenericRelation
 from django.db import models
 from django.conf import settings
+from images.storage import get_content_storage
+from images.tasks import enqueue_profile_variants
+from images.tracking import FileChangeTrackingModel
 from posts.models import Audience, Post
 
-from django.core.files.uploadedfile import InMemoryUploadedFile
-import sys
-
 User = settings.AUTH_USER_MODEL
 
 
-class UserProfile(models.Model):
+class UserProfile(FileChangeTrackingModel):
     user = models.OneToOneField(User, null=True,
                                 on_delete=models.CASCADE)
     avatar = models.ImageField(
-        upload_to='avatars', blank=True, null=True, max_length=255)
+        upload_to='avatars', blank=True, null=True, max_length=255, storage=get_content_storage, db_index=True)
     cover = models.ImageField(
-        upload_to='covers', blank=True, null=True, max_length=255)
+        upload_to='covers', blank=True, null=True, max_length=255, storage=get_content_storage, db_index=True)
     avatar_thumbnail = models.ImageField(
-        upload_to='avatars_tumbnails', blank=True, null=True, max_length=255)
+        upload_to='avatars_tumbnails', blank=True, null=True, max_length=255, storage=get_content_storage, db_index=True)
     friends = models.ManyToManyField('self',  blank=True)
     default_audience = models.IntegerField(default=1)
     default_custom_audience = models.ForeignKey(Audience, null=True, blank=True, on_delete=models.SET_NULL)
-    favorite_posts = models.ManyToManyField(Post, blank=True, related_name='favorited_by')
+    favorite_posts = models.ManyToManyField(
+        Post, blank=True, related_name='favorited_by', through='FavoritePost')
   
+    variants = GenericRelation('images.ImageVariant')
+
+    tracked_file_fields = ('avatar', 'cover')
+    worker_fields = ('avatar_thumbnail',)
+
     def save(self, **kwargs):
-        if (self.avatar):
-            output_size = (100, 100)
-            output_thumb = BytesIO()
-            img = Image.open(self.avatar)
-            img_name = self.avatar.name.split('.')[0]
-
-            if img.height > 100 or img.width > 100:
-                img.thumbnail(output_size)
-                img.save(output_thumb, format='PNG', quality=90)
-
-            self.avatar_thumbnail = InMemoryUploadedFile(
-                output_thumb, 'ImageField', f"{img_name}_thumb.jpg", 'image/jpeg', sys.getsizeof(output_thumb), None)
-        super(UserProfile, self).save()
+        # Audience and favorites edits leave the images alone and never reach the workers
+        changed = self.changed_file_fields()
+        if 'avatar' in changed:
+            # Rendered again with the avatar variants by images.tasks
+            self.avatar_thumbnail = None
+        self.save_tracked(changed, **kwargs)
+        if changed:
+            enqueue_profile_variants(self.pk, changed)
+
+
+class FavoritePost(models.Model):
+    """
+    A post in a user's favorites, the through row of UserProfile.favorite_posts
+    kept in the table the plain many-to-many created. Toggled by
+    posts.favorites, the favorites feed pages through it newest first.
+    """
+    userprofile = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='favorites')
+    favorited_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'profiles_userprofile_favorite_posts'
+        unique_together = ('userprofile', 'post',)
+        indexes = [
+            models.Index(fields=['userprofile', 'favorited_at', 'post'], name='favorite_post_feed_idx'),
+        ]
+
+
+class FriendshipChange(models.Model):
+    """
+    Append-only log of friendship edits, replayed by profiles.graph to stay
+    current. Rows outlive the users they name, so the friendships a deleted
+    profile took along are logged as removed like any other.
+    """
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    friend = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    added = models.BooleanField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class FriendSuggestion(models.Model):
+    """A "people you may know" entry, computed offline by compute_friend_suggestions."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friend_suggestions')
+    suggested = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    mutual_friends_count = models.IntegerField(default=0)
+    co_tagged_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'suggested',)
+        indexes = [
+            models.Index(fields=['user', '-score'], name='suggestion_user_score_idx'),
+        ]
@@ -3,7 +3,9 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth.hashers import make_password
-from profiles.models import UserProfile
+from images.variants import srcset
+from profiles.graph import friend_graph
+from profiles.models import FriendSuggestion, UserProfile
 from rest_framework.validators import UniqueValidator
 
 
@@ -60,9 +62,19 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         return super(UserRegisterSerializer, self).create(validated_data)
 
 
+class ProfileVariantsMixin:
+    """Avatar and cover variants for responsive clients, see images.variants."""
+
+    def get_avatar_variants(self, obj):
+        return srcset(obj, "avatar", self.context.get("request"))
+
+    def get_cover_variants(self, obj):
+        return srcset(obj, "cover", self.context.get("request"))
+
+
 # PROFILE
 # FOR CREATE AND UPDATE
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(ProfileVariantsMixin, serializers.ModelSerializer):
     avatar = serializers.ImageField(
         required=False, max_length=None, allow_empty_file=True
     )
@@ -70,6 +82,8 @@ class UserProfileSerializer(serializers.ModelSerializer):
     cover = serializers.ImageField(
         required=False, max_length=None, allow_empty_file=True
     )
+    avatar_variants = serializers.SerializerMethodField()
+    cover_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
@@ -77,17 +91,33 @@ class UserProfileSerializer(serializers.ModelSerializer):
             "avatar",
             "avatar_thumbnail",
             "cover",
+            "avatar_variants",
+            "cover_variants",
         ]
 
 
+class MutualFriendsCountMixin:
+    """Mutual friends between the profile and the requesting user, from the in-memory friend graph."""
+
+    def get_mutual_friends_count(self, obj):
+        request = self.context.get("request")
+        if request is None or not request.user.is_authenticated or obj.user_id is None:
+            return None
+        if request.user.id == obj.user_id:
+            return None
+        return len(friend_graph.mutual_friends(request.user.id, obj.user_id))
+
+
 # FOR FRIENDS
-class UserProfileFriendsInlineSerializer(serializers.ModelSerializer):
+class UserProfileFriendsInlineSerializer(MutualFriendsCountMixin, serializers.ModelSerializer):
     user = UserPublicSerializer(many=False, read_only=True)
+    mutual_friends_count = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
         fields = [
             "user",
+            "mutual_friends_count",
         ]
 
 
@@ -113,10 +143,12 @@ class UserProfileAudienceSerializer(serializers.ModelSerializer):
 
 
 # FOR MY PROFILE
-class MyProfileSerializer(serializers.ModelSerializer):
+class MyProfileSerializer(ProfileVariantsMixin, serializers.ModelSerializer):
     user = UserPublicSerializer()
     friends = UserProfileFriendsInlineSerializer(many=True, read_only=True)
     friends_count = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
+    cover_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
@@ -126,16 +158,22 @@ class MyProfileSerializer(serializers.ModelSerializer):
             "default_custom_audience",
             "friends",
             "friends_count",
+            "avatar_variants",
+            "cover_variants",
         ]
 
     def get_friends_count(self, obj):
+        # Counted from the same rows as ``friends``
         return obj.friends.count()
 
 
-class UserProfileDetailsSerializer(serializers.ModelSerializer):
+class UserProfileDetailsSerializer(MutualFriendsCountMixin, ProfileVariantsMixin, serializers.ModelSerializer):
     user = UserPublicSerializer()
     friends = UserProfileFriendsInlineSerializer(many=True, read_only=True)
     friends_count = serializers.SerializerMethodField()
+    mutual_friends_count = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
+    cover_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
@@ -143,7 +181,24 @@ class UserProfileDetailsSerializer(serializers.ModelSerializer):
             "user",
             "friends",
             "friends_count",
+            "mutual_friends_count",
+            "avatar_variants",
+            "cover_variants",
         ]
 
     def get_friends_count(self, obj):
+        # Counted from the same rows as ``friends``
         return obj.friends.count()
+
+
+# PEOPLE YOU MAY KNOW
+class FriendSuggestionSerializer(serializers.ModelSerializer):
+    user = UserPublicSerializer(source="suggested", read_only=True)
+
+    class Meta:
+        model = FriendSuggestion
+        fields = [
+            "user",
+            "mutual_friends_count",
+            "co_tagged_count",
+        ]
@@ -0,0 +1,35 @@
+from django.db.models.signals import m2m_changed, pre_delete
+from django.dispatch import receiver
+
+from .models import FriendshipChange, UserProfile
+
+
+@receiver(m2m_changed, sender=UserProfile.friends.through)
+def log_friendship_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # The cleared friends are gone by post_clear, remember them
+        instance._cleared_friend_profile_ids = set(instance.friends.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear') or instance.user_id is None:
+        return
+
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_friend_profile_ids', set())
+    friend_user_ids = UserProfile.objects.filter(
+        pk__in=pk_set, user__isnull=False).values_list('user_id', flat=True)
+    FriendshipChange.objects.bulk_create([
+        FriendshipChange(user_id=instance.user_id, friend_id=friend_id, added=action == 'post_add')
+        for friend_id in friend_user_ids
+    ])
+
+
+@receiver(pre_delete, sender=UserProfile)
+def log_deleted_profile_friendships(sender, instance, **kwargs):
+    # The friend rows go with the profile without an m2m_changed signal
+    if instance.user_id is None:
+        return
+    friend_user_ids = instance.friends.filter(user__isnull=False).values_list('user_id', flat=True)
+    FriendshipChange.objects.bulk_create([
+        FriendshipChange(user_id=instance.user_id, friend_id=friend_id, added=False)
+        for friend_id in friend_user_ids
+    ])
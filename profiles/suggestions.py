@@ -0,0 +1,134 @@
+import numpy as np
+from scipy import sparse
+
+from django.db import transaction
+
+from images.models import TaggedFriend
+from posts.models import Post
+from .models import FriendSuggestion, UserProfile
+
+
+class UserIndex:
+    """Maps sparse user ids to the dense 0..n-1 row numbers of the matrices."""
+
+    def __init__(self, user_ids):
+        self.user_ids = np.unique(np.asarray(user_ids, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def rows(self, user_ids):
+        return np.searchsorted(self.user_ids, np.asarray(user_ids, dtype=np.int64))
+
+
+def _pairs(queryset):
+    pairs = np.fromiter(
+        (value for pair in queryset.iterator(chunk_size=10000) for value in pair),
+        dtype=np.int64,
+    )
+    return pairs.reshape(-1, 2)
+
+
+def load_friendships():
+    """(n, 2) array of user id pairs, one row per friendship direction."""
+    return _pairs(UserProfile.friends.through.objects.filter(
+        from_userprofile__user__isnull=False, to_userprofile__user__isnull=False,
+    ).values_list('from_userprofile__user_id', 'to_userprofile__user_id'))
+
+
+def load_tag_memberships():
+    """
+    (n, 2) array of (item, user id) pairs, where an item is a post or an image
+    with tagged users and its members are its author and those users.
+    """
+    post_authors = _pairs(Post.tagged_friends.through.objects.values_list('post_id', 'post__user_id').distinct())
+    post_tags = _pairs(Post.tagged_friends.through.objects.values_list('post_id', 'user_id'))
+    image_authors = _pairs(TaggedFriend.objects.filter(image__user__isnull=False)
+                           .values_list('image_id', 'image__user_id').distinct())
+    image_tags = _pairs(TaggedFriend.objects.values_list('image_id', 'user_id'))
+
+    # Shift image ids past the post ids so both share one item axis
+    image_offset = post_tags[:, 0].max(initial=0) + 1
+    return np.concatenate([
+        post_authors,
+        post_tags,
+        image_authors + [image_offset, 0],
+        image_tags + [image_offset, 0],
+    ])
+
+
+def build_matrices(friendships, memberships):
+    """The binary friendship adjacency (users x users) and tag incidence (users x items)."""
+    index = UserIndex(np.concatenate([friendships.ravel(), memberships[:, 1]]))
+    n = len(index)
+
+    adjacency = sparse.csr_matrix(
+        (np.ones(len(friendships), dtype=np.int32),
+         (index.rows(friendships[:, 0]), index.rows(friendships[:, 1]))),
+        shape=(n, n),
+    )
+    adjacency.data[:] = 1  # collapse duplicate rows
+
+    items, item_columns = np.unique(memberships[:, 0], return_inverse=True)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(memberships), dtype=np.int32), (index.rows(memberships[:, 1]), item_columns)),
+        shape=(n, len(items)),
+    )
+    incidence.data[:] = 1
+    return index, adjacency, incidence
+
+
+def _row_values(matrix, offset, columns):
+    start, end = matrix.indptr[offset], matrix.indptr[offset + 1]
+    values = dict(zip(matrix.indices[start:end].tolist(), matrix.data[start:end].tolist()))
+    return [values.get(column, 0) for column in columns.tolist()]
+
+
+def rank_chunk(rows, adjacency, incidence, tag_weight, per_user):
+    """
+    Score the candidates of ``rows``: mutual friends come from squaring the
+    adjacency, co-tagging from the incidence times its transpose. Self and
+    existing friends are dropped and the best ``per_user`` kept per row.
+    """
+    n = adjacency.shape[0]
+    known = adjacency[rows] + sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (np.arange(len(rows)), rows)), shape=(len(rows), n))
+
+    def unknown_only(matrix):
+        matrix = (matrix - matrix.multiply(known)).tocsr()
+        matrix.eliminate_zeros()
+        return matrix
+
+    mutual = unknown_only(adjacency[rows] @ adjacency)
+    co_tagged = unknown_only(incidence[rows] @ incidence.T)
+    scores = (mutual + co_tagged * tag_weight).tocsr()
+
+    for offset, row in enumerate(rows):
+        start, end = scores.indptr[offset], scores.indptr[offset + 1]
+        columns, values = scores.indices[start:end], scores.data[start:end]
+        if len(values) > per_user:
+            best = np.argpartition(-values, per_user - 1)[:per_user]
+            columns, values = columns[best], values[best]
+        yield (row, columns, values,
+               _row_values(mutual, offset, columns),
+               _row_values(co_tagged, offset, columns))
+
+
+def store_suggestions(index, ranked):
+    """Replace the stored suggestions of the ranked users."""
+    user_ids, suggestions = [], []
+    for row, columns, values, mutual, co_tagged in ranked:
+        user_id = int(index.user_ids[row])
+        user_ids.append(user_id)
+        for column, score, mutual_count, co_tagged_count in zip(columns, values, mutual, co_tagged):
+            suggestions.append(FriendSuggestion(
+                user_id=user_id,
+                suggested_id=int(index.user_ids[column]),
+                score=float(score),
+                mutual_friends_count=int(mutual_count),
+                co_tagged_count=int(co_tagged_count),
+            ))
+    with transaction.atomic():
+        FriendSuggestion.objects.filter(user_id__in=user_ids).delete()
+        FriendSuggestion.objects.bulk_create(suggestions, batch_size=2000)
+    return len(suggestions)
@@ -1,3 +1,203 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .graph import FriendGraph, FriendGraphSnapshot
+from .models import FriendshipChange, FriendSuggestion, UserProfile
+from .serializers import UserProfileDetailsSerializer
+from .suggestions import build_matrices, rank_chunk
+
+
+def create_user(username):
+    user = User.objects.create(username=username)
+    UserProfile.objects.create(user=user)
+    return user
+
+
+class FriendGraphSnapshotTests(TestCase):
+
+    def test_csr_lookups(self):
+        snapshot = FriendGraphSnapshot.from_edges([(1, 3), (1, 2), (2, 3), (5, 1)])
+        self.assertEqual(list(snapshot.friends(1)), [2, 3, 5])
+        self.assertEqual(list(snapshot.friends(5)), [1])
+        self.assertEqual(list(snapshot.friends(4)), [])
+        self.assertTrue(snapshot.has_edge(3, 2))
+        self.assertFalse(snapshot.has_edge(3, 5))
+        self.assertFalse(snapshot.has_edge(4, 1))
+        self.assertEqual(snapshot.degree(1), 3)
+        self.assertEqual(snapshot.degree(4), 0)
+        self.assertEqual(snapshot.adjacency(), {1: {2, 3, 5}, 2: {1, 3}, 3: {1, 2}, 5: {1}})
+
+
+@override_settings(FRIEND_GRAPH_REFRESH_SECONDS=0)
+class FriendGraphTests(TestCase):
+    """The graph follows friendship edits through the change log, folding them into a new snapshot."""
+
+    def setUp(self):
+        self.users = [create_user(f'user{index}') for index in range(4)]
+        self.ids = [user.id for user in self.users]
+        self.befriend(0, 1)
+        self.graph = FriendGraph()
+
+    def befriend(self, user, friend):
+        self.users[user].userprofile.friends.add(self.users[friend].userprofile)
+
+    def test_overlay_replays_add_remove_and_clear(self):
+        a, b, c, d = self.ids
+        self.assertEqual(list(self.graph.friends(a)), [b])
+        snapshot = self.graph.state().snapshot
+
+        self.befriend(0, 2)
+        self.befriend(2, 3)
+        self.assertEqual(list(self.graph.friends(a)), [b, c])
+        self.assertEqual(list(self.graph.friends(c)), [a, d])
+        self.assertTrue(self.graph.are_friends(d, c))
+        self.assertEqual(self.graph.degree(c), 2)
+        self.assertEqual(self.graph.mutual_friends(a, d), [c])
+        self.assertEqual(self.graph.friends_of_friends(a), {d})
+        self.assertIs(self.graph.state().snapshot, snapshot)
+
+        self.users[0].userprofile.friends.remove(self.users[1].userprofile)
+        self.assertFalse(self.graph.are_friends(b, a))
+        self.assertEqual(self.graph.degree(a), 1)
+
+        self.users[2].userprofile.friends.clear()
+        self.assertEqual(list(self.graph.friends(c)), [])
+        self.assertEqual(list(self.graph.friends(a)), [])
+        self.assertEqual(self.graph.degree(d), 0)
+
+        # Adding back an edge of the snapshot leaves nothing in the overlay
+        self.befriend(1, 0)
+        state = self.graph.state()
+        self.assertTrue(state.are_friends(a, b))
+        self.assertNotIn(a, state.added)
+        self.assertNotIn(a, state.removed)
+
+    def test_published_states_are_not_changed(self):
+        a, b, c, _ = self.ids
+        before = self.graph.state()
+        self.befriend(0, 2)
+        self.assertEqual(list(self.graph.friends(a)), [b, c])
+        self.assertEqual(list(before.friends(a)), [b])
+        self.assertFalse(before.are_friends(a, c))
+
+    @override_settings(FRIEND_GRAPH_MAX_OVERLAY=2)
+    def test_overlay_is_compacted_into_a_new_snapshot(self):
+        a, b, c, d = self.ids
+        snapshot = self.graph.state().snapshot
+        self.befriend(2, 3)
+        self.befriend(0, 2)
+        state = self.graph.state()
+        self.assertIsNot(state.snapshot, snapshot)
+        self.assertEqual((state.added, state.removed, state.overlay_size), ({}, {}, 0))
+        self.assertEqual(list(state.snapshot.friends(c)), [a, d])
+        self.assertEqual(state.last_change_id, FriendshipChange.objects.latest('id').id)
+
+    def test_idle_graph_reloads_after_changes_are_pruned(self):
+        a, _, c, _ = self.ids
+        self.graph.refresh()
+        self.befriend(0, 2)
+        FriendshipChange.objects.update(created_at=timezone.now() - timedelta(hours=25))
+        out = StringIO()
+        call_command('prune_friendship_changes', stdout=out)
+        self.assertIn('Deleted 2', out.getvalue())
+        self.assertFalse(FriendshipChange.objects.exists())
+
+        # The pruned change cannot be replayed, a day-idle graph reads the edges again
+        with mock.patch('profiles.graph.time.monotonic', return_value=self.graph._refreshed_at + 25 * 3600):
+            self.assertEqual(list(self.graph.friends(c)), [a])
+
+    def test_deleted_profiles_leave_the_graph(self):
+        a, b, c, _ = self.ids
+        self.befriend(2, 1)
+        self.graph.refresh()
+        self.users[1].userprofile.delete()
+        self.assertEqual(list(self.graph.friends(a)), [])
+        self.assertEqual(list(self.graph.friends(c)), [])
+
+        self.befriend(0, 2)
+        self.users[2].delete()
+        self.assertEqual(list(self.graph.friends(a)), [])
+        self.assertEqual(self.graph.degree(c), 0)
+
+    def test_graph_reloads_changes_it_replayed_past(self):
+        a, b, c, _ = self.ids
+        self.graph.refresh()
+        # A friendship whose change committed below an id already replayed
+        UserProfile.friends.through.objects.bulk_create([
+            UserProfile.friends.through(from_userprofile=self.users[0].userprofile,
+                                        to_userprofile=self.users[2].userprofile),
+            UserProfile.friends.through(from_userprofile=self.users[2].userprofile,
+                                        to_userprofile=self.users[0].userprofile),
+        ])
+        self.assertEqual(list(self.graph.friends(a)), [b])
+        with mock.patch('profiles.graph.time.monotonic', return_value=self.graph._loaded_at + 601):
+            self.assertEqual(list(self.graph.friends(a)), [b, c])
+
+
+class FriendSuggestionRankingTests(TestCase):
+    """
+    User 1 has friends 2 and 4, who share friend 3; 6 is a friend of 2 and
+    tagged with 1 once; 5 is tagged with 1 twice.
+    """
+    FRIENDSHIPS = [(1, 2), (2, 3), (1, 4), (4, 3), (2, 6)]
+    MEMBERSHIPS = [(10, 1), (10, 5), (11, 1), (11, 5), (12, 1), (12, 2), (13, 1), (13, 6)]
+
+    def rank(self, per_user):
+        friendships = np.array(self.FRIENDSHIPS + [(friend, user) for user, friend in self.FRIENDSHIPS])
+        index, adjacency, incidence = build_matrices(friendships, np.array(self.MEMBERSHIPS))
+        rows = index.rows([1])
+        [(row, columns, values, mutual, co_tagged)] = rank_chunk(rows, adjacency, incidence, 0.5, per_user)
+        self.assertEqual(index.user_ids[row], 1)
+        suggested = index.user_ids[columns].tolist()
+        return {user_id: (score, mutual_count, co_tagged_count) for user_id, score, mutual_count, co_tagged_count
+                in zip(suggested, values.tolist(), mutual, co_tagged)}
+
+    def test_build_matrices_collapses_duplicates(self):
+        friendships = np.array([(1, 2), (2, 1), (1, 2)])
+        index, adjacency, incidence = build_matrices(friendships, np.array([(7, 2), (7, 2)]))
+        self.assertEqual(index.user_ids.tolist(), [1, 2])
+        self.assertEqual(adjacency.toarray().tolist(), [[0, 1], [1, 0]])
+        self.assertEqual(incidence.toarray().tolist(), [[0], [1]])
+
+    def test_scores_mutual_friends_and_co_tags_without_self_and_friends(self):
+        self.assertEqual(self.rank(per_user=10), {3: (2, 2, 0), 5: (1, 0, 2), 6: (1.5, 1, 1)})
+
+    def test_keeps_the_best_per_user(self):
+        self.assertEqual(set(self.rank(per_user=2)), {3, 6})
+
+
+class ProfileSerializerTests(TestCase):
+
+    def test_friends_count_matches_the_friends_listed(self):
+        user, friend = create_user('user'), create_user('friend')
+        user.userprofile.friends.add(friend.userprofile, UserProfile.objects.create())
+        client = APIClient()
+        client.force_authenticate(user)
+        for url in ('/api/me', f'/api/profiles/user/{user.id}/'):
+            response = client.get(url)
+            self.assertEqual(response.data['friends_count'], len(response.data['friends']))
+        self.assertEqual(UserProfileDetailsSerializer(UserProfile.objects.create()).data['friends_count'], 0)
+
+
+class FriendSuggestionListTests(TestCase):
+
+    def test_current_friends_are_excluded_before_paging(self):
+        user, friend, other = (create_user(name) for name in ('user', 'friend', 'other'))
+        FriendSuggestion.objects.create(user=user, suggested=friend, score=2)
+        FriendSuggestion.objects.create(user=user, suggested=other, score=1)
+        # Excluded right away, before the feeds catch up after the commit
+        user.userprofile.friends.add(friend.userprofile)
+
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/profiles/suggestions/', {'limit': 1})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual([suggestion['user']['id'] for suggestion in response.data['results']], [other.id])
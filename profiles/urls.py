@@ -15,6 +15,7 @@ urlpatterns = [
     path("me", views.MyProfileRetrieveView.as_view()),
     path("profiles/user/<int:user_id>/", views.UserProfileRetrieveView.as_view()),
     path("profiles/friends/<int:user>/", views.FriendsListView.as_view()),
+    path("profiles/suggestions/", views.FriendSuggestionListView.as_view()),
     path(
         "profiles/<int:user>/audience/", views.AudienceUpdateRetrieveAPIView.as_view()
     ),
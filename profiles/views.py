@@ -3,9 +3,10 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 
 from django.contrib.auth.models import User
+from django.db.models import Exists, OuterRef
 from posts.models import Audience
-from .models import UserProfile
-from .serializers import UserRegisterSerializer
+from .models import FriendSuggestion, UserProfile
+from .serializers import UserRegisterSerializer, FriendSuggestionSerializer
 from .serializers import UserProfileSerializer, UserProfileFriendsSerializer
 from .serializers import (
     UserProfileAudienceSerializer,
@@ -60,6 +61,19 @@ class FriendsListView(generics.RetrieveAPIView):
         return Response(serializer.data)
 
 
+class FriendSuggestionListView(generics.ListAPIView):
+    serializer_class = FriendSuggestionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        # Precomputed offline by the compute_friend_suggestions command, without
+        # the people who became friends since, before the page is cut
+        befriended = UserProfile.friends.through.objects.filter(
+            from_userprofile__user_id=OuterRef("user_id"), to_userprofile__user_id=OuterRef("suggested_id"))
+        return FriendSuggestion.objects.filter(user=self.request.user).exclude(
+            Exists(befriended)).select_related("suggested__userprofile").order_by("-score", "suggested_id")
+
+
 class AudienceUpdateRetrieveAPIView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [OwnerPermission]
     serializer_class = UserProfileAudienceSerializer
@@ -106,6 +106,109 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     "PAGE_SIZE": 10
 }
+
+# Friendship changes (posts.tasks): a background thread in each web process
+# applies them to the visibility index and timelines after the request,
+# 0 applies them in the request once it commits
+FEED_UPDATE_WORKERS = 1
+
+# Home timeline (posts.timeline)
+# Entries kept per user, older ones are trimmed on fan-out
+TIMELINE_MAX_ENTRIES = 800
+# A fan-out trims about one in this many of its timelines, which may run this far over the cap
+TIMELINE_TRIM_EVERY = 50
+# Authors with more friends than this are not fanned out, their posts are pulled at read time
+TIMELINE_FANOUT_LIMIT = 2000
+# Posts copied into a timeline when a new friendship is made
+TIMELINE_BACKFILL_POSTS = 20
+
+# Reaction counters (posts.reactions)
+# Write-behind: taps journal their count changes instead of updating the
+# aggregate and counter rows, which a flusher thread per web process (or the
+# flush_reaction_journal command) applies in batches; reads add the pending ones
+REACTION_WRITE_BEHIND = False
+# Milliseconds between flushes, 0 leaves the journal to flush_reaction_journal
+REACTION_FLUSH_INTERVAL_MS = 500
+# Taps in a process that wake its flusher before the interval is up
+REACTION_FLUSH_EVENTS = 500
+# Most journal rows applied per flush transaction
+REACTION_FLUSH_BATCH = 5000
+
+# Offline-sync bulk actions (posts.bulk_actions)
+# Most actions one request replays
+BULK_ACTIONS_MAX = 100
+# Results kept for retries of the same action ids, clear_client_actions removes older ones
+BULK_ACTION_EXPIRY_HOURS = 72
+
+# Friend graph snapshot (profiles.graph)
+# Seconds between polls of the friendship change log
+FRIEND_GRAPH_REFRESH_SECONDS = 5
+# Pending changes merged into a fresh snapshot once the overlay grows past this
+FRIEND_GRAPH_MAX_OVERLAY = 10000
+# Seconds between full reloads of the snapshot from the friend rows, which pick up
+# changes replayed past while their transaction was still open
+FRIEND_GRAPH_RELOAD_SECONDS = 600
+# Friendship changes kept for the graphs to replay, prune_friendship_changes removes older
+# ones; a graph idle for longer than this reloads its snapshot
+FRIEND_GRAPH_CHANGE_RETENTION_HOURS = 24
+
+# Thumbnail pipeline (images.tasks)
+# Background threads rendering thumbnails in each web process, 0 leaves
+# uploads pending for the process_thumbnails command
+THUMBNAIL_WORKERS = 2
+# Bounding boxes by displayed aspect ratio (width / height): the first bucket
+# whose minimum ratio is reached applies, 9999 leaves that side unconstrained
+THUMBNAIL_BUCKETS = [
+    (1.8, (9999, 400)),  # panoramas
+    (1.2, (750, 9999)),  # landscape
+    (0.8, (9999, 400)),  # square-ish
+    (0, (400, 9999)),  # portrait
+]
+# Responsive variants (images.variants): widths rendered per image field and
+# the formats each width is encoded in, formats Pillow cannot encode are skipped
+IMAGE_VARIANT_WIDTHS = {
+    'image': [320, 640, 1080, 2048],
+    'avatar': [100, 200, 400],
+    'cover': [640, 1080, 2048],
+}
+IMAGE_VARIANT_FORMATS = ['WEBP', 'AVIF']
+# Box of the square avatar thumbnail rendered with the avatar variants
+AVATAR_THUMBNAIL_BOX = (100, 100)
+
+# Content-addressed media (images.storage): image, video, avatar and cover
+# files and their renditions are stored once under this MEDIA_ROOT folder
+CONTENT_ADDRESSED_ROOT = 'content'
+# Media responses (images.media): None streams files from Django,
+# 'x-accel-redirect' hands them to nginx at MEDIA_ACCEL_PREFIX (an internal
+# location aliased to MEDIA_ROOT), 'x-sendfile' to Apache or lighttpd
+MEDIA_ACCEL_MODE = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Media URLs rendered for signed-in viewers carry an HMAC of the file, the
+# viewer and an expiry, the credential <img> and <video> requests can send.
+# They stay valid between one and two of these periods and do not change
+# within one, so browsers keep their cached copies
+MEDIA_URL_SIGNATURE_PERIOD = 3600
+
+# Justified image layouts of posts (posts.layout): target row height in
+# pixels per viewport width, rows are capped at MAX_ROW_SCALE times it
+POST_LAYOUT_ROW_HEIGHTS = {360: 180, 600: 240, 1080: 320}
+POST_LAYOUT_GAP = 4
+POST_LAYOUT_MAX_ROW_SCALE = 2
+
+# Batch uploads (images.batch)
+# Processes decoding the files of a batch upload in parallel, 0 leaves them to the thumbnail workers.
+# Each web process starts its own pool, so opt in with a small number
+BATCH_UPLOAD_PROCESSES = 0
+# Most files one batch upload accepts
+BATCH_UPLOAD_MAX_FILES = 20
+
+# Resumable uploads (images.uploads)
+# Where partial uploads are written, outside MEDIA_ROOT
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'upload_sessions')
+# Largest file a session accepts, in bytes
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+# Sessions untouched for longer are removed by clear_upload_sessions
+CHUNKED_UPLOAD_EXPIRY_HOURS = 24
  
 
 SIMPLE_JWT = {
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+
+from images.views import MediaFileView
 
 
 urlpatterns = [
@@ -9,8 +10,6 @@ urlpatterns = [
     path('api/', include('profiles.urls')),
     path('api/posts/', include('posts.urls')),
     path('api/images/', include('images.urls')),
+    # Access-checked in every environment, see images.media
+    path(settings.MEDIA_URL.lstrip('/') + '<path:name>', MediaFileView.as_view()),
 ]
-
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file